@@ -0,0 +1,259 @@
+"""
+Micro-benchmarks for the hot paths in tfmesh.core.
+
+    python -m benchmarks.micro run --save baseline.json
+    python -m benchmarks.micro compare baseline.json --threshold 0.1
+    python -m benchmarks.micro scaling --parser regex
+
+compare runs the suite again (or reads --current) and fails when any benchmark is slower than the
+baseline by more than the threshold.  scaling times inputs that make the patterns backtrack at two
+sizes and fails when parsing them does not grow linearly.
+
+Timings depend on the machine, so no baseline is committed.  Save one with run --save on the machine
+the comparison will run on, before making a change.
+"""
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import click
+from tfmesh.core import find_dependencies, get_allowed_versions, get_dependency_attributes, get_semantic_version, patterns, pretty_code, sort_versions
+from benchmarks.workspace import get_module_block, write_workspace
+
+DEPENDENCY_PATTERNS = {
+    "terraform": [patterns("TERRAFORM")],
+    "providers": [patterns("PROVIDER")],
+    "modules": [
+        patterns("MODULE_REGISTRY"),
+        patterns("MODULE_GITHUB")
+    ]
+}
+
+ADVERSARIAL_HEADER = 'terraform {\n  required_version = "1.1.3"\n  required_providers {\n    aws = {\n      source = "hashicorp/aws"\n      version = "3.71.0" # ~>3.0\n    }\n  }\n}\n'
+
+# Inputs that make the built-in patterns backtrack, each taking the number of times to repeat its body.
+ADVERSARIAL_INPUTS = {
+    "unclosed objects": lambda n: ADVERSARIAL_HEADER + "locals {\n" + "  a = {\n" * n,
+    "unclosed modules": lambda n: ADVERSARIAL_HEADER + 'module "m" {\n  source = "x"\n' * n,
+    "unclosed providers": lambda n: ADVERSARIAL_HEADER + "terraform {\n  required_providers {\n" + "    aws = {\n" * n,
+    "incomplete providers": lambda n: ADVERSARIAL_HEADER + "terraform {\n  required_providers {\n" + '    aws = {\n      source = "hashicorp/aws"\n' * n + "  }\n}\n",
+    "many modules": lambda n: ADVERSARIAL_HEADER + 'module "m" {\n  source = "hashicorp/consul/aws"\n  version = "0.5.0" # ~>0.5\n}\n' * n,
+}
+
+def get_versions(count, seed=0):
+    """
+    Returns a shuffled list of version strings with some v prefixes, pre-releases and two part versions.
+    """
+    generator = random.Random(seed)
+    versions = []
+
+    for index in range(count):
+        version = f"{generator.randint(0, 5)}.{generator.randint(0, 99)}.{generator.randint(0, 20)}"
+        if index % 10 == 0:
+            version += f"-beta{generator.randint(1, 12)}"
+        elif index % 10 == 1:
+            version = version.rsplit(".", 1)[0]
+        versions.append(f"v{version}" if index % 3 == 0 else version)
+
+    return versions
+
+def benchmark_get_dependency_attributes(folder, parser):
+    files = write_workspace(folder, files=50, blocks_per_file=20, constraints="mixed", pathological=0.1)
+
+    return lambda: get_dependency_attributes(files, DEPENDENCY_PATTERNS, parser)
+
+def benchmark_get_semantic_version(folder):
+    versions = get_versions(1000)
+
+    return lambda: [get_semantic_version(version) for version in versions]
+
+def benchmark_sort_versions(folder):
+    versions = get_versions(2000)
+
+    return lambda: sort_versions(versions)
+
+def benchmark_get_allowed_versions(folder):
+    versions = get_versions(2000)
+
+    return lambda: get_allowed_versions(versions, "1.5.0", ">=", "4.0.0", "<")
+
+def benchmark_pretty_code(folder):
+    blocks = [get_module_block(index, pathological=index % 2 == 0) for index in range(200)]
+
+    return lambda: [pretty_code(block) for block in blocks]
+
+# Each benchmark takes a scratch folder and returns the function to time.
+BENCHMARKS = {
+    "get_dependency_attributes[regex]": lambda folder: benchmark_get_dependency_attributes(folder, "regex"),
+    "get_dependency_attributes[hcl]": lambda folder: benchmark_get_dependency_attributes(folder, "hcl"),
+    "get_semantic_version": benchmark_get_semantic_version,
+    "sort_versions": benchmark_sort_versions,
+    "get_allowed_versions": benchmark_get_allowed_versions,
+    "pretty_code": benchmark_pretty_code,
+}
+
+def run_benchmarks(names=None, repeat=5, min_time=0.2):
+    """
+    Times each benchmark and returns the results, where seconds is the fastest of repeat timings of one call.
+
+    Each timing runs the benchmark enough times to take at least min_time seconds, so short
+    benchmarks are not lost in timer resolution.
+    """
+    results = {}
+
+    for name, setup in BENCHMARKS.items():
+        if names and not any(part in name for part in names):
+            continue
+
+        folder = tempfile.mkdtemp()
+        try:
+            timer = timeit.Timer(setup(folder))
+            number, elapsed = timer.autorange()
+            number = max(1, int(number * min_time / elapsed)) if elapsed < min_time else number
+            seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+        finally:
+            shutil.rmtree(folder)
+
+        results[name] = {"seconds": seconds, "number": number}
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results
+    }
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compares two sets of results and returns a row for each benchmark in both, and the names of the regressions.
+
+    A benchmark has regressed when it is slower than the baseline by more than threshold (0.1 is 10%).
+    """
+    rows = []
+    regressions = []
+
+    for name, result in current["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+
+        change = result["seconds"] / baseline["benchmarks"][name]["seconds"] - 1
+        rows.append((name, baseline["benchmarks"][name]["seconds"], result["seconds"], change))
+        if change > threshold:
+            regressions.append(name)
+
+    return rows, regressions
+
+def measure_scaling(parser="regex", size=5000, factor=4, repeat=3):
+    """
+    Returns how many times longer each adversarial input takes to parse when it is factor times larger.
+
+    Parsing time that grows linearly with the size of a file gives ratios close to factor.
+    """
+    ratios = {}
+
+    for name, generate in ADVERSARIAL_INPUTS.items():
+        seconds = []
+        for contents in [generate(size), generate(size * factor)]:
+            timer = timeit.Timer(lambda: find_dependencies(contents, DEPENDENCY_PATTERNS, parser))
+            seconds.append(min(timer.repeat(repeat=repeat, number=1)))
+        ratios[name] = seconds[1] / seconds[0]
+
+    return ratios
+
+def print_results(results):
+    """
+    Prints the time of one call of each benchmark.
+    """
+    width = max([len(name) for name in results["benchmarks"]] + [9])
+
+    print(f'{"benchmark":<{width}}  {"time":>12}')
+    for name, result in results["benchmarks"].items():
+        print(f'{name:<{width}}  {result["seconds"] * 1000:>9.3f} ms')
+
+@click.group()
+def cli():
+    """
+    Runs micro-benchmarks and compares them to a saved baseline.
+    """
+    pass
+
+@cli.command()
+@click.option("--save", help="A file to save the results to as a baseline.")
+@click.option("--filter", "names", multiple=True, help="Only runs benchmarks whose name contains this text.")
+@click.option("--repeat", default=5, show_default=True, help="The number of timings to take the fastest of.")
+def run(save, names, repeat):
+    """
+    Runs the micro-benchmarks.
+    """
+    results = run_benchmarks(names, repeat)
+    print_results(results)
+
+    if save:
+        with open(save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {save}.")
+
+@cli.command()
+@click.argument("baseline")
+@click.option("--current", help="A file of saved results to compare instead of running the benchmarks again.")
+@click.option("--threshold", default=0.1, show_default=True, help="The slowdown allowed before a benchmark fails (0.1 is 10%).")
+@click.option("--filter", "names", multiple=True, help="Only runs benchmarks whose name contains this text.")
+@click.option("--repeat", default=5, show_default=True, help="The number of timings to take the fastest of.")
+def compare(baseline, current, threshold, names, repeat):
+    """
+    Compares the micro-benchmarks to a BASELINE file and fails on any regression past the threshold.
+    """
+    try:
+        with open(baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        raise click.ClickException(f"There is no baseline at {baseline}.  Baselines are saved per machine, so create one first with `python -m benchmarks.micro run --save {baseline}`.")
+
+    if current:
+        with open(current) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(names, repeat)
+
+    if (baseline.get("python"), baseline.get("platform")) != (current.get("python"), current.get("platform")):
+        print(f'Warning: the baseline was saved with Python {baseline.get("python")} on {baseline.get("platform")}, so the timings may not be comparable.\n')
+
+    rows, regressions = compare_results(baseline, current, threshold)
+    width = max([len(row[0]) for row in rows] + [9])
+
+    print(f'{"benchmark":<{width}}  {"baseline":>12}  {"current":>12}  {"change":>8}')
+    for name, before, after, change in rows:
+        print(f'{name:<{width}}  {before * 1000:>9.3f} ms  {after * 1000:>9.3f} ms  {change:>+8.1%}{"  REGRESSION" if name in regressions else ""}')
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}.")
+        sys.exit(1)
+
+    print(f"\nNo benchmark regressed by more than {threshold:.0%}.")
+
+@cli.command()
+@click.option("--parser", type=click.Choice(["regex", "hcl"]), default="regex", show_default=True, help="The parser to time.")
+@click.option("--size", default=5000, show_default=True, help="The number of repetitions in the smaller input.")
+@click.option("--factor", default=4, show_default=True, help="How many times larger the larger input is.")
+@click.option("--limit", default=8.0, show_default=True, help="The largest ratio of timings allowed before an input fails.")
+def scaling(parser, size, factor, limit):
+    """
+    Checks that inputs which make the patterns backtrack still parse in time linear in their size.
+    """
+    ratios = measure_scaling(parser, size, factor)
+    width = max(len(name) for name in ratios)
+
+    for name, ratio in ratios.items():
+        print(f'{name:<{width}}  {ratio:>6.1f}x{"  NOT LINEAR" if ratio > limit else ""}')
+
+    failures = [name for name, ratio in ratios.items() if ratio > limit]
+    if failures:
+        print(f"\n{len(failures)} input(s) took more than {limit:g} times as long at {factor} times the size.")
+        sys.exit(1)
+
+    print(f"\nEvery input took at most {limit:g} times as long at {factor} times the size.")
+
+if __name__ == "__main__":
+    cli()
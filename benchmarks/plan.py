@@ -0,0 +1,146 @@
+"""
+Runs plan or apply end-to-end against a synthetic workspace and a local fake registry.
+
+    python -m benchmarks.plan --files 50 --blocks-per-file 20 --latency 0.05 --runs 10
+
+Every run starts without a version cache, so each one resolves every source over HTTP.
+"""
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import click
+from tfmesh.core import patterns, run_plan_apply
+from tfmesh.testing import FakeRegistry, RedirectTransport
+from tfmesh.transport import Transport
+from benchmarks.workspace import write_workspace
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None where it cannot be read.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes and Linux reports kilobytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def percentile(values, percent):
+    """
+    Returns a percentile of a list of values using the nearest rank.
+    """
+    values = sorted(values)
+
+    return values[max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))]
+
+def run_benchmark(files=10, blocks_per_file=10, modules_ratio=0.5, runs=5, apply=False, latency=0, jitter=0, error_rate=0, tag_count=50, parallelism=10, parser="regex", jobs=1, github_token=None):
+    """
+    Runs plan (or apply) several times and returns wall times, requests issued and peak RSS.
+
+    Apply rewrites the workspace, so it is written again before every run.
+    """
+    folder = tempfile.mkdtemp()
+    dependency_patterns = {
+        "terraform": [patterns("TERRAFORM")],
+        "providers": [patterns("PROVIDER")],
+        "modules": [
+            patterns("MODULE_REGISTRY"),
+            patterns("MODULE_GITHUB")
+        ]
+    }
+    environment = {"TFMESH_GITHUB_TOKEN": github_token} if github_token else {}
+    times = []
+    requests = []
+
+    try:
+        with FakeRegistry(latency=latency, jitter=jitter, error_rate=error_rate, tag_count=tag_count) as registry, mock_environment(environment):
+            for run in range(runs):
+                if run == 0 or apply:
+                    terraform_files = write_workspace(folder, files, blocks_per_file, modules_ratio)
+                registry.requests.clear()
+                transport = RedirectTransport(registry.url, Transport(pool_size=parallelism))
+
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run_plan_apply(
+                        terraform_files=terraform_files,
+                        patterns=dependency_patterns,
+                        apply=apply,
+                        verbose=True,
+                        no_color=True,
+                        parallelism=parallelism,
+                        transport=transport,
+                        parser=parser,
+                        jobs=jobs
+                    )
+                times.append(time.perf_counter() - start)
+                requests.append(sum(registry.requests.values()))
+                transport.close()
+    finally:
+        shutil.rmtree(folder)
+
+    return {
+        "runs": runs,
+        "p50": percentile(times, 50),
+        "p95": percentile(times, 95),
+        "requests": max(requests),
+        "peak_rss": get_peak_rss()
+    }
+
+@contextlib.contextmanager
+def mock_environment(variables):
+    """
+    Sets environment variables for the duration of a with block.
+    """
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+@click.command()
+@click.option("--files", default=10, show_default=True, help="The number of .tf files in the workspace.")
+@click.option("--blocks-per-file", default=10, show_default=True, help="The number of provider and module blocks in each file.")
+@click.option("--modules-ratio", default=0.5, show_default=True, help="The share of blocks that are modules rather than providers.")
+@click.option("--runs", default=5, show_default=True, help="The number of times to run plan or apply.")
+@click.option("--apply", is_flag=True, help="Runs apply instead of plan.")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds the fake registry waits before each response.")
+@click.option("--jitter", default=0.0, show_default=True, help="Up to this many more seconds are added to each response at random.")
+@click.option("--error-rate", default=0.0, show_default=True, help="The share of requests that fail with a 500.")
+@click.option("--tag-count", default=50, show_default=True, help="The number of versions for every source.")
+@click.option("--parallelism", default=10, show_default=True, help="The number of version requests to run at once.")
+@click.option("--parser", type=click.Choice(["regex", "hcl"]), default="regex", show_default=True, help="The parser used to find dependencies.")
+@click.option("--jobs", default=1, show_default=True, help="The number of processes used to parse files.")
+@click.option("--github-token", help="Resolves GitHub modules through batched GraphQL queries as they are with TFMESH_GITHUB_TOKEN set.")
+def cli(**options):
+    """
+    Benchmarks plan and apply end-to-end against a local fake registry.
+    """
+    result = run_benchmark(**options)
+    peak_rss = f'{result["peak_rss"] / 1024 / 1024:.1f} MiB' if result["peak_rss"] else "unknown"
+
+    print(f'runs: {result["runs"]}')
+    print(f'p50: {result["p50"] * 1000:.1f} ms')
+    print(f'p95: {result["p95"] * 1000:.1f} ms')
+    print(f'requests per run: {result["requests"]}')
+    print(f'peak rss: {peak_rss}')
+
+if __name__ == "__main__":
+    cli()
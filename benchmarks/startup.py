@@ -0,0 +1,81 @@
+"""
+Measures how long the tfmesh CLI takes to import, using python -X importtime.
+
+    python -m benchmarks.startup --budget 75
+
+The import is measured in fresh interpreters with bytecode already compiled, as it is once tfmesh
+is installed, and the fastest run is reported.
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import click
+
+# The most time importing the CLI may take, in seconds.
+STARTUP_BUDGET = 0.075
+
+# Modules that only the commands which need them may import.
+DEFERRED_MODULES = ("requests", "urllib3", "multiprocessing")
+
+IMPORT_TIME = re.compile(r'^import time: +(\d+) \| +(\d+) \| ( *)(\S+)$')
+
+def import_times(statement="from tfmesh import cli", pycache=None):
+    """
+    Runs a statement in a new interpreter and returns the cumulative import time in seconds of each module.
+    """
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    if pycache:
+        environment["PYTHONPYCACHEPREFIX"] = pycache
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    times = {}
+
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2)) / 1000000
+
+    return times
+
+def measure_startup(statement="from tfmesh import cli", package="tfmesh", runs=5):
+    """
+    Returns the fastest time taken to import a package by a statement and the modules it imported.
+
+    A first run compiles bytecode into a temporary folder so the timed runs do not include it.
+    """
+    with tempfile.TemporaryDirectory() as pycache:
+        import_times(statement, pycache)
+        results = [import_times(statement, pycache) for _ in range(runs)]
+
+    return min(times[package] for times in results), set(results[0])
+
+@click.command()
+@click.option("--statement", default="from tfmesh import cli", show_default=True, help="The statement to time.")
+@click.option("--runs", default=5, show_default=True, help="The number of runs to take the fastest of.")
+@click.option("--budget", default=STARTUP_BUDGET * 1000, show_default=True, help="Fails when the import takes longer than this many milliseconds.")
+def cli(statement, runs, budget):
+    """
+    Measures the time taken to import the tfmesh CLI.
+    """
+    seconds, modules = measure_startup(statement, runs=runs)
+    deferred = [module for module in DEFERRED_MODULES if module in modules]
+
+    print(f"import time: {seconds * 1000:.1f} ms (budget {budget:.1f} ms)")
+    if deferred:
+        print(f'modules that should only be imported when needed: {", ".join(deferred)}')
+
+    if seconds * 1000 > budget or deferred:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    cli()
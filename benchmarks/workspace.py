@@ -0,0 +1,146 @@
+"""
+Writes synthetic Terraform workspaces for benchmarks.
+
+    python -m benchmarks.workspace ./workspace --files 200 --blocks-per-file 25 --constraints mixed --pathological 0.2
+"""
+import os
+import random
+import click
+
+# Sources for each kind of dependency, chosen by position so every workspace of the same size is the same.
+PROVIDER_SOURCES = ["hashicorp/aws", "hashicorp/azurerm", "hashicorp/google", "hashicorp/random", "hashicorp/null", "hashicorp/tls"]
+
+MODULE_SOURCES = [
+    '"terraform-aws-modules/vpc/aws"',
+    '"hashicorp/consul/aws"',
+    '"github.com/example/terraform-module-{index}?ref=v{version}"',
+    '"git::https://dev.azure.com/example/modules/_git/terraform-module-{index}?ref=v{version}"',
+]
+
+# Constraints given to blocks in turn, where an empty constraint leaves the block without one.
+CONSTRAINT_MIXES = {
+    "none": [""],
+    "simple": [">=1.0.0"],
+    "mixed": [">=1.0.0", "~>1.0", ">=1.0.0, <3.0.0", "", "=1.0.0", ">=1.0.0, <4.0.0, !=2.0.0", "~>1"],
+}
+
+def get_provider_block(index, version="1.0.0", constraint=">=1.0.0", pathological=False):
+    """
+    Returns a terraform block with one required provider.
+    """
+    source = PROVIDER_SOURCES[index % len(PROVIDER_SOURCES)]
+    comment = f" # {constraint}" if constraint else ""
+
+    if pathological:
+        return (
+            'terraform   {\n'
+            '\trequired_providers  {\n\n'
+            f'\t\tprovider{index}     =     {{\n'
+            f'\t\t\tsource    =    "{source}"\n\n'
+            f'\t\t\tversion   =   "{version}"   {comment}\n'
+            '\t\t}\n'
+            '\t}\n'
+            '}\n'
+        )
+
+    return (
+        'terraform {\n'
+        '    required_providers {\n'
+        f'        provider{index} = {{\n'
+        f'            source = "{source}"\n'
+        f'            version = "{version}"{comment}\n'
+        '        }\n'
+        '    }\n'
+        '}\n'
+    )
+
+def get_module_block(index, version="1.0.0", constraint=">=1.0.0", pathological=False):
+    """
+    Returns a module block whose source is a registry, GitHub or Azure DevOps module.
+    """
+    source = MODULE_SOURCES[index % len(MODULE_SOURCES)].format(index=index, version=version)
+    comment = f" # {constraint}" if constraint else ""
+    indent, space = ("\t", "    ") if pathological else ("  ", " ")
+    inputs = "".join(f'{indent}input_{number}{space}={space}"value {{ {number} }}"\n' for number in range(20)) if pathological else ""
+
+    if "?ref=" in source:
+        return f'module{space}"module{index}"{space}{{\n{indent}source{space}={space}{source}{comment}\n{inputs}}}\n'
+
+    return f'module{space}"module{index}"{space}{{\n{indent}source{space}={space}{source}\n{indent}version{space}={space}"{version}"{comment}\n{inputs}}}\n'
+
+def get_noise_block(index):
+    """
+    Returns a resource that is not a dependency but is full of the braces, quotes and keywords the parsers look for.
+    """
+    return (
+        f'# module "commented{index}" {{ version = "9.9.9" }}\n'
+        f'resource "aws_instance" "noise{index}" {{\n'
+        '  tags = {\n'
+        '    Name = "module { source = \\"fake\\" }"\n'
+        '    Version = "${var.version}"\n'
+        '  }\n'
+        '  user_data = <<-EOT\n'
+        '    terraform {\n'
+        '      required_version = "0.0.1"\n'
+        '    }\n'
+        '  EOT\n'
+        '  lifecycle {\n'
+        '    ignore_changes = [tags["Version"], user_data]\n'
+        '  }\n'
+        '}\n'
+    )
+
+def write_workspace(folder, files=10, blocks_per_file=10, modules_ratio=0.5, constraints="simple", pathological=0, seed=0):
+    """
+    Writes a Terraform workspace of the given size to a folder and returns the paths of its files.
+
+    The first file pins the Terraform version and modules_ratio of the remaining blocks are modules,
+    spread evenly between the providers.  Blocks take their constraints from a constraint mix in
+    turn, and the pathological share of them are written with odd whitespace and followed by a
+    resource that only looks like a dependency.  The same arguments always write the same files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    generator = random.Random(seed)
+    mix = CONSTRAINT_MIXES[constraints]
+    paths = []
+    counts = {"providers": 0, "modules": 0}
+
+    for file_index in range(files):
+        blocks = ['terraform {\n  required_version = "1.0.0" # >=1.0.0\n}\n'] if file_index == 0 else []
+        for _ in range(blocks_per_file):
+            total = counts["providers"] + counts["modules"]
+            odd = generator.random() < pathological
+            if counts["modules"] < modules_ratio * (total + 1):
+                blocks.append(get_module_block(counts["modules"], constraint=mix[total % len(mix)], pathological=odd))
+                counts["modules"] += 1
+            else:
+                blocks.append(get_provider_block(counts["providers"], constraint=mix[total % len(mix)], pathological=odd))
+                counts["providers"] += 1
+            if odd:
+                blocks.append(get_noise_block(total))
+
+        path = os.path.join(folder, f"main{file_index}.tf")
+        with open(path, "w") as f:
+            f.write("\n".join(blocks))
+        paths.append(path)
+
+    return paths
+
+@click.command()
+@click.argument("folder")
+@click.option("--files", default=10, show_default=True, help="The number of .tf files to write.")
+@click.option("--blocks-per-file", default=10, show_default=True, help="The number of provider and module blocks in each file.")
+@click.option("--modules-ratio", default=0.5, show_default=True, help="The share of blocks that are modules rather than providers.")
+@click.option("--constraints", type=click.Choice(list(CONSTRAINT_MIXES)), default="simple", show_default=True, help="The mix of version constraints given to blocks.")
+@click.option("--pathological", default=0.0, show_default=True, help="The share of blocks written with odd formatting and surrounded by look-alike code.")
+@click.option("--seed", default=0, show_default=True, help="Seeds which blocks are pathological.")
+def cli(folder, **options):
+    """
+    Writes a synthetic Terraform workspace to FOLDER.
+    """
+    paths = write_workspace(folder, **options)
+
+    print(f"Wrote {len(paths)} file(s) to {folder}.")
+
+if __name__ == "__main__":
+    cli()
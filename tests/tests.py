@@ -1,6 +1,69 @@
 import unittest
+import contextlib
+import io
+import os
+import subprocess
+import sys
 import pathlib
+import re
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 from tfmesh.core import *
+from tfmesh.cache import ParseIndex, SnapshotError, VersionCache, VersionSnapshot, write_snapshot
+from tfmesh import hcl
+from tfmesh.metrics import get_metrics, write_metrics
+from tfmesh.testing import FakeRegistry, RedirectTransport
+from tfmesh.trace import NULL_SPAN, Tracer, get_tracer, span, tracing
+from tfmesh.versions import ConstraintError
+from tfmesh.transport import Response, Transport
+from benchmarks.micro import ADVERSARIAL_INPUTS, compare_results
+from benchmarks.startup import DEFERRED_MODULES
+from benchmarks.workspace import write_workspace
+
+# The built-in patterns for every kind of versioned resource.
+DEPENDENCY_PATTERNS = {
+    "terraform": [patterns("TERRAFORM")],
+    "providers": [patterns("PROVIDER")],
+    "modules": [patterns("MODULE_REGISTRY"), patterns("MODULE_GITHUB")],
+}
+
+class FakeTransport:
+    """
+    A transport that serves canned responses by url instead of making network requests.
+    """
+    def __init__(self, responses, tags=None):
+        self.responses = responses
+        self.tags = tags or {}
+        self.urls = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        status_code, text, *response_headers = self.responses.get(url, (404, ""))
+        return Response(status_code, "OK" if status_code == 200 else "Not Found", text, response_headers[0] if response_headers else {})
+
+    def post(self, url, body, headers=None):
+        """
+        Answers aliased GraphQL tag queries from a dictionary of repository tags, two tags per page.
+        """
+        self.urls.append(url)
+        variables = json.loads(body)["variables"]
+        data = {}
+        for index in range(len(variables) // 3):
+            repository = (variables[f"owner{index}"], variables[f"name{index}"])
+            if repository not in self.tags:
+                data[f"r{index}"] = None
+                continue
+            start = int(variables[f"cursor{index}"] or 0)
+            tags = self.tags[repository]
+            data[f"r{index}"] = {
+                "refs": {
+                    "nodes": [{"name": tag} for tag in tags[start:start + 2]],
+                    "pageInfo": {"hasNextPage": start + 2 < len(tags), "endCursor": str(start + 2)},
+                }
+            }
+        return Response(200, "OK", json.dumps({"data": data}), {})
 
 class TestCore(unittest.TestCase):
     def test_get_terraform_files(self):
@@ -15,6 +78,34 @@ class TestCore(unittest.TestCase):
 
         self.assertEqual(actual, expected)
 
+    def test_get_terraform_files_with_pruning_and_ignore_files(self):
+        """
+        Test that pruned folders, ignore files and exclude patterns are skipped and that multiple patterns can be used.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            files = [
+                "main.tf", "a.generated.tf", "important.generated.tf",
+                ".terraform/modules/vpc/main.tf", ".git/main.tf", "node_modules/package/main.tf", "custom/main.tf",
+                "vendor/module/main.tf", "modules/a/main.tf", "modules/a/test.tf", "modules/b/main.tf", "env/prod/main.tf",
+            ]
+            for file in files:
+                pathlib.Path(folder, file).parent.mkdir(parents=True, exist_ok=True)
+                pathlib.Path(folder, file).write_text("")
+            pathlib.Path(folder, ".gitignore").write_text("# generated files\n*.generated.tf\n!important.generated.tf\n")
+            pathlib.Path(folder, ".tfmeshignore").write_text("vendor/\n")
+            pathlib.Path(folder, "modules", "a", ".gitignore").write_text("test.tf\n")
+
+            stats = {}
+            actual = get_terraform_files(folder, "**/*.tf", exclude=["env/**"], pruned_folders=PRUNED_FOLDERS + ("custom",), stats=stats)
+            expected = [f"{folder}/{file}" for file in ["important.generated.tf", "main.tf", "modules/a/main.tf", "modules/b/main.tf"]]
+
+            self.assertEqual(actual, expected)
+            self.assertEqual(stats, {"folders": 5, "files": 4, "pruned": 4, "ignored": 4})
+            self.assertEqual(get_terraform_files(folder, stats=stats), [f"{folder}/important.generated.tf", f"{folder}/main.tf"])
+            self.assertEqual(stats, {"folders": 1, "files": 2, "pruned": 0, "ignored": 1})
+            self.assertEqual(get_terraform_files(folder, ["main.tf", "modules/*/main.tf"], stats=stats), [f"{folder}/main.tf", f"{folder}/modules/a/main.tf", f"{folder}/modules/b/main.tf"])
+            self.assertEqual(stats["pruned"], 3)
+
     def test_get_semantic_version(self):
         """
         Test that semantic version components are returned as a dictionary
@@ -24,6 +115,27 @@ class TestCore(unittest.TestCase):
 
         self.assertEqual(actual, expected)
 
+    def test_parse_version(self):
+        """
+        Test that versions are parsed once, are immutable and order pre-releases below their release.
+        """
+        version = parse_version("v1.2.3")
+
+        self.assertIs(parse_version("v1.2.3"), version)
+        self.assertEqual((version.major, version.minor, version.patch, version.prerelease, version.length), (1, 2, 3, "", 3))
+        self.assertEqual(parse_version("1.2"), parse_version("1.2.0"))
+        self.assertEqual(parse_version("1.2").length, 2)
+        self.assertIsNone(parse_version("latest"))
+        with self.assertRaises(AttributeError):
+            version.major = 2
+
+        ordered = ["1.2.9", "1.3.0-alpha20220622", "1.3.0-beta1", "1.3.0-beta2", "1.3.0-beta10", "1.3.0-rc1", "1.3.0", "1.3.0+build5", "1.10.0"]
+        self.assertEqual(sorted(ordered, key=parse_version), ordered)
+        self.assertLess(parse_version("1.0.0-alpha"), parse_version("1.0.0-alpha.1"))
+        self.assertLess(parse_version("1.0.0-1"), parse_version("1.0.0-alpha"))
+        self.assertTrue(compare_versions(parse_version("1.9.0"), "~>", parse_version("1.1")))
+        self.assertFalse(compare_versions(parse_version("1.2.0"), "~>", parse_version("1.1.0")))
+
     def test_get_github_module_versions(self):
         """
         Test that a list of tags can be returned from a github repo without headers.
@@ -157,6 +269,106 @@ class TestCore(unittest.TestCase):
 
         self.assertEqual(get_allowed_versions(available_versions, lower_constraint, lower_constraint_operator, upper_constraint, upper_constraint_operator), ["v2.0.0", "v2.0.1"])
 
+    def test_version_set(self):
+        """
+        Test that a version set returns the same versions as filtering and sorting the full list.
+        """
+        available_versions = ["v0.1.0", "v2.1.0", "v0.1.4", "v1.0.0", "v2.0.0-rc1", "latest", "v1.1.2", "v2.0.0", "v0.1.3", "v2.0.1", "v0.1.1"]
+        version_set = VersionSet(available_versions)
+        constraints = [
+            ("", "", "", ""),
+            ("0.1.3", "", "", ""),
+            ("v2.0.0", ">", "", ""),
+            ("2.0.0", ">=", "2.1.0", "<"),
+            ("0.1", "~>", "", ""),
+            ("0.1.1", "~>", "", ""),
+            ("1.0.0", "!=", "2.0.0", "<="),
+            ("2.0.0", "<", "0.1.1", ">"),
+        ]
+
+        for lower_constraint, lower_constraint_operator, upper_constraint, upper_constraint_operator in constraints:
+            constraint = compile_constraint(", ".join(f"{op}{version}" for version, op in [(lower_constraint, lower_constraint_operator), (upper_constraint, upper_constraint_operator)] if version))
+            expected = sort_versions(get_allowed_versions(available_versions, lower_constraint, lower_constraint_operator, upper_constraint, upper_constraint_operator))
+
+            self.assertEqual(version_set.allowed(constraint), expected, lower_constraint_operator + lower_constraint)
+            self.assertEqual(version_set.allowed(constraint, top=2), expected[:2])
+            self.assertEqual(version_set.allowed(constraint, top=0), expected)
+            self.assertEqual(version_set.allowed(constraint, top=-2), expected[:-2])
+            self.assertEqual(version_set.latest_matching(constraint), get_latest_version(expected))
+
+        self.assertEqual(version_set.latest(), "v2.1.0")
+        self.assertEqual(version_set.allowed(compile_constraint("<2.0.0, >=1.0.0")), ["v2.0.0-rc1", "v1.1.2", "v1.0.0"])
+        self.assertEqual(version_set.allowed(compile_constraint("<2.0.0, >=1.0.0"), exclude_prerelease=True), ["v1.1.2", "v1.0.0"])
+        self.assertIsNone(version_set.latest_matching(compile_constraint(">3.0.0")))
+        self.assertIn("v2.0.1", version_set)
+        self.assertNotIn("latest", version_set)
+
+    def test_compile_constraint(self):
+        """
+        Test that constraints compile to intervals with any number of clauses and that invalid constraints are rejected.
+        """
+        available_versions = ["0.9.0", "1.0.0", "1.1.0", "1.5.0", "1.5.1", "1.9.0", "2.0.0", "3.0.0"]
+        version_set = VersionSet(available_versions)
+        expected = {
+            "": ["3.0.0", "2.0.0", "1.9.0", "1.5.1", "1.5.0", "1.1.0", "1.0.0", "0.9.0"],
+            ">= 1.0.0, < 2.0.0, != 1.5.0, != 1.9.0": ["1.5.1", "1.1.0", "1.0.0"],
+            "~>1.1": ["1.9.0", "1.5.1", "1.5.0", "1.1.0"],
+            "~>1.5.0": ["1.5.1", "1.5.0"],
+            "~>1": ["3.0.0", "2.0.0", "1.9.0", "1.5.1", "1.5.0", "1.1.0", "1.0.0"],
+            "v1.1.0": ["1.1.0"],
+            ">2.0.0, <2.0.0": [],
+        }
+
+        for constraint, versions in expected.items():
+            self.assertEqual(version_set.allowed(compile_constraint(constraint)), versions, constraint)
+        self.assertIs(compile_constraint("~>1.1"), compile_constraint("~>1.1"))
+
+        for constraint in ["=>1.0.0", "~>", ">=1.0.0,", "1.2.3.4", "latest"]:
+            with self.assertRaises(ConstraintError):
+                compile_constraint(constraint)
+
+    def test_run_plan_apply_with_invalid_constraints(self):
+        """
+        Test that every invalid constraint is reported before any versions are requested.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            with open(f"{folder}/main.tf", "w") as f:
+                f.write('module "a" {\n  source  = "hashicorp/consul/aws"\n  version = "0.1.0" # =>0.1.0\n}\n')
+                f.write('module "b" {\n  source  = "hashicorp/consul/aws"\n  version = "0.1.0" # >=0.1.0, <1.0.0, !=0.5.0\n}\n')
+                f.write('module "c" {\n  source  = "hashicorp/consul/aws"\n  version = "0.1.0" # ~>0.1.0.1\n}\n')
+            pattern_map = {"modules": DEPENDENCY_PATTERNS["modules"]}
+            files = get_terraform_files(folder)
+
+            for parser in ["regex", "hcl"]:
+                self.assertEqual(get_dependency_attributes(files, pattern_map, parser=parser)["modules"]["b"]["constraint"], ">=0.1.0, <1.0.0, !=0.5.0")
+
+            with mock.patch("tfmesh.core.fetch_available_versions") as fetch, mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                run_plan_apply(files, pattern_map, no_color=True)
+
+        fetch.assert_not_called()
+        self.assertIn("2 resource(s) have a version constraint that is not valid", stdout.getvalue())
+        self.assertIn('modules "a"', stdout.getvalue())
+        self.assertIn('modules "c"', stdout.getvalue())
+        self.assertNotIn('modules "b"', stdout.getvalue())
+
+    def test_set_constraint_with_comment_prefix(self):
+        """
+        Test that a constraint given with a leading # is accepted and written as a single constraint comment.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            path = pathlib.Path(folder, "main.tf")
+            path.write_text(pathlib.Path(__file__).parent.joinpath("test.tf").read_text())
+            files = get_terraform_files(folder)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                set_dependency_attribute(files, DEPENDENCY_PATTERNS, "providers", "aws", "constraint", "# ~>3.1", False, False, False, False)
+                set_dependency_attribute(files, DEPENDENCY_PATTERNS, "terraform", "terraform", "constraint", "#>=1.0.0", False, False, False, False)
+            result = set_dependency_attribute(files, DEPENDENCY_PATTERNS, "providers", "aws", "constraint", " # ~>3.1", False, False, False, False)
+
+            self.assertIn('version = "3.71.0" # ~>3.1\n', path.read_text())
+            self.assertIn('required_version = "1.1.3" # >=1.0.0\n', path.read_text())
+            self.assertIn('already set to "~>3.1"', result)
+
     def test_get_available_versions(self):
         """
         Test that the number of available versions is less when pre-releases are excluded.
@@ -168,6 +380,763 @@ class TestCore(unittest.TestCase):
         self.assertIn("0.12.0-alpha3", result_with_pre_releases)
         self.assertNotIn("0.12.0-alpha3", result_without_pre_releases)
 
+    def test_get_source_host(self):
+        """
+        Test that each target and source resolves to the host that serves its versions.
+        """
+        self.assertEqual(get_source_host("terraform"), "releases.hashicorp.com")
+        self.assertEqual(get_source_host("providers", "hashicorp/aws"), "registry.terraform.io")
+        self.assertEqual(get_source_host("modules", "hashicorp/consul/aws"), "registry.terraform.io")
+        self.assertEqual(get_source_host("modules", "github.com/jsoconno/tfmesh"), "api.github.com")
+        self.assertEqual(get_source_host("modules", "git::https://dev.azure.com/org/project/_git/repo"), "dev.azure.com")
+
+    def test_resolve_available_versions(self):
+        """
+        Test that versions are resolved concurrently, keyed by resource, and within per-host limits.
+        """
+        resources = {
+            "providers": {f"provider{i}": {"target": "providers", "source": f"hashicorp/provider{i}"} for i in range(6)},
+            "terraform": {"terraform": {"target": "terraform", "source": ""}},
+        }
+        lock = threading.Lock()
+        active = defaultdict(int)
+        peak = defaultdict(int)
+
+        def fake_fetch_available_versions(target, source=None, transport=None):
+            host = get_source_host(target, source)
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.05)
+            with lock:
+                active[host] -= 1
+            return {"status_code": 200, "reason": "OK", "versions": [source]}
+
+        with mock.patch("tfmesh.core.fetch_available_versions", side_effect=fake_fetch_available_versions):
+            with mock.patch("tfmesh.core.host_limits", return_value=2):
+                start = time.perf_counter()
+                result = resolve_available_versions(resources, parallelism=8)
+                elapsed = time.perf_counter() - start
+
+        self.assertEqual(list(result.keys()), [("providers", f"provider{i}") for i in range(6)] + [("terraform", "terraform")])
+        self.assertEqual(result[("providers", "provider3")]["versions"], ["hashicorp/provider3"])
+        self.assertLessEqual(peak["registry.terraform.io"], 2)
+        self.assertLess(elapsed, 6 * 0.05)
+
+    def test_request_coalescer(self):
+        """
+        Test that identical sources are only requested once, even when the lookups are in flight together.
+        """
+        resources = {
+            "modules": {
+                "s3": {"target": "modules", "source": "github.com/jsoconno/terraform-module-aws-s3"},
+                "s3_copy": {"target": "modules", "source": "git::https://github.com/jsoconno/terraform-module-aws-s3.git"},
+                "consul": {"target": "modules", "source": "hashicorp/consul/aws"},
+            },
+            "providers": {
+                "aws": {"target": "providers", "source": "hashicorp/aws"},
+                "aws_copy": {"target": "providers", "source": "hashicorp/aws"},
+            },
+        }
+
+        def fake_fetch_available_versions(target, source=None, transport=None):
+            time.sleep(0.05)
+            return {"status_code": 200, "reason": "OK", "versions": ["1.0.0", "1.1.0-beta1"]}
+
+        coalescer = RequestCoalescer()
+        with mock.patch("tfmesh.core.fetch_available_versions", side_effect=fake_fetch_available_versions) as fetch:
+            result = resolve_available_versions(resources, parallelism=8, coalescer=coalescer)
+
+        self.assertEqual(fetch.call_count, 3)
+        self.assertEqual(coalescer.requests, 3)
+        self.assertEqual(coalescer.saved, 2)
+        self.assertEqual(result[("providers", "aws")], result[("providers", "aws_copy")])
+        self.assertIsNot(result[("providers", "aws")]["versions"], result[("providers", "aws_copy")]["versions"])
+
+    def test_version_cache(self):
+        """
+        Test that cached versions are returned until stale and that refresh and offline modes are honoured.
+        """
+        result = {"status_code": 200, "reason": "OK", "versions": ["1.0.0", "1.1.0"]}
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = VersionCache(cache_folder=folder, ttl=60)
+            cache.set("providers", "hashicorp/aws", result)
+            cache.set("providers", "hashicorp/broken", {"status_code": 404, "reason": "Not Found", "versions": []})
+
+            self.assertEqual(cache.get("providers", "hashicorp/aws"), result)
+            self.assertIsNone(cache.get("providers", "hashicorp/broken"))
+
+            with mock.patch("tfmesh.cache.time.time", return_value=time.time() + 120):
+                self.assertIsNone(cache.get("providers", "hashicorp/aws"))
+                cache.offline = True
+                self.assertEqual(cache.get("providers", "hashicorp/aws"), result)
+
+            cache.offline = False
+            cache.refresh = True
+            self.assertIsNone(cache.get("providers", "hashicorp/aws"))
+
+            self.assertEqual(cache.clear(), 1)
+            cache.close()
+
+    def test_version_cache_eviction(self):
+        """
+        Test that the least recently used entries are evicted when the cache is full.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            cache = VersionCache(cache_folder=folder, max_entries=2)
+            for source in ["a", "b"]:
+                cache.set("modules", source, {"status_code": 200, "reason": "OK", "versions": [source]})
+                time.sleep(0.01)
+            cache.get("modules", "a")
+            time.sleep(0.01)
+            cache.set("modules", "c", {"status_code": 200, "reason": "OK", "versions": ["c"]})
+
+            self.assertIsNotNone(cache.get("modules", "a"))
+            self.assertIsNone(cache.get("modules", "b"))
+            self.assertIsNotNone(cache.get("modules", "c"))
+            self.assertEqual(cache.stats()["entries"], 2)
+            cache.close()
+
+    def test_get_available_versions_with_cache(self):
+        """
+        Test that cached versions are served without a request and offline misses fail without a request.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            cache = VersionCache(cache_folder=folder)
+            cache.set("providers", "hashicorp/aws", {"status_code": 200, "reason": "OK", "versions": ["3.0.0"]})
+
+            with mock.patch("tfmesh.core.fetch_available_versions") as fetch:
+                result = get_available_versions("providers", "hashicorp/aws", cache=cache)
+                cache.offline = True
+                offline_result = get_available_versions("providers", "hashicorp/azurerm", cache=cache)
+
+            fetch.assert_not_called()
+            self.assertEqual(result["versions"], ["3.0.0"])
+            self.assertNotEqual(offline_result["status_code"], 200)
+            cache.close()
+
+    def test_version_snapshot(self):
+        """
+        Test that snapshots serve every stored version list, including from a folder, and never make requests.
+        """
+        results = {("providers", f"hashicorp/provider{i}"): {"status_code": 200, "reason": "OK", "versions": [f"{i}.0.0", f"{i}.1.0"]} for i in range(200)}
+        results[("terraform", "")] = {"status_code": 200, "reason": "OK", "versions": ["1.1.3"]}
+        results[("providers", "hashicorp/broken")] = {"status_code": 404, "reason": "Not Found", "versions": []}
+
+        with tempfile.TemporaryDirectory() as folder:
+            self.assertEqual(write_snapshot(f"{folder}/a.snapshot", results), 201)
+            write_snapshot(f"{folder}/b.snapshot", {("modules", "hashicorp/consul/aws"): {"status_code": 200, "reason": "OK", "versions": ["0.5.0"]}})
+
+            snapshot = VersionSnapshot(f"{folder}/a.snapshot")
+            for (target, source), result in results.items():
+                self.assertEqual(snapshot.get(target, source), result if result["status_code"] == 200 else None)
+            self.assertIsNone(snapshot.get("modules", "hashicorp/consul/aws"))
+            snapshot.close()
+
+            snapshot = VersionSnapshot(folder)
+            self.assertEqual(snapshot.stats()["entries"], 202)
+            resources = {
+                "modules": {"consul": {"target": "modules", "source": "hashicorp/consul/aws"}, "s3": {"target": "modules", "source": "github.com/jsoconno/s3"}},
+                "terraform": {"terraform": {"target": "terraform", "source": ""}},
+            }
+            with mock.patch("tfmesh.core.fetch_available_versions") as fetch, mock.patch.dict(os.environ, {"TFMESH_GITHUB_TOKEN": "token"}):
+                result = resolve_available_versions(resources, cache=snapshot, transport=FakeTransport({}))
+
+            fetch.assert_not_called()
+            self.assertEqual(result[("modules", "consul")]["versions"], ["0.5.0"])
+            self.assertEqual(result[("terraform", "terraform")]["versions"], ["1.1.3"])
+            self.assertEqual(result[("modules", "s3")]["status_code"], 503)
+            snapshot.close()
+
+    def test_version_snapshot_rejects_incomplete_files(self):
+        """
+        Test that empty, foreign and truncated snapshots raise a clear error, on the command line too, and that writes leave no temporary files.
+        """
+        results = {("providers", f"hashicorp/provider{i}"): {"status_code": 200, "reason": "OK", "versions": [f"{i}.0.0"]} for i in range(10)}
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:])"
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = pathlib.Path(folder, "versions.snapshot")
+            write_snapshot(path, results)
+            write_snapshot(path, results)
+            self.assertEqual(os.listdir(folder), ["versions.snapshot"])
+            contents = path.read_bytes()
+
+            for broken in [b"", contents[:6], b"NOTASNAPSHOT", contents[:40], contents[:-1]]:
+                path.write_bytes(broken)
+                with self.assertRaises(SnapshotError):
+                    VersionSnapshot(path)
+
+            output = subprocess.run([sys.executable, "-c", script, "plan", "--versions-from", str(path)], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+            self.assertEqual(output.returncode, 1)
+            self.assertIn("is incomplete", output.stderr)
+            self.assertNotIn("Traceback", output.stderr)
+
+    def test_fetchers_with_injected_transport(self):
+        """
+        Test that every fetcher uses an injected transport and handles failed requests.
+        """
+        transport = FakeTransport({
+            "https://registry.terraform.io/v1/providers/hashicorp/aws": (200, '{"versions": ["3.0.0", "3.1.0"]}'),
+            "https://registry.terraform.io/v1/modules/hashicorp/consul/aws": (200, '{"versions": ["0.5.0"]}'),
+            "https://api.github.com/repos/jsoconno/tfmesh/tags?per_page=100": (200, '[{"name": "v1.0.0"}]', {"Link": '<https://api.github.com/repos/jsoconno/tfmesh/tags?per_page=100&page=2>; rel="next"'}),
+            "https://api.github.com/repos/jsoconno/tfmesh/tags?per_page=100&page=2": (200, '[{"name": "v1.1.0"}]'),
+            "https://dev.azure.com/org/project/_apis/git/repositories/repo/refs?filter=tags/&api-version=6.0-preview.1": (200, '{"value": [{"name": "refs/tags/v2.0.0"}]}'),
+            "https://releases.hashicorp.com/terraform": (200, '<a href="/terraform/1.1.3/">terraform_1.1.3</a><a href="/terraform/1.2.0-beta1/">terraform_1.2.0-beta1</a>'),
+        })
+
+        self.assertEqual(get_terraform_provider_versions("hashicorp/aws", transport=transport)["versions"], ["3.0.0", "3.1.0"])
+        self.assertEqual(get_terraform_module_versions("hashicorp/consul/aws", transport=transport)["versions"], ["0.5.0"])
+        self.assertEqual(get_github_module_versions("jsoconno", "tfmesh", transport=transport)["versions"], ["v1.0.0", "v1.1.0"])
+        self.assertEqual(get_azure_devops_module_versions("org", "project", "repo", transport=transport)["versions"], ["v2.0.0"])
+        self.assertEqual(get_terraform_versions(transport=transport)["versions"], ["1.1.3", "1.2.0-beta1"])
+
+        missing = get_terraform_provider_versions("hashicorp/missing", transport=transport)
+        self.assertEqual((missing["status_code"], missing["versions"]), (404, []))
+
+    def test_fetchers_with_fake_registry(self):
+        """
+        Test that every fetcher gets the same versions from the fake registry and that its error rate fails requests.
+        """
+        with FakeRegistry(tag_count=120) as registry:
+            transport = RedirectTransport(registry.url, Transport())
+            expected = registry.versions("jsoconno/tfmesh")
+
+            self.assertEqual(get_terraform_provider_versions("hashicorp/aws", transport=transport)["versions"], registry.versions("hashicorp/aws"))
+            self.assertEqual(get_terraform_module_versions("hashicorp/consul/aws", transport=transport)["versions"], registry.versions("hashicorp/consul/aws"))
+            self.assertEqual(sort_versions(get_github_module_versions("jsoconno", "tfmesh", transport=transport)["versions"]), sort_versions([f"v{tag}" for tag in expected]))
+            self.assertEqual(sort_versions(get_github_module_versions_batch([("jsoconno", "tfmesh")], "token", transport=transport)[("jsoconno", "tfmesh")]["versions"]), sort_versions([f"v{tag}" for tag in expected]))
+            self.assertEqual(get_azure_devops_module_versions("org", "project", "repo", transport=transport)["versions"], [f"v{tag}" for tag in registry.versions("org/project/repo")])
+            self.assertEqual(sort_versions(get_terraform_versions(transport=transport)["versions"]), sort_versions(registry.versions("terraform")))
+            self.assertEqual(len(expected), 120)
+            self.assertEqual(registry.requests["api.github.com"], 4)
+
+            registry.error_rate = 1
+            self.assertEqual(get_terraform_provider_versions("hashicorp/aws", transport=transport)["status_code"], 500)
+            transport.close()
+
+    def test_write_workspace(self):
+        """
+        Test that synthetic workspaces are the same for the same arguments and parse the same with either parser.
+        """
+        with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+            files = write_workspace(a, files=3, blocks_per_file=8, constraints="mixed", pathological=0.5)
+            self.assertEqual([pathlib.Path(file).read_text() for file in files], [pathlib.Path(file).read_text() for file in write_workspace(b, files=3, blocks_per_file=8, constraints="mixed", pathological=0.5)])
+
+            regex = get_dependency_attributes(files, DEPENDENCY_PATTERNS, "regex")
+            self.assertEqual({key: len(value) for key, value in regex.items()}, {"terraform": 1, "providers": 12, "modules": 12})
+            self.assertEqual(
+                {(key, name, attributes["version"], attributes["constraint"]) for key, value in regex.items() for name, attributes in value.items()},
+                {(key, name, attributes["version"], attributes["constraint"]) for key, value in get_dependency_attributes(files, DEPENDENCY_PATTERNS, "hcl").items() for name, attributes in value.items()}
+            )
+
+    def test_run_plan_apply_with_tracing(self):
+        """
+        Test that phases and requests are traced while a tracer is active and that nothing is recorded otherwise.
+        """
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            files = write_workspace(folder, files=2, blocks_per_file=4)
+            transport = RedirectTransport(registry.url, Transport())
+            tracer = Tracer()
+
+            with tracing(tracer), contextlib.redirect_stdout(io.StringIO()):
+                run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport)
+            self.assertIs(get_tracer(), None)
+            self.assertIs(span("render"), NULL_SPAN)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport)
+            transport.close()
+
+        timings = tracer.timings()
+        self.assertEqual(list(timings), ["parse files", "compile constraints", "get versions", "filter versions", "render"])
+        self.assertEqual(timings["render"][0], 9)
+
+        requests = [event for event in tracer.events if event["cat"] == "http"]
+        self.assertEqual(len(requests), sum(registry.requests.values()) // 2)
+        self.assertEqual({request["args"]["source"] for request in requests}, {"terraform", "hashicorp/aws", "hashicorp/azurerm", "hashicorp/google", "hashicorp/random", "terraform-aws-modules/vpc/aws", "hashicorp/consul/aws", "github.com/example/terraform-module-2", "git::https://dev.azure.com/example/modules/_git/terraform-module-3"})
+        self.assertTrue(all(request["args"]["status_code"] == 200 and request["args"]["bytes"] > 0 and request["args"]["cache"] == "miss" for request in requests))
+
+        with tempfile.TemporaryDirectory() as folder:
+            tracer.write(f"{folder}/trace.json")
+            events = json.loads(pathlib.Path(folder, "trace.json").read_text())["traceEvents"]
+        self.assertEqual(len(events), len(tracer.events))
+        self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in events))
+
+    def test_run_plan_apply_streams_output(self):
+        """
+        Test that versions are yielded in resource order as requests finish and that plan output is written a block at a time in the same order every run.
+        """
+        class Stream(io.StringIO):
+            writes = 0
+
+            def write(self, text):
+                self.writes += 1
+                return super().write(text)
+
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry(latency=0.01, jitter=0.02, seed=1) as registry:
+            files = write_workspace(folder, files=2, blocks_per_file=4)
+            transport = RedirectTransport(registry.url, Transport())
+            resources = get_dependency_attributes(files, DEPENDENCY_PATTERNS)
+
+            waits = []
+            keys = [key for key, result in iter_available_versions(resources, transport=transport, wait=lambda: waits.append(True))]
+
+            streams = [Stream(), Stream()]
+            for stream in streams:
+                with contextlib.redirect_stdout(stream):
+                    run_plan_apply(files, DEPENDENCY_PATTERNS, verbose=True, transport=transport)
+            transport.close()
+
+        self.assertEqual(keys, [(resource_type, name) for resource_type, dependencies in resources.items() for name in dependencies])
+        self.assertTrue(waits)
+        self.assertEqual(streams[0].getvalue(), streams[1].getvalue())
+        self.assertIn("Plan: ", streams[0].getvalue())
+        self.assertLess(streams[0].writes, streams[0].getvalue().count("\n") // 4)
+
+    def test_run_plan_apply_json_output(self):
+        """
+        Test that plan output is one JSON record per resource followed by a summary with jsonl, the same records as a list with json, and that get returns JSON records.
+        """
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            files = write_workspace(folder, files=2, blocks_per_file=4)
+            transport = RedirectTransport(registry.url, Transport())
+            outputs = {}
+            for output_format in ["jsonl", "json"]:
+                with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                    run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport, output_format=output_format)
+                outputs[output_format] = stdout.getvalue()
+
+            versions = json.loads(get_dependency_attribute(files, DEPENDENCY_PATTERNS, "providers", "provider0", "versions", True, True, 3, transport=transport, output_format="jsonl"))
+            every_version = json.loads(get_dependency_attribute(files, DEPENDENCY_PATTERNS, "providers", "provider0", "versions", True, False, 0, transport=transport, output_format="jsonl"))
+            resources = get_resources(files, DEPENDENCY_PATTERNS, output_format="jsonl").splitlines()
+            transport.close()
+
+        records = [json.loads(line) for line in outputs["jsonl"].splitlines()]
+        self.assertEqual(records, json.loads(outputs["json"]))
+        self.assertEqual([record["type"] for record in records], ["resource"] * 9 + ["summary"])
+        self.assertEqual(records[-1], {"type": "summary", "apply": False, "upgrade": 9, "downgrade": 0, "no change": 0, "failure": 0, "files": 2, "requests_saved": 0})
+
+        provider = next(record for record in records if record["name"] == "provider0")
+        self.assertEqual((provider["resource_type"], provider["source"], provider["version"], provider["constraint"]), ("providers", "hashicorp/aws", "1.0.0", ">=1.0.0"))
+        self.assertEqual(provider["latest_available_version"], provider["available_versions"][0])
+        self.assertEqual(provider["latest_allowed_version"], provider["allowed_versions"][0])
+        self.assertEqual(provider["status"], get_status("1.0.0", provider["latest_available_version"], provider["latest_allowed_version"]))
+        self.assertEqual(provider["action"], "upgrade")
+        self.assertEqual(list(provider)[:8], ["type", "resource_type", "target", "name", "source", "filepath", "version", "constraint"])
+        self.assertFalse({"spans", "code", "lower_constraint", "upper_constraint"} & set(provider))
+
+        self.assertEqual(versions["value"], [version for version in provider["allowed_versions"] if "-" not in version][:3])
+        self.assertEqual(every_version["value"], provider["allowed_versions"])
+        self.assertEqual(len(resources), 9)
+        self.assertEqual(set(json.loads(resources[0])), {"type", "resource_type", "target", "name", "source", "filepath", "version", "constraint"})
+        self.assertEqual(json.loads(get_resources([], DEPENDENCY_PATTERNS, output_format="jsonl")), {"type": "error", "message": "No Terraform files found."})
+
+    def test_apply_saved_plan(self):
+        """
+        Test that a saved plan is applied without any requests and is refused when a file it changes has changed since it was saved.
+        """
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:], standalone_mode=False); print('requests' in sys.modules)"
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            files = write_workspace(folder, files=2, blocks_per_file=4)
+            originals = {file: pathlib.Path(file).read_text() for file in files}
+            transport = RedirectTransport(registry.url, Transport())
+            plan_file = f"{folder}/plan.tfmesh"
+
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport, out=plan_file)
+            transport.close()
+            requests = sum(registry.requests.values())
+            self.assertIn(f'Run "tfmesh apply {plan_file}"', stdout.getvalue())
+            self.assertEqual({file: pathlib.Path(file).read_text() for file in files}, originals)
+
+            plan = read_plan(plan_file)
+            self.assertEqual(set(plan["files"]), set(files))
+            self.assertEqual(len(plan["edits"]), 9)
+            self.assertEqual(plan["summary"], {"upgrade": 9, "downgrade": 0, "no change": 0, "failure": 0, "files": 2})
+
+            environment = dict(os.environ, XDG_CACHE_HOME=folder)
+            process = subprocess.run([sys.executable, "-c", script, "apply", plan_file, "--no-color"], cwd=pathlib.Path(__file__).parent.parent, env=environment, capture_output=True, text=True)
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertIn("Apply complete!  Resources: 9 upgraded, 0 downgraded", process.stdout)
+            self.assertEqual(process.stdout.strip().splitlines()[-1], "False")
+            self.assertEqual(sum(registry.requests.values()), requests)
+            self.assertFalse(pathlib.Path(folder, "tfmesh", "parse.db").exists())
+
+            resources = get_dependency_attributes(files, DEPENDENCY_PATTERNS)
+            for resource in plan["resources"]:
+                self.assertEqual(resources[resource["resource_type"]][resource["name"]]["version"], resource["latest_allowed_version"])
+
+            applied = {file: pathlib.Path(file).read_text() for file in files}
+            with open(files[1], "a") as f:
+                f.write("\n# changed after the plan was saved\n")
+            changed = pathlib.Path(files[1]).read_text()
+            with open(files[0], "w") as f:
+                f.write(originals[files[0]])
+
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                apply_plan(plan_file, no_color=True)
+            self.assertIn(f"{files[1]} has changed since the plan was saved", stdout.getvalue())
+            self.assertEqual(pathlib.Path(files[0]).read_text(), originals[files[0]])
+            self.assertEqual(pathlib.Path(files[1]).read_text(), changed)
+            self.assertNotEqual(changed, applied[files[1]])
+
+            pathlib.Path(folder, "other.tfmesh").write_text('{"format": "something else"}')
+            with self.assertRaisesRegex(PlanError, "is not a saved plan"):
+                read_plan(f"{folder}/other.tfmesh")
+
+    def test_apply_saved_plan_rejects_plan_options(self):
+        """
+        Test that options which only change what is planned cannot be combined with a saved plan.
+        """
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:])"
+
+        with tempfile.TemporaryDirectory() as folder:
+            plan_file = f"{folder}/plan.tfmesh"
+            pathlib.Path(plan_file).write_text("{}")
+            environment = dict(os.environ, XDG_CACHE_HOME=folder)
+
+            for options in [["--target", "provider", "aws"], ["--shard", "1/2"], ["--var", "TFMESH_TEST=1"]]:
+                process = subprocess.run([sys.executable, "-c", script, "apply", plan_file, *options], cwd=pathlib.Path(__file__).parent.parent, env=environment, capture_output=True, text=True)
+                self.assertEqual(process.returncode, 2, options)
+                self.assertIn("cannot be used with PLAN_FILE", process.stderr)
+                self.assertNotIn("Traceback", process.stderr)
+
+    def test_run_workspaces_plan(self):
+        """
+        Test that many workspaces are found from patterns and manifests, parsed once, share one request per source and are reported separately and in total.
+        """
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            for name in ["envs/dev/network", "envs/prod/network", "envs/prod/node_modules", "single"]:
+                os.makedirs(f"{folder}/{name}")
+                write_workspace(f"{folder}/{name}", files=2, blocks_per_file=4)
+            os.symlink(f"{folder}/envs/dev/network/main1.tf", f"{folder}/envs/prod/network/shared.tf")
+            pathlib.Path(folder, "workspaces.txt").write_text("# root modules\nenvs/prod/*\n\nmissing/*\n")
+
+            workspaces, unmatched = get_workspaces(patterns=["envs/*/*"], root=folder)
+            self.assertEqual([os.path.relpath(workspace, folder) for workspace in workspaces], ["envs/dev/network", "envs/prod/network"])
+            self.assertEqual(unmatched, [])
+            self.assertEqual(get_workspaces(manifest=f"{folder}/workspaces.txt"), ([f"{folder}/envs/prod/network"], ["missing/*"]))
+
+            transport = RedirectTransport(registry.url, Transport())
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_plan_apply(get_terraform_files(f"{folder}/single"), DEPENDENCY_PATTERNS, transport=transport)
+            single_requests = sum(registry.requests.values())
+
+            tracer = Tracer()
+            summary = {}
+            with tracing(tracer), contextlib.redirect_stdout(io.StringIO()) as stdout:
+                run_workspaces_plan(workspaces, DEPENDENCY_PATTERNS, root=folder, transport=transport, summary=summary, no_color=True)
+            self.assertEqual(sum(registry.requests.values()), single_requests * 2)
+
+            with contextlib.redirect_stdout(io.StringIO()) as jsonl:
+                run_workspaces_plan(workspaces, DEPENDENCY_PATTERNS, root=folder, transport=transport, output_format="jsonl")
+            transport.close()
+
+        self.assertEqual(tracer.timings()["parse files"][0], 1)
+        self.assertEqual(summary, {"upgrade": 18, "downgrade": 0, "no change": 0, "failure": 0, "files": 5})
+        self.assertIn("Workspace: envs/dev/network", stdout.getvalue())
+        self.assertIn("Workspace: envs/prod/network", stdout.getvalue())
+        self.assertIn("All 2 workspace(s): 18 to upgrade, 0 to downgrade, 0 not to change and 0 failed in 5 file(s).", stdout.getvalue())
+
+        records = [json.loads(line) for line in jsonl.getvalue().splitlines()]
+        self.assertEqual([record["workspace"] for record in records if record["type"] == "summary" and "workspace" in record], ["envs/dev/network", "envs/prod/network"])
+        self.assertEqual({record["workspace"] for record in records if record["type"] == "resource"}, {"envs/dev/network", "envs/prod/network"})
+        self.assertEqual(records[-1]["workspaces"], 2)
+        self.assertEqual(records[-1]["upgrade"], 18)
+
+    def test_run_workspaces_plan_counts_saved_requests(self):
+        """
+        Test that only lookups shared between workspaces are counted as saved, not lookups served from the shared results.
+        """
+        provider = '    {name} = {{\n      source  = "hashicorp/{name}"\n      version = "1.0.0"\n    }}\n'
+        workspaces = {"a": ["aws", "azurerm", "google", "random"], "b": ["aws", "null"]}
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            for workspace, names in workspaces.items():
+                os.makedirs(f"{folder}/{workspace}")
+                pathlib.Path(folder, workspace, "main.tf").write_text("terraform {\n  required_providers {\n" + "".join(provider.format(name=name) for name in names) + "  }\n}\n")
+
+            transport = RedirectTransport(registry.url, Transport())
+            outputs = []
+            for names in [["a"], ["a", "b"]]:
+                with contextlib.redirect_stdout(io.StringIO()) as jsonl:
+                    run_workspaces_plan([f"{folder}/{name}" for name in names], DEPENDENCY_PATTERNS, root=folder, transport=transport, output_format="jsonl")
+                outputs.append(json.loads(jsonl.getvalue().splitlines()[-1]))
+            transport.close()
+
+        self.assertEqual(outputs[0]["requests_saved"], 0)
+        self.assertEqual(outputs[1]["requests_saved"], 1)
+
+    def test_shards_merge_into_one_plan(self):
+        """
+        Test that shards split resources by source without fetching any source twice and that merged shard results have the totals of one plan.
+        """
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:])"
+
+        self.assertEqual(get_shard("modules", "git::https://github.com/example/repo.git?ref=v1.0.0", 7), get_shard("modules", "git::https://github.com/Example/repo.git?ref=v2.0.0", 7))
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            files = write_workspace(folder, files=4, blocks_per_file=10)
+            transport = RedirectTransport(registry.url, Transport())
+
+            full = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport, summary=full)
+            requests = dict(registry.requests)
+            registry.requests.clear()
+
+            sources = []
+            for index in range(1, 4):
+                with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                    run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport, output_format="jsonl", shard=(index, 3))
+                pathlib.Path(folder, f"shard{index}.jsonl").write_text(stdout.getvalue())
+                sources.append({get_request_key(record["target"], record["source"]) for record in read_records(f"{folder}/shard{index}.jsonl") if record["type"] == "resource"})
+            transport.close()
+
+            self.assertEqual(dict(registry.requests), requests)
+            self.assertTrue(all(shard_sources for shard_sources in sources))
+            self.assertEqual(len(set.union(*sources)), sum(len(shard_sources) for shard_sources in sources))
+
+            records = [record for index in range(1, 4) for record in read_records(f"{folder}/shard{index}.jsonl")]
+            resources, totals, missing = merge_plan_records(records + records)
+            self.assertEqual(totals, full)
+            self.assertEqual(len(resources), full["upgrade"] + full["downgrade"] + full["no change"] + full["failure"])
+            self.assertEqual(missing, [])
+            self.assertEqual(merge_plan_records(records[:1] + [record for record in records if record["type"] == "summary" and record["shard"] != "2/3"])[2], ["2/3"])
+
+            process = subprocess.run([sys.executable, "-c", script, "report", "merge", f"{folder}/shard1.jsonl", f"{folder}/shard2.jsonl", f"{folder}/shard3.jsonl", "--no-color"], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertIn(f'Plan: {full["upgrade"]} to upgrade (+), {full["downgrade"]} to downgrade (-), {full["no change"]} not to change (~)', process.stdout)
+
+            process = subprocess.run([sys.executable, "-c", script, "report", "merge", f"{folder}/shard1.jsonl", "--output", "json"], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+            self.assertEqual(process.returncode, 1)
+            self.assertEqual(json.loads(process.stdout)[-1]["missing_shards"], ["2/3", "3/3"])
+
+    def test_write_metrics(self):
+        """
+        Test that metrics count every resource action, request and cache lookup and are written as OpenMetrics or JSON.
+        """
+
+        with tempfile.TemporaryDirectory() as folder, FakeRegistry() as registry:
+            files = write_workspace(folder, files=2, blocks_per_file=4)
+            transport = RedirectTransport(registry.url, Transport())
+            cache = VersionCache(cache_folder=folder)
+            cache.set("providers", "hashicorp/aws", {"status_code": 200, "reason": "OK", "versions": ["1.0.0"]})
+            tracer = Tracer()
+            summary = {}
+
+            with tracing(tracer), contextlib.redirect_stdout(io.StringIO()):
+                with tracer.span("total"):
+                    run_plan_apply(files, DEPENDENCY_PATTERNS, transport=transport, cache=cache, summary=summary)
+            transport.close()
+
+            metrics = get_metrics(tracer, summary, folder)
+            write_metrics(f"{folder}/tfmesh.prom", metrics)
+            write_metrics(f"{folder}/tfmesh.json", metrics, "json")
+            text = pathlib.Path(folder, "tfmesh.prom").read_text()
+
+            self.assertEqual(json.loads(pathlib.Path(folder, "tfmesh.json").read_text()), json.loads(json.dumps(metrics)))
+            cache.close()
+
+        self.assertEqual(sum(metrics["resources"].values()), 9)
+        self.assertEqual(metrics["resources"]["failure"], 0)
+        self.assertEqual(metrics["files_scanned"], 2)
+        self.assertEqual(sum(request["count"] for request in metrics["requests"].values()), sum(registry.requests.values()))
+        self.assertEqual((metrics["cache"]["hits"], metrics["cache"]["misses"]), (1, 8))
+        self.assertGreater(metrics["parse_seconds"], 0)
+        self.assertIn(f'tfmesh_resources{{workspace="{folder}",action="failure"}} 0', text)
+        self.assertIn(f'tfmesh_http_request_duration_seconds_bucket{{workspace="{folder}",host="127.0.0.1",le="+Inf"}} {sum(registry.requests.values())}', text)
+        self.assertIn(f'tfmesh_cache_hit_ratio{{workspace="{folder}"}} {1 / 9}', text)
+        self.assertEqual(re.findall(r'_bucket\{[^}]*le="([^"]*)"', text), ["0.005", "0.01", "0.025", "0.05", "0.1", "0.25", "0.5", "1.0", "2.5", "5.0", "10.0", "+Inf"])
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_import_defers_network_and_process_modules(self):
+        """
+        Test that importing the CLI leaves network and process modules unimported.  The time budget is checked by benchmarks.startup.
+        """
+        script = "import sys; from tfmesh import cli; print(' '.join(module for module in sys.modules))"
+        process = subprocess.run([sys.executable, "-c", script], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual([module for module in DEFERRED_MODULES if module in process.stdout.split()], [])
+
+    def test_commands_without_network_do_not_import_requests(self):
+        """
+        Test that commands which never use the network do not import requests.
+        """
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:], standalone_mode=False); print('requests' in sys.modules)"
+
+        with tempfile.TemporaryDirectory() as folder:
+            pathlib.Path(folder, "main.tf").write_text(pathlib.Path(__file__).parent.joinpath("test.tf").read_text())
+            environment = dict(os.environ, XDG_CACHE_HOME=folder)
+
+            for command in [["--help"], ["get", "providers", "--terraform-folder", folder], ["get", "provider", "aws", "code", "--terraform-folder", folder], ["set", "provider", "aws", "constraint", "~>3.0", "--terraform-folder", folder]]:
+                process = subprocess.run([sys.executable, "-c", script, *command], cwd=pathlib.Path(__file__).parent.parent, env=environment, capture_output=True, text=True)
+                self.assertEqual(process.returncode, 0, process.stderr)
+                self.assertEqual(process.stdout.strip().splitlines()[-1], "False", command)
+
+            self.assertIn("~>3.0", pathlib.Path(folder, "main.tf").read_text())
+
+    def test_parse_index_uses_cache_folder(self):
+        """
+        Test that the parse index is kept in the cache folder given to a command and is only created once files are parsed.
+        """
+        script = "import sys; from tfmesh import cli; cli(sys.argv[1:], standalone_mode=False)"
+
+        with tempfile.TemporaryDirectory() as folder:
+            pathlib.Path(folder, "main.tf").write_text(pathlib.Path(__file__).parent.joinpath("test.tf").read_text())
+            environment = dict(os.environ, XDG_CACHE_HOME=folder)
+            cache_folder = f"{folder}/custom"
+
+            parse_index = ParseIndex(cache_folder=cache_folder)
+            get_dependency_attributes([], {"providers": DEPENDENCY_PATTERNS["providers"]}, parse_index=parse_index)
+            self.assertFalse(parse_index.path.exists())
+            parse_index.close()
+
+            for command in [["get", "provider", "aws", "code", "--terraform-folder", folder, "--cache-folder", cache_folder], ["cache", "stats", "--cache-folder", cache_folder]]:
+                process = subprocess.run([sys.executable, "-c", script, *command], cwd=pathlib.Path(__file__).parent.parent, env=environment, capture_output=True, text=True)
+                self.assertEqual(process.returncode, 0, process.stderr)
+
+            self.assertIn(f"path: {cache_folder}/parse.db", process.stdout)
+            self.assertIn("files: 1", process.stdout)
+            self.assertFalse(pathlib.Path(folder, "tfmesh", "parse.db").exists())
+
+    def test_compare_benchmark_results(self):
+        """
+        Test that benchmarks slower than the baseline by more than the threshold are regressions, and that a missing baseline explains how to save one.
+        """
+        baseline = {"benchmarks": {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}, "c": {"seconds": 1.0}}}
+        current = {"benchmarks": {"a": {"seconds": 1.05}, "b": {"seconds": 1.5}, "c": {"seconds": 0.5}, "new": {"seconds": 1.0}}}
+
+        rows, regressions = compare_results(baseline, current, threshold=0.1)
+
+        self.assertEqual([row[0] for row in rows], ["a", "b", "c"])
+        self.assertEqual(regressions, ["b"])
+        self.assertEqual(compare_results(baseline, current, threshold=0.6)[1], [])
+
+        with tempfile.TemporaryDirectory() as folder:
+            process = subprocess.run([sys.executable, "-m", "benchmarks.micro", "compare", f"{folder}/baseline.json"], cwd=pathlib.Path(__file__).parent.parent, capture_output=True, text=True)
+        self.assertEqual(process.returncode, 1)
+        self.assertIn(f"run --save {folder}/baseline.json", process.stderr)
+
+    def test_get_github_module_versions_batch(self):
+        """
+        Test that tags for many repos are fetched in batches and paged until complete.
+        """
+        transport = FakeTransport({}, tags={
+            ("jsoconno", "a"): ["v1.0.0", "v1.1.0", "v1.2.0", "v2.0.0", "v2.1.0"],
+            ("jsoconno", "b"): ["v0.1.0"],
+            ("jsoconno", "c"): ["v3.0.0", "v3.1.0"],
+        })
+        repositories = [("jsoconno", "a"), ("jsoconno", "b"), ("jsoconno", "c"), ("jsoconno", "missing")]
+
+        results = get_github_module_versions_batch(repositories, token="token", transport=transport, batch_size=3)
+
+        self.assertEqual(results[("jsoconno", "a")]["versions"], ["v1.0.0", "v1.1.0", "v1.2.0", "v2.0.0", "v2.1.0"])
+        self.assertEqual(results[("jsoconno", "b")]["versions"], ["v0.1.0"])
+        self.assertEqual(results[("jsoconno", "c")]["versions"], ["v3.0.0", "v3.1.0"])
+        self.assertEqual(results[("jsoconno", "missing")]["status_code"], 404)
+        self.assertEqual(len(transport.urls), 3)
+
+    def test_resolve_available_versions_batches_github_modules(self):
+        """
+        Test that GitHub modules are resolved with GraphQL when a token is set and with REST otherwise.
+        """
+        resources = {
+            "modules": {
+                "a": {"target": "modules", "source": "github.com/jsoconno/a"},
+                "b": {"target": "modules", "source": "git::https://github.com/jsoconno/b.git"},
+            }
+        }
+        tags = {("jsoconno", "a"): ["v1.0.0"], ("jsoconno", "b"): ["v2.0.0"]}
+
+        transport = FakeTransport({}, tags=tags)
+        with mock.patch.dict(os.environ, {"TFMESH_GITHUB_TOKEN": "token"}):
+            result = resolve_available_versions(resources, transport=transport)
+
+        self.assertEqual(transport.urls, ["https://api.github.com/graphql"])
+        self.assertEqual(result[("modules", "b")]["versions"], ["v2.0.0"])
+
+        with tempfile.TemporaryDirectory() as folder:
+            for run in range(2):
+                cache = VersionCache(cache_folder=folder)
+                transport = FakeTransport({}, tags=tags)
+                with mock.patch.dict(os.environ, {"TFMESH_GITHUB_TOKEN": "token"}):
+                    result = resolve_available_versions(resources, cache=cache, transport=transport)
+                cache.close()
+
+            self.assertEqual(transport.urls, [])
+            self.assertEqual((cache.hits, cache.misses), (2, 0))
+            self.assertEqual(result[("modules", "a")]["versions"], ["v1.0.0"])
+
+        transport = FakeTransport({
+            "https://api.github.com/repos/jsoconno/a/tags?per_page=100": (200, '[{"name": "v1.0.0"}]'),
+            "https://api.github.com/repos/jsoconno/b/tags?per_page=100": (200, '[{"name": "v2.0.0"}]'),
+        }, tags=tags)
+        with mock.patch.dict(os.environ, {"TFMESH_GITHUB_TOKEN": ""}):
+            result = resolve_available_versions(resources, transport=transport)
+
+        self.assertEqual(len(transport.urls), 2)
+        self.assertNotIn("https://api.github.com/graphql", transport.urls)
+        self.assertEqual(result[("modules", "a")]["versions"], ["v1.0.0"])
+
+    def test_transport_conditional_requests(self):
+        """
+        Test that stored responses are revalidated with ETags and that stalled requests time out.
+        """
+        statuses = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/slow":
+                    time.sleep(0.5)
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    statuses.append(304)
+                    return
+                body = b'{"versions": ["1.0.0"]}'
+                self.send_response(200)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                statuses.append(200)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/providers/hashicorp/aws"
+
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                cache = VersionCache(cache_folder=folder)
+                transport = Transport(read_timeout=0.2, validators=cache)
+
+                first = transport.get(url)
+                second = transport.get(url)
+                slow = transport.get(url.replace("/v1/providers/hashicorp/aws", "/slow"))
+
+                transport.close()
+                cache.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(statuses[:2], [200, 304])
+        self.assertEqual((first.status_code, first.text), (200, '{"versions": ["1.0.0"]}'))
+        self.assertEqual((second.status_code, second.text), (200, '{"versions": ["1.0.0"]}'))
+        self.assertEqual(slow.status_code, 599)
+
     def test_color(self):
         """
         Test that all colors are present and that they match the required pattern.
@@ -276,6 +1245,7 @@ class TestCore(unittest.TestCase):
         result = sort_versions(versions)
 
         self.assertEqual(result, ["2.0", "1.10.0", "1.9.0", "1.1.1", "1.0.0"])
+        self.assertEqual(sort_versions(["1.3.0", "1.3.0-alpha20220622", "latest", "1.2.0"]), ["1.3.0", "1.3.0-alpha20220622", "1.2.0", "latest"])
 
     def test_get_dependency_attributes(self):
         """
@@ -301,5 +1271,314 @@ class TestCore(unittest.TestCase):
         self.assertEqual(len(dependencies["modules"]), 2)
         self.assertEqual("terraform", dependencies["terraform"]["terraform"]["name"])
 
+    def test_get_dependency_attributes_matches_full_scan(self):
+        """
+        Test that scanning blocks returns the same dependencies as running each pattern against whole files.
+        """
+        root = pathlib.Path(__file__).parent.parent
+        files = get_terraform_files(root / "terraform") + get_terraform_files(root / "tests")
+
+        expected = defaultdict(dict)
+        for file in files:
+            contents = open(file).read()
+            for target, pattern_list in DEPENDENCY_PATTERNS.items():
+                for pattern in pattern_list:
+                    for result in re.findall(pattern, contents, re.MULTILINE):
+                        expected[target][result[1]] = (file, result)
+
+        actual = get_dependency_attributes(files, DEPENDENCY_PATTERNS)
+
+        for target, dependencies in expected.items():
+            for name, (file, result) in dependencies.items():
+                self.assertEqual(actual[target][name]["filepath"], file)
+                self.assertEqual(actual[target][name]["code"], result[0])
+                self.assertEqual(actual[target][name]["version"], result[3])
+                self.assertEqual(actual[target][name]["constraint"], result[4])
+        self.assertEqual({target: len(d) for target, d in actual.items()}, {target: len(d) for target, d in expected.items()})
+
+    def test_get_dependency_attributes_in_parallel(self):
+        """
+        Test that parsing across a process pool returns the same dependencies, in the same order, as parsing in-process.
+        """
+
+        with tempfile.TemporaryDirectory() as folder:
+            for i in range(40):
+                with open(f"{folder}/main{i:02}.tf", "w") as f:
+                    f.write(f'module "consul{i % 7}" {{\n  source  = "hashicorp/consul/aws"\n  version = "0.{i}.0"\n}}\n')
+                    f.write(f'terraform {{\n  required_providers {{\n    aws{i % 5} = {{\n      source = "hashicorp/aws"\n      version = "3.{i}.0"\n    }}\n  }}\n}}\n')
+            files = get_terraform_files(folder)
+
+            self.assertEqual(get_parse_jobs(files, jobs=4), 1)
+
+            for parser in ["regex", "hcl"]:
+                expected = get_dependency_attributes(files, DEPENDENCY_PATTERNS, parser=parser, jobs=1)
+                with mock.patch("tfmesh.core.PARALLEL_PARSE_MIN_BYTES", 0):
+                    self.assertEqual(get_parse_jobs(files, jobs=4), 4)
+                    actual = get_dependency_attributes(files, DEPENDENCY_PATTERNS, parser=parser, jobs=4)
+
+                self.assertEqual(json.dumps(actual), json.dumps(expected))
+                self.assertEqual(actual["modules"]["consul4"]["filepath"], [file for file in files if int(file[-5:-3]) % 7 == 4][-1])
+
+    def test_get_dependency_attributes_with_parse_index(self):
+        """
+        Test that only changed and new files are parsed again when a parse index is used.
+        """
+        pattern_map = {target: DEPENDENCY_PATTERNS[target] for target in ["providers", "modules"]}
+
+        with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as cache_folder:
+            for i in range(5):
+                with open(f"{folder}/main{i}.tf", "w") as f:
+                    f.write(f'module "consul{i}" {{\n  source  = "hashicorp/consul/aws"\n  version = "0.{i}.0"\n}}\n')
+            files = sorted(get_terraform_files(folder))
+            parse_index = ParseIndex(cache_folder=cache_folder)
+            expected = get_dependency_attributes(files, pattern_map)
+
+            actual = get_dependency_attributes(files, pattern_map, parse_index=parse_index)
+            self.assertEqual(json.dumps(actual), json.dumps(expected))
+            self.assertEqual((parse_index.hits, parse_index.misses), (0, 5))
+
+            with mock.patch("tfmesh.core.get_file_dependencies", wraps=get_file_dependencies) as parse:
+                actual = get_dependency_attributes(files, pattern_map, parse_index=parse_index)
+                self.assertEqual(json.dumps(actual), json.dumps(expected))
+                self.assertEqual(parse.call_count, 0)
+
+                with open(files[1], "w") as f:
+                    f.write('module "consul1" {\n  source  = "hashicorp/consul/aws"\n  version = "1.0.0"\n}\n')
+                os.remove(files[2])
+                with open(f"{folder}/main5.tf", "w") as f:
+                    f.write('module "consul5" {\n  source  = "hashicorp/consul/aws"\n  version = "0.5.0"\n}\n')
+
+                actual = get_dependency_attributes(sorted(get_terraform_files(folder)), pattern_map, parse_index=parse_index)
+                self.assertEqual([call.args[0] for call in parse.call_args_list], [files[1], f"{folder}/main5.tf"])
+                self.assertEqual(actual["modules"]["consul1"]["version"], "1.0.0")
+                self.assertEqual(sorted(actual["modules"]), ["consul0", "consul1", "consul3", "consul4", "consul5"])
+
+                parse.reset_mock()
+                get_dependency_attributes(files[:1], {"modules": pattern_map["modules"]}, parse_index=parse_index)
+                self.assertEqual(parse.call_count, 1)
+
+            parse_index.racy_window_ns = 0
+            indexed, fingerprint = parse_index.get(get_parse_namespace(pattern_map), files[0])
+            self.assertIsNone(fingerprint)
+            self.assertEqual(indexed[0]["version"], "0.0.0")
+            self.assertEqual(parse_index.stats()["namespaces"], 2)
+            self.assertEqual(parse_index.clear(), 7)
+
+    def test_find_dependencies_does_not_rescan(self):
+        """
+        Test that inputs which make the patterns backtrack are never searched twice and that provider entries are each tried once.
+
+        Parsing time is checked by python -m benchmarks.micro scaling.
+        """
+        class RecordingPattern:
+            def __init__(self, regex):
+                self.regex = regex
+                self.searched = 0
+                self.matches = 0
+
+            def finditer(self, string, pos=0, endpos=sys.maxsize):
+                self.searched += min(endpos, len(string)) - pos
+                return self.regex.finditer(string, pos, endpos)
+
+            def match(self, string, pos=0, endpos=sys.maxsize):
+                self.matches += 1
+                return self.regex.match(string, pos, endpos)
+
+        provider_matches = {}
+        for name, generate in ADVERSARIAL_INPUTS.items():
+            for size in [100, 1000]:
+                contents = generate(size)
+                recorders = {}
+                with mock.patch("tfmesh.core.compile_pattern", side_effect=lambda pattern: recorders.setdefault(pattern, RecordingPattern(re.compile(pattern, re.MULTILINE)))):
+                    find_dependencies(contents, DEPENDENCY_PATTERNS)
+
+                for pattern, recorder in recorders.items():
+                    self.assertLessEqual(recorder.searched, len(contents), name)
+                self.assertEqual(recorders[patterns("PROVIDER")].searched, 0, name)
+                provider_matches.setdefault(name, []).append(recorders[patterns("PROVIDER")].matches)
+
+        for name, matches in provider_matches.items():
+            self.assertEqual(matches[0], matches[1], name)
+            self.assertLessEqual(matches[1], 2, name)
+
+    def test_hcl_parser_matches_regex_parser(self):
+        """
+        Test that the hcl and regex parsers return the same dependencies and spans for the repo fixtures.
+        """
+        root = pathlib.Path(__file__).parent.parent
+
+        for folder in [root / "terraform", root / "tests"]:
+            files = get_terraform_files(folder)
+            regex_dependencies = get_dependency_attributes(files, DEPENDENCY_PATTERNS, parser="regex")
+            hcl_dependencies = get_dependency_attributes(files, DEPENDENCY_PATTERNS, parser="hcl")
+
+            self.assertEqual(json.dumps(hcl_dependencies), json.dumps(regex_dependencies))
+
+    def test_hcl_parser_ignores_comments_strings_and_heredocs(self):
+        """
+        Test that braces and blocks inside comments, strings and heredocs do not confuse the hcl parser.
+        """
+        contents = '''# module "commented" { source = "hashicorp/consul/aws" version = "1.0.0" }
+locals {
+  doc = <<EOT
+module "heredoc" {
+  source  = "hashicorp/consul/aws"
+  version = "1.0.0"
+}
+EOT
+  text = "{ not a brace ${var.name}"
+}
+
+terraform {
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws" # a comment with a }
+      version = "4.0.0" # ~>4.0
+    }
+  }
+  required_version = "1.2.0"
+}
+
+module "real" {
+  version = "2.0.0" # >=2.0.0
+  source  = "hashicorp/consul/aws"
+  settings = { a = "}" }
+}
+'''
+        dependencies = {(target, result[1]): (result, spans) for target, result, spans in hcl.find_dependencies(contents)}
+
+        self.assertEqual(sorted(dependencies), [("modules", "real"), ("providers", "aws"), ("terraform", "terraform")])
+        self.assertEqual(dependencies[("providers", "aws")][0][3:5], ("4.0.0", "~>4.0"))
+        self.assertEqual(dependencies[("modules", "real")][0][2:5], ("hashicorp/consul/aws", "2.0.0", ">=2.0.0"))
+        self.assertEqual(dependencies[("terraform", "terraform")][0][3], "1.2.0")
+
+        start, end = dependencies[("modules", "real")][1]["version"]
+        self.assertEqual(contents[start:end], "2.0.0")
+        start, end = dependencies[("modules", "real")][1]["code"]
+        self.assertTrue(contents[start:end].startswith('module "real"') and contents[start:end].endswith("}"))
+
+    def test_hcl_parser_handles_unclosed_and_nested_input(self):
+        """
+        Test that the hcl parser returns the complete dependencies for deeply nested, unclosed and malformed input.
+        """
+        header = 'terraform {\n  required_version = "1.1.3"\n  required_providers {\n    aws = {\n      source = "hashicorp/aws"\n      version = "3.71.0" # ~>3.0\n    }\n  }\n}\n'
+        inputs = {
+            "unclosed providers": header + "terraform {\n  required_providers {\n" + "    aws = {\n" * 5000,
+            "nested objects": header + "locals {\n  a = " + "{ b = " * 5000 + "1" + " }" * 5000 + "\n}\n",
+            "unclosed blocks": header + 'module "m" {\n  dynamic "x" {\n' * 5000,
+            "nested templates": header + 'locals {\n  a = "' + "${\"" * 5000 + "\n}\n",
+            "stray braces": header + "}\n]\n)\n" * 100 + '= "x"\n{\n',
+        }
+
+        with tempfile.TemporaryDirectory() as folder:
+            for name, contents in inputs.items():
+                path = f"{folder}/{name.replace(' ', '_')}.tf"
+                with open(path, "w") as f:
+                    f.write(contents)
+
+                dependencies = get_dependency_attributes([path], DEPENDENCY_PATTERNS, parser="hcl")
+
+                self.assertEqual(dependencies["terraform"]["terraform"]["version"], "1.1.3", name)
+                self.assertEqual(dependencies["providers"]["aws"]["version"], "3.71.0", name)
+                self.assertEqual(dependencies["providers"]["aws"]["constraint"], "~>3.0", name)
+
+    def test_update_version_with_spans(self):
+        """
+        Test that versions and constraints are replaced using spans, including adding a missing constraint.
+        """
+        pattern_map = {target: DEPENDENCY_PATTERNS[target] for target in ["terraform", "providers"]}
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = f"{folder}/versions.tf"
+            with open(path, "w") as f:
+                f.write(open(pathlib.Path(__file__).parent / "test.tf").read())
+
+            for parser in ["regex", "hcl"]:
+                dependencies = get_dependency_attributes([path], pattern_map, parser=parser)
+                aws = dependencies["providers"]["aws"]
+                update_version(path, aws["code"], "version", "3.72.0", spans=aws["spans"])
+
+                dependencies = get_dependency_attributes([path], pattern_map, parser=parser)
+                terraform = dependencies["terraform"]["terraform"]
+                update_version(path, terraform["code"], "constraint", ">=1.0.0", spans=terraform["spans"])
+
+                dependencies = get_dependency_attributes([path], pattern_map, parser=parser)
+                self.assertEqual(dependencies["providers"]["aws"]["version"], "3.72.0")
+                self.assertEqual(dependencies["providers"]["aws"]["constraint"], "~>3.0")
+                self.assertEqual(dependencies["terraform"]["terraform"]["constraint"], ">=1.0.0")
+
+            contents = open(path).read()
+
+        self.assertIn('required_version = "1.1.3" # >=1.0.0\n', contents)
+
+    def test_apply_edits(self):
+        """
+        Test that edits are written once per file, only change their own code and roll back when a write fails.
+        """
+        pattern_map = {"modules": DEPENDENCY_PATTERNS["modules"]}
+        module = 'module "{name}" {{\n  source  = "hashicorp/consul/aws"\n  version = "0.1.0"\n}}\n'
+
+        with tempfile.TemporaryDirectory() as folder:
+            for file in ["a.tf", "b.tf"]:
+                with open(f"{folder}/{file}", "w") as f:
+                    f.write("".join(module.format(name=name) for name in ["one", "two", "three"]))
+            files = get_terraform_files(folder)
+            originals = {file: open(file).read() for file in files}
+
+            dependencies = get_dependency_attributes(files, pattern_map)
+            edits = [
+                {"filepath": files[0], "code": dependencies["modules"]["two"]["code"], "attribute": "version", "value": "0.2.0", "spans": dependencies["modules"]["two"]["spans"]},
+                {"filepath": files[0], "code": dependencies["modules"]["two"]["code"], "attribute": "constraint", "value": "~>0.2", "spans": dependencies["modules"]["two"]["spans"]},
+                {"filepath": files[1], "code": dependencies["modules"]["three"]["code"], "attribute": "version", "value": "0.3.0", "spans": None},
+            ]
+
+            real_replace = os.replace
+
+            def replace(source, destination):
+                if destination == files[1]:
+                    raise OSError("disk full")
+                real_replace(source, destination)
+
+            with mock.patch("tfmesh.core.os.replace", side_effect=replace):
+                with self.assertRaises(EditError):
+                    apply_edits(edits)
+            self.assertEqual({file: open(file).read() for file in files}, originals)
+            self.assertEqual(sorted(os.listdir(folder)), ["a.tf", "b.tf"])
+
+            with open(f"{files[1]}.backup", "w") as f:
+                f.write("previous backup")
+            with mock.patch("tfmesh.core.os.replace", side_effect=replace):
+                with self.assertRaises(EditError):
+                    apply_edits(edits, backup=True)
+            self.assertEqual({file: open(file).read() for file in files}, originals)
+            self.assertEqual(sorted(os.listdir(folder)), ["a.tf", "b.tf", "b.tf.backup"])
+            self.assertEqual(open(f"{files[1]}.backup").read(), "previous backup")
+            os.remove(f"{files[1]}.backup")
+
+            # a failed restore leaves the file whole and is reported
+            calls = []
+
+            def replace_then_fail(source, destination):
+                calls.append(destination)
+                if destination == files[1] or calls.count(files[0]) > 1:
+                    raise OSError("disk full")
+                real_replace(source, destination)
+
+            with mock.patch("tfmesh.core.os.replace", side_effect=replace_then_fail):
+                with self.assertRaisesRegex(EditError, "could not be restored"):
+                    apply_edits(edits)
+            self.assertEqual(open(files[0]).read(), module.format(name="one") + module.format(name="two").replace('"0.1.0"', '"0.2.0" # ~>0.2') + module.format(name="three"))
+            self.assertEqual(sorted(os.listdir(folder)), ["a.tf", "b.tf"])
+            with open(files[0], "w") as f:
+                f.write(originals[files[0]])
+
+            self.assertEqual(apply_edits(edits, backup=True), 2)
+            self.assertEqual(open(files[0]).read(), module.format(name="one") + module.format(name="two").replace('"0.1.0"', '"0.2.0" # ~>0.2') + module.format(name="three"))
+            self.assertEqual(open(files[1]).read(), module.format(name="one") + module.format(name="two") + module.format(name="three").replace('"0.1.0"', '"0.3.0"'))
+            self.assertEqual(open(f"{files[0]}.backup").read(), originals[files[0]])
+
+            with self.assertRaises(EditError):
+                apply_edits([dict(edits[0], code="missing", spans=None)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
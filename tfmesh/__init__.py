@@ -1,16 +1,33 @@
 import click
+import functools
 from pathlib import Path
 import sys
 from tfmesh.core import *
+from tfmesh.cache import ParseIndex, SnapshotError, VersionCache, VersionSnapshot
+from tfmesh.metrics import get_metrics, write_metrics
+from tfmesh.trace import Tracer, format_timings, tracing
+from tfmesh.transport import Transport
 
 CONTEXT_SETTINGS = dict(auto_envvar_prefix='TFMESH')
 
 def workspace_options(f):
-    f = click.option("--terraform-folder", default="", help="The name of the folder where Terraform files are located (defaults to the current directory).")(f)
-    f = click.option("--terraform-file-pattern", default="*.tf", help="The pattern for matching Terraform files within the directory (defaults to *.tf).")(f)
-    f = click.option("--var", multiple=True, help="One or more variables to be set as environment variables in the format 'some=value'.")(f)
+    @functools.wraps(f)
+    def wrapper(*args, no_parse_cache, prune_folder, **kwargs):
+        # the index is kept with the version cache, and only opened once files are parsed
+        parse_index = None if no_parse_cache else ParseIndex(cache_folder=kwargs.get("cache_folder"))
+        pruned_folders = PRUNED_FOLDERS + prune_folder
+        return f(*args, parse_index=parse_index, pruned_folders=pruned_folders, **kwargs)
 
-    return f
+    wrapper = click.option("--terraform-folder", default="", help="The name of the folder where Terraform files are located (defaults to the current directory).")(wrapper)
+    wrapper = click.option("--terraform-file-pattern", multiple=True, default=["*.tf"], help="One or more patterns for matching Terraform files within the directory (defaults to *.tf).")(wrapper)
+    wrapper = click.option("--exclude", multiple=True, help="One or more patterns for files and folders to skip within the directory.")(wrapper)
+    wrapper = click.option("--prune-folder", multiple=True, help="One or more folder names to skip in addition to .git, .terraform and node_modules.")(wrapper)
+    wrapper = click.option("--var", multiple=True, help="One or more variables to be set as environment variables in the format 'some=value'.")(wrapper)
+    wrapper = click.option("--parser", type=click.Choice(["hcl", "regex"]), default="regex", help="The parser used to find versioned resources in Terraform files (defaults to regex).")(wrapper)
+    wrapper = click.option("--jobs", type=click.IntRange(min=1), default=None, help="The number of processes used to parse large workspaces (defaults to the number of CPUs).")(wrapper)
+    wrapper = click.option("--no-parse-cache", is_flag=True, help="Parses every Terraform file instead of reusing results for unchanged files.")(wrapper)
+
+    return wrapper
 
 def get_options(f):
     f = click.argument("attribute", required=False)(f)
@@ -27,18 +44,111 @@ def set_options(f):
     f = click.option("--ignore-constraints", is_flag=True, help="Allows the version to be set to a valid version that does not meet the defined constraint.")(f)
     f = click.option("--what-if", is_flag=True, help="Allows for a dry run to see what would happen before making changes.")(f)
     f = click.option("--force", is_flag=True, help="Allows the version to be set to any value without validation.")(f)
+    f = click.option("--backup", is_flag=True, help="Keeps a copy of each changed file with a .backup extension.")(f)
 
     return f
 
+def parse_shard(ctx, param, value):
+    """
+    Parses a shard given as INDEX/COUNT into an (index, count) tuple.
+    """
+    if value is None:
+        return None
+
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("must be in the format INDEX/COUNT, such as 2/4.")
+
+    if not 1 <= index <= count:
+        raise click.BadParameter("INDEX must be from 1 to COUNT.")
+
+    return index, count
+
 def plan_apply_options(f):
     f = click.option("--target", nargs=2, multiple=True, help="Takes arguments `TYPE` and `NAME` to allow for specific update targets.  For example, `--target provider aws`.  Multiple targets are allowed.")(f)
     f = click.option("--exclude-prerelease", is_flag=True, help="Ensures the set version is not a pre-release.")(f)
     f = click.option("--ignore-constraints", is_flag=True, help="Allows the version to be set to a valid version that does not meet the defined constraint.")(f)
     f = click.option("--no-color", is_flag=True, help="Removes terminal color formatting, primarily for automation purposes.")(f)
     f = click.option("--verbose", is_flag=True, help="Returns all resources including those with no version changes.")(f)
-    
+    f = click.option("--parallelism", type=click.IntRange(min=1), default=10, help="The maximum number of concurrent requests made when getting available versions (defaults to 10).")(f)
+    f = click.option("--shard", default=None, callback=parse_shard, help="Only includes the resources in shard INDEX of COUNT, such as 2/4, so the work can be split between machines.  Resources with the same source are always in the same shard.")(f)
+
     return f
 
+def output_options(f):
+    f = click.option("--output", "output_format", type=click.Choice(["text", "json", "jsonl"]), default="text", help="The output format.  jsonl writes one JSON record per line as results arrive (defaults to text).")(f)
+
+    return f
+
+def network_options(f):
+    @functools.wraps(f)
+    def wrapper(*args, cache_folder, cache_ttl, cache_max_entries, refresh, offline, connect_timeout, read_timeout, versions_from, **kwargs):
+        if versions_from:
+            try:
+                cache = VersionSnapshot(versions_from)
+            except (OSError, SnapshotError) as e:
+                raise click.ClickException(str(e))
+            transport = Transport(
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout
+            )
+        else:
+            cache = VersionCache(
+                cache_folder=cache_folder,
+                ttl=cache_ttl,
+                max_entries=cache_max_entries,
+                refresh=refresh,
+                offline=offline
+            )
+            transport = Transport(
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                validators=cache
+            )
+        return f(*args, cache=cache, transport=transport, **kwargs)
+
+    wrapper = click.option("--cache-folder", default="", help="The folder where available versions are cached (defaults to $XDG_CACHE_HOME/tfmesh).")(wrapper)
+    wrapper = click.option("--cache-ttl", type=click.IntRange(min=0), default=3600, help="The number of seconds cached versions are considered fresh (defaults to 3600).")(wrapper)
+    wrapper = click.option("--cache-max-entries", type=click.IntRange(min=1), default=1000, help="The maximum number of cached version lists before the least recently used are evicted (defaults to 1000).")(wrapper)
+    wrapper = click.option("--refresh", is_flag=True, help="Ignores cached versions and refreshes them from their sources.")(wrapper)
+    wrapper = click.option("--offline", is_flag=True, help="Only uses cached versions and makes no network requests.")(wrapper)
+    wrapper = click.option("--connect-timeout", type=click.FloatRange(min=0, min_open=True), default=5, help="The number of seconds to wait for a connection to a version source (defaults to 5).")(wrapper)
+    wrapper = click.option("--read-timeout", type=click.FloatRange(min=0, min_open=True), default=30, help="The number of seconds to wait for a version source to respond (defaults to 30).")(wrapper)
+    wrapper = click.option("--versions-from", type=click.Path(exists=True), default=None, help="A snapshot file, or a folder of snapshot files, to get all available versions from without network access.")(wrapper)
+
+    return wrapper
+
+def trace_options(f):
+    @functools.wraps(f)
+    def wrapper(*args, timings, trace_file, metrics_file, metrics_format, **kwargs):
+        summary = {}
+        if not timings and not trace_file and not metrics_file:
+            return f(*args, summary=summary, **kwargs)
+
+        tracer = Tracer()
+        with tracing(tracer):
+            with tracer.span("total"):
+                result = f(*args, summary=summary, **kwargs)
+
+        if timings:
+            # keep machine readable output parseable
+            click.echo(f"\n{format_timings(tracer)}", err=kwargs.get("output_format", "text") != "text")
+        if trace_file:
+            tracer.write(trace_file)
+        if metrics_file:
+            workspace = str(Path(kwargs.get("terraform_folder") or ".").absolute())
+            write_metrics(metrics_file, get_metrics(tracer, summary, workspace), metrics_format)
+
+        return result
+
+    wrapper = click.option("--timings", is_flag=True, help="Prints the time spent in each phase and on requests to each host.")(wrapper)
+    wrapper = click.option("--trace-file", default=None, help="A file to write a trace of every phase and request to in the Chrome trace event format.")(wrapper)
+    wrapper = click.option("--metrics-file", default=None, help="A file to write resource actions, request, cache and parse metrics to.")(wrapper)
+    wrapper = click.option("--metrics-format", type=click.Choice(["openmetrics", "json"]), default="openmetrics", help="The format of the metrics file (defaults to openmetrics).")(wrapper)
+
+    return wrapper
+
 @click.group("cli", invoke_without_command=True)
 @click.version_option()
 def cli():
@@ -75,8 +185,10 @@ def set():
 
 @get.command(context_settings=CONTEXT_SETTINGS)
 @get_options
+@output_options
 @workspace_options
-def terraform(terraform_file_pattern, terraform_folder, attribute, allowed, exclude_prerelease, top, var):
+@network_options
+def terraform(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, attribute, allowed, exclude_prerelease, top, var, cache, transport, parse_index, output_format):
     """
     Gets a given attribute for the Terraform executable.
     """
@@ -87,7 +199,9 @@ def terraform(terraform_file_pattern, terraform_folder, attribute, allowed, excl
     result = get_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "terraform": [patterns("TERRAFORM")]
@@ -97,32 +211,47 @@ def terraform(terraform_file_pattern, terraform_folder, attribute, allowed, excl
         attribute=attribute,
         allowed=allowed,
         exclude_prerelease=exclude_prerelease,
-        top=top
+        top=top,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        output_format=output_format
     )
     click.echo(result)
 
 @get.command(context_settings=CONTEXT_SETTINGS)
+@output_options
 @workspace_options
-def providers(terraform_file_pattern, terraform_folder, var):
+def providers(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, var, parse_index, output_format):
     """
     Lists all tracked providers.
     """
     resources = get_resources(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "providers": [patterns("PROVIDER")],
-        }
+        },
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        output_format=output_format
     )
     click.echo(resources)
 
 @get.command(context_settings=CONTEXT_SETTINGS)
 @click.argument("name", type=str)
 @get_options
+@output_options
 @workspace_options
-def provider(terraform_file_pattern, terraform_folder, name, attribute, allowed, exclude_prerelease, top, var):
+@network_options
+def provider(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, name, attribute, allowed, exclude_prerelease, top, var, cache, transport, parse_index, output_format):
     """
     Gets a given attribute for provider.
     """
@@ -133,7 +262,9 @@ def provider(terraform_file_pattern, terraform_folder, name, attribute, allowed,
     result = get_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "providers": [patterns("PROVIDER")],
@@ -143,35 +274,50 @@ def provider(terraform_file_pattern, terraform_folder, name, attribute, allowed,
         attribute=attribute,
         allowed=allowed,
         exclude_prerelease=exclude_prerelease,
-        top=top
+        top=top,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        output_format=output_format
     )
     click.echo(result)
 
 @get.command(context_settings=CONTEXT_SETTINGS)
+@output_options
 @workspace_options
-def modules(terraform_file_pattern, terraform_folder, var):
+def modules(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, var, parse_index, output_format):
     """
     Lists all tracked modules.
     """
     resources = get_resources(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "modules": [
                 patterns("MODULE_REGISTRY"),
                 patterns("MODULE_GITHUB"),
             ],
-        }
+        },
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        output_format=output_format
     )
     click.echo(resources)
 
 @get.command(context_settings=CONTEXT_SETTINGS)
 @click.argument("name", type=str)
 @get_options
+@output_options
 @workspace_options
-def module(terraform_file_pattern, terraform_folder, name, attribute, allowed, exclude_prerelease, top, var):
+@network_options
+def module(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, name, attribute, allowed, exclude_prerelease, top, var, cache, transport, parse_index, output_format):
     """
     Gets a given attribute for module.
     """
@@ -182,7 +328,9 @@ def module(terraform_file_pattern, terraform_folder, name, attribute, allowed, e
     result = get_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "modules": [
@@ -195,14 +343,21 @@ def module(terraform_file_pattern, terraform_folder, name, attribute, allowed, e
         attribute=attribute,
         allowed=allowed,
         exclude_prerelease=exclude_prerelease,
-        top=top
+        top=top,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        output_format=output_format
     )
     click.echo(result)
 
 @set.command(context_settings=CONTEXT_SETTINGS)
 @set_options
 @workspace_options
-def terraform(terraform_file_pattern, terraform_folder, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force):
+@network_options
+def terraform(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force, backup, cache, transport, parse_index):
     """
     Sets the version or constraint for the Terraform executable.
     """
@@ -213,7 +368,9 @@ def terraform(terraform_file_pattern, terraform_folder, attribute, value, exclud
     result = set_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "terraform": [patterns("TERRAFORM")],
@@ -225,7 +382,13 @@ def terraform(terraform_file_pattern, terraform_folder, attribute, value, exclud
         exclude_prerelease=exclude_prerelease,
         what_if=what_if,
         ignore_constraints=ignore_constraints,
-        force=force
+        force=force,
+        backup=backup,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index
     )
     click.echo(result)
 
@@ -233,7 +396,8 @@ def terraform(terraform_file_pattern, terraform_folder, attribute, value, exclud
 @click.argument("name", type=str)
 @set_options
 @workspace_options
-def provider(terraform_file_pattern, terraform_folder, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force):
+@network_options
+def provider(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force, backup, cache, transport, parse_index):
     """
     Sets the version or constraint for a given provider.
     """
@@ -244,7 +408,9 @@ def provider(terraform_file_pattern, terraform_folder, name, attribute, value, e
     result = set_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "providers": [patterns("PROVIDER")],
@@ -256,7 +422,13 @@ def provider(terraform_file_pattern, terraform_folder, name, attribute, value, e
         exclude_prerelease=exclude_prerelease,
         what_if=what_if,
         ignore_constraints=ignore_constraints,
-        force=force
+        force=force,
+        backup=backup,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index
     )
     click.echo(result)
 
@@ -264,7 +436,8 @@ def provider(terraform_file_pattern, terraform_folder, name, attribute, value, e
 @click.argument("name", type=str)
 @set_options
 @workspace_options
-def module(terraform_file_pattern, terraform_folder, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force):
+@network_options
+def module(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, var, force, backup, cache, transport, parse_index):
     """
     Sets the version or constraint for a given module.
     """
@@ -275,7 +448,9 @@ def module(terraform_file_pattern, terraform_folder, name, attribute, value, exc
     result = set_dependency_attribute(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
         ),
         patterns={
             "modules": [
@@ -290,22 +465,83 @@ def module(terraform_file_pattern, terraform_folder, name, attribute, value, exc
         exclude_prerelease=exclude_prerelease,
         what_if=what_if,
         ignore_constraints=ignore_constraints,
-        force=force
+        force=force,
+        backup=backup,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index
     )
     click.echo(result)
 
 @cli.command(context_settings=CONTEXT_SETTINGS)
+@trace_options
+@click.option("--out", "-out", "out", default=None, help="A file to save the plan to, so `tfmesh apply FILE` can make the same changes without getting versions again.")
+@click.option("--workspaces", multiple=True, help="One or more glob patterns for root module folders to plan together, relative to the Terraform folder.  For example, `--workspaces 'envs/*/*'`.")
+@click.option("--workspaces-file", type=click.Path(exists=True, dir_okay=False), default=None, help="A file listing root module folders or patterns to plan together, one per line.")
 @plan_apply_options
+@output_options
 @workspace_options
-def plan(terraform_file_pattern, terraform_folder, target, exclude_prerelease, ignore_constraints, no_color, verbose, var):
+@network_options
+def plan(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, target, exclude_prerelease, ignore_constraints, no_color, verbose, parallelism, shard, out, workspaces, workspaces_file, var, cache, transport, parse_index, summary, output_format):
     """
     Plans what version changes will be made to the configuration.
     """
     set_environment_variables(var)
+    if workspaces or workspaces_file:
+        if target or out:
+            raise click.UsageError("--target and --out cannot be used with --workspaces or --workspaces-file.")
+
+        workspace_folders, unmatched = get_workspaces(
+            patterns=workspaces,
+            manifest=workspaces_file,
+            root=terraform_folder,
+            pruned_folders=pruned_folders
+        )
+        for pattern in unmatched:
+            click.echo(f'No folders match "{pattern}".', err=output_format != "text")
+        if not workspace_folders:
+            raise click.UsageError("No workspaces were found.")
+
+        run_workspaces_plan(
+            workspaces=workspace_folders,
+            patterns = {
+                "terraform": [patterns("TERRAFORM")],
+                "providers": [patterns("PROVIDER")],
+                "modules": [
+                    patterns("MODULE_REGISTRY"),
+                    patterns("MODULE_GITHUB")
+                ]
+            },
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders,
+            root=terraform_folder,
+            verbose=verbose,
+            exclude_prerelease=exclude_prerelease,
+            ignore_constraints=ignore_constraints,
+            no_color=no_color,
+            parallelism=parallelism,
+            cache=cache,
+            transport=transport,
+            parser=parser,
+            jobs=jobs,
+            parse_index=parse_index,
+            summary=summary,
+            output_format=output_format,
+            shard=shard
+        )
+        return
+
+    file_stats = {}
     run_plan_apply(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders,
+            stats=file_stats
         ),
         patterns = {
             "terraform": [patterns("TERRAFORM")],
@@ -319,22 +555,55 @@ def plan(terraform_file_pattern, terraform_folder, target, exclude_prerelease, i
         verbose=verbose,
         exclude_prerelease=exclude_prerelease,
         ignore_constraints=ignore_constraints,
-        no_color=no_color
+        no_color=no_color,
+        parallelism=parallelism,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        file_stats=file_stats,
+        summary=summary,
+        output_format=output_format,
+        out=out,
+        shard=shard
     )
 
 @cli.command(context_settings=CONTEXT_SETTINGS)
+@trace_options
+@click.argument("plan_file", required=False, type=click.Path(exists=True, dir_okay=False))
 @click.option("--auto-approve", is_flag=True)
+@click.option("--backup", is_flag=True, help="Keeps a copy of each changed file with a .backup extension.")
 @plan_apply_options
+@output_options
 @workspace_options
-def apply(terraform_file_pattern, terraform_folder, target, exclude_prerelease, ignore_constraints, no_color, verbose, auto_approve, var):
+@network_options
+def apply(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, target, exclude_prerelease, ignore_constraints, no_color, verbose, parallelism, shard, plan_file, auto_approve, backup, var, cache, transport, parse_index, summary, output_format):
     """
-    Applies configuration version changes.
+    Applies configuration version changes, or the changes in a PLAN_FILE saved by plan.
     """
+    if plan_file and (target or shard or var):
+        raise click.UsageError("--target, --shard and --var cannot be used with PLAN_FILE.  They are applied when the plan is saved.")
+
+    if plan_file:
+        apply_plan(
+            plan_file,
+            backup=backup,
+            no_color=no_color,
+            summary=summary,
+            output_format=output_format
+        )
+        return
+
     set_environment_variables(var)
+    file_stats = {}
     run_plan_apply(
         terraform_files=get_terraform_files(
             terraform_folder=terraform_folder,
-            file_pattern=terraform_file_pattern
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders,
+            stats=file_stats
         ),
         patterns = {
             "terraform": [patterns("TERRAFORM")],
@@ -345,9 +614,137 @@ def apply(terraform_file_pattern, terraform_folder, target, exclude_prerelease,
             ]
         },
         apply=True,
+        backup=backup,
         target=target,
         verbose=verbose,
         exclude_prerelease=exclude_prerelease,
         ignore_constraints=ignore_constraints,
-        no_color=no_color
-    )
\ No newline at end of file
+        no_color=no_color,
+        parallelism=parallelism,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index,
+        file_stats=file_stats,
+        summary=summary,
+        output_format=output_format,
+        shard=shard
+    )
+
+@cli.group("report")
+def report():
+    """
+    Combines the results of plans.
+    """
+    pass
+
+@report.command(context_settings=CONTEXT_SETTINGS)
+@click.argument("files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--no-color", is_flag=True, help="Removes terminal color formatting, primarily for automation purposes.")
+@output_options
+def merge(files, no_color, output_format):
+    """
+    Merges the --output json or jsonl results of plans run with --shard into one plan summary.
+    """
+    records = []
+    for path in files:
+        try:
+            records += read_records(path)
+        except (OSError, ValueError) as e:
+            raise click.ClickException(f"{path} could not be read as json or jsonl ({e}).")
+
+    resources, totals, missing = merge_plan_records(records)
+
+    if output_format != "text":
+        summary = {"type": "summary", "apply": False, **totals, "results": len(files), "missing_shards": missing}
+        click.echo(format_json(resources + [summary], output_format))
+    else:
+        click.echo(f'{"" if no_color else colors("OK_GREEN")}Merged {len(resources)} resource(s) from {len(files)} result file(s).{"" if no_color else colors()}')
+        click.echo(f'{"" if no_color else colors("OK_GREEN")}Plan: {totals["upgrade"]} to upgrade (+), {totals["downgrade"]} to downgrade (-), {totals["no change"]} not to change (~){"" if no_color else colors()}')
+        if totals["failure"] >= 1:
+            click.echo(f'\n{"" if no_color else colors("FAIL")}Warning: {totals["failure"]} resource(s) failed to return a list of available versions.{"" if no_color else colors()}')
+
+    if missing:
+        click.echo(f'{"" if no_color else colors("FAIL")}Warning: there are no results for shard(s) {", ".join(missing)}.{"" if no_color else colors()}', err=True)
+        sys.exit(1)
+
+@cli.group("snapshot")
+def snapshot():
+    """
+    Manages snapshots of available versions for running without network access.
+    """
+    pass
+
+@snapshot.command(context_settings=CONTEXT_SETTINGS)
+@click.option("--output", default="versions.snapshot", help="The snapshot file to write (defaults to versions.snapshot).")
+@click.option("--parallelism", type=click.IntRange(min=1), default=10, help="The maximum number of concurrent requests made when getting available versions (defaults to 10).")
+@workspace_options
+@network_options
+def export(terraform_file_pattern, terraform_folder, exclude, pruned_folders, parser, jobs, output, parallelism, var, cache, transport, parse_index):
+    """
+    Writes the available versions of every resource to a snapshot file.
+    """
+    set_environment_variables(var)
+    result = export_snapshot(
+        terraform_files=get_terraform_files(
+            terraform_folder=terraform_folder,
+            file_pattern=terraform_file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
+        ),
+        patterns = {
+            "terraform": [patterns("TERRAFORM")],
+            "providers": [patterns("PROVIDER")],
+            "modules": [
+                patterns("MODULE_REGISTRY"),
+                patterns("MODULE_GITHUB")
+            ]
+        },
+        output=output,
+        parallelism=parallelism,
+        cache=cache,
+        transport=transport,
+        parser=parser,
+        jobs=jobs,
+        parse_index=parse_index
+    )
+    click.echo(result)
+
+@cli.group("cache")
+def cache():
+    """
+    Manages the local caches of available versions and parsed files.
+    """
+    pass
+
+@cache.command(context_settings=CONTEXT_SETTINGS)
+@click.option("--cache-folder", default="", help="The folder where available versions are cached (defaults to $XDG_CACHE_HOME/tfmesh).")
+@click.option("--cache-ttl", type=click.IntRange(min=0), default=3600, help="The number of seconds cached versions are considered fresh (defaults to 3600).")
+def stats(cache_folder, cache_ttl):
+    """
+    Shows statistics for the local caches.
+    """
+    version_cache = VersionCache(cache_folder=cache_folder, ttl=cache_ttl)
+    parse_index = ParseIndex(cache_folder=cache_folder)
+    result = pretty_print(
+        title="Version cache:",
+        options=[f"{name}: {value}" for name, value in version_cache.stats().items() if name not in ["hits", "misses"]]
+    )
+    result += pretty_print(
+        title="Parse cache:",
+        options=[f"{name}: {value}" for name, value in parse_index.stats().items() if name not in ["hits", "misses"]]
+    )
+    click.echo(result)
+
+@cache.command(context_settings=CONTEXT_SETTINGS)
+@click.option("--cache-folder", default="", help="The folder where available versions are cached (defaults to $XDG_CACHE_HOME/tfmesh).")
+def clear(cache_folder):
+    """
+    Removes all entries from the local caches.
+    """
+    version_cache = VersionCache(cache_folder=cache_folder)
+    parse_index = ParseIndex(cache_folder=cache_folder)
+    removed = version_cache.clear()
+    removed_files = parse_index.clear()
+    click.echo(pretty_print(title=f"Removed {removed} cached version list(s) and {removed_files} parsed file(s)."))
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import tempfile
+from tfmesh.trace import traced
+
+PLAN_FORMAT = "tfmesh-plan"
+PLAN_VERSION = 1
+
+class PlanError(Exception):
+    """
+    Raised when a saved plan cannot be read.
+    """
+
+def get_fingerprint(data):
+    """
+    Returns the fingerprint of the contents of a file.
+    """
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def write_plan(path, edits, resources, summary):
+    """
+    Writes a saved plan with the edits to make, the fingerprint of each file they change and the resolved versions of every resource.
+
+    The file is replaced atomically so a saved plan is never left partly written.
+    """
+    fingerprints = {}
+    for edit in edits:
+        if edit["filepath"] not in fingerprints:
+            with open(edit["filepath"], "r") as f:
+                fingerprints[edit["filepath"]] = get_fingerprint(f.read())
+
+    plan = {
+        "format": PLAN_FORMAT,
+        "version": PLAN_VERSION,
+        "files": fingerprints,
+        "edits": edits,
+        "resources": resources,
+        "summary": summary
+    }
+
+    folder = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w") as f:
+            json.dump(plan, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+@traced("read plan")
+def read_plan(path):
+    """
+    Reads a saved plan written by write_plan.
+    """
+    try:
+        with open(path, "r") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PlanError(f"The saved plan {path} could not be read ({e}).") from e
+
+    if not isinstance(plan, dict) or plan.get("format") != PLAN_FORMAT:
+        raise PlanError(f"{path} is not a saved plan.")
+    if plan.get("version") != PLAN_VERSION:
+        raise PlanError(f"The saved plan {path} was written by a different version of tfmesh.  Run plan again to save a new one.")
+
+    return plan
@@ -0,0 +1,558 @@
+from pathlib import Path
+import os
+import json
+import hashlib
+import mmap
+import struct
+import time
+import sqlite3
+import tempfile
+import threading
+
+def get_cache_folder(cache_folder=None):
+    """
+    Get the folder used for persistent caches, honouring XDG_CACHE_HOME.
+    """
+    if cache_folder:
+        path = Path(cache_folder).expanduser().absolute()
+    elif os.environ.get("XDG_CACHE_HOME"):
+        path = Path(os.environ["XDG_CACHE_HOME"]) / "tfmesh"
+    else:
+        path = Path.home() / ".cache" / "tfmesh"
+
+    return path
+
+class VersionCache:
+    """
+    A persistent SQLite cache of available versions keyed by target and source.
+
+    Entries older than ttl seconds are treated as stale and are refetched unless the cache is
+    offline, in which case stale entries are still served.  When the cache holds more than
+    max_entries entries, the least recently used entries are evicted.
+    """
+    def __init__(self, cache_folder=None, ttl=3600, max_entries=1000, refresh=False, offline=False):
+        self.path = get_cache_folder(cache_folder) / "versions.db"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS versions (
+                target TEXT NOT NULL,
+                source TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                versions TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (target, source)
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                last_modified TEXT NOT NULL,
+                body TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+
+    def get(self, target, source=None):
+        """
+        Returns a cached result for the target and source, or None when missing or stale.
+        """
+        if self.refresh and not self.offline:
+            return None
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status_code, reason, versions, fetched_at FROM versions WHERE target = ? AND source = ?",
+                (target, source or "")
+            ).fetchone()
+
+            if row is None or (not self.offline and time.time() - row[3] > self.ttl):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE versions SET accessed_at = ? WHERE target = ? AND source = ?",
+                (time.time(), target, source or "")
+            )
+
+        result = {
+            "status_code": row[0],
+            "reason": row[1],
+            "versions": json.loads(row[2])
+        }
+
+        return result
+
+    def has(self, target, source=None):
+        """
+        Returns whether a fresh result is cached for the target and source, without counting a hit or miss.
+        """
+        if self.refresh and not self.offline:
+            return False
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fetched_at FROM versions WHERE target = ? AND source = ?",
+                (target, source or "")
+            ).fetchone()
+
+        return row is not None and (self.offline or time.time() - row[0] <= self.ttl)
+
+    def set(self, target, source, result):
+        """
+        Stores a successful result for the target and source, evicting least recently used entries.
+        """
+        if result is None or result["status_code"] != 200:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (target, source or "", result["status_code"], result["reason"], json.dumps(result["versions"]), now, now)
+            )
+            self._connection.execute(
+                "DELETE FROM versions WHERE rowid IN (SELECT rowid FROM versions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_response(self, url):
+        """
+        Returns the stored validators, body and headers for a url so it can be revalidated, or None.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified, body, headers FROM responses WHERE url = ?",
+                (url,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        response = {
+            "etag": row[0],
+            "last_modified": row[1],
+            "body": row[2],
+            "headers": json.loads(row[3])
+        }
+
+        return response
+
+    def set_response(self, url, etag, last_modified, body, headers=None):
+        """
+        Stores the validators, body and headers for a url, evicting least recently used responses.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, body, json.dumps(headers or {}), time.time())
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        """
+        Returns details about the cache such as the number of entries and its size on disk.
+        """
+        with self._lock:
+            entries, stale, oldest = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(fetched_at < ?), 0), MIN(fetched_at) FROM versions",
+                (time.time() - self.ttl,)
+            ).fetchone()
+            responses = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        stats = {
+            "path": str(self.path),
+            "entries": entries,
+            "stale entries": stale,
+            "revalidatable responses": responses,
+            "max entries": self.max_entries,
+            "ttl": self.ttl,
+            "size": self.path.stat().st_size,
+            "oldest entry age": round(time.time() - oldest) if oldest else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+        return stats
+
+    def clear(self):
+        """
+        Removes all entries from the cache and returns the number removed.
+        """
+        with self._lock:
+            removed = self._connection.execute("DELETE FROM versions").rowcount
+            self._connection.execute("DELETE FROM responses")
+            self._connection.execute("VACUUM")
+
+        return removed
+
+    def close(self):
+        """
+        Closes the underlying database connection.
+        """
+        self._connection.close()
+
+class ParseIndex:
+    """
+    A persistent SQLite index of the dependencies found in each Terraform file.
+
+    Entries are keyed by a namespace, which identifies the tfmesh code, parser and patterns that
+    produced them, and by file path.  A file is served from the index while its size and mtime are
+    unchanged, or when its content hash is unchanged, so only changed or new files are parsed again.
+    When the index holds more than max_entries entries, the least recently used are evicted.
+
+    The database is opened the first time it is used, so commands that never parse do not create it.
+    """
+    # Files modified this close to when they were fingerprinted may change again within the same mtime, so their hash is always checked.
+    racy_window_ns = 2_000_000_000
+
+    def __init__(self, cache_folder=None, max_entries=100000):
+        self.path = get_cache_folder(cache_folder) / "parse.db"
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        """
+        Returns the database connection, opening the database and creating its table on first use.
+
+        Must be called while holding the lock.
+        """
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    namespace TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    fingerprinted_at_ns INTEGER NOT NULL,
+                    dependencies TEXT NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, path)
+                )
+                """
+            )
+
+        return self._connection
+
+    def get(self, namespace, path):
+        """
+        Returns the indexed dependencies for a file, or None when the file is new or has changed.
+
+        Also returns the fingerprint to store for the file, or None when the indexed fingerprint is
+        still current and only needs to be touched.
+        """
+        now = time.time_ns()
+        stat = os.stat(path)
+
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, mtime_ns, hash, fingerprinted_at_ns, dependencies FROM files WHERE namespace = ? AND path = ?",
+                (namespace, str(path))
+            ).fetchone()
+
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns and stat.st_mtime_ns < row[3] - self.racy_window_ns:
+            self.hits += 1
+            return json.loads(row[4]), None
+
+        with open(path, "rb") as f:
+            fingerprint = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": hashlib.sha256(f.read()).hexdigest(),
+                "fingerprinted_at_ns": now
+            }
+
+        if row is None or row[2] != fingerprint["hash"]:
+            self.misses += 1
+            return None, fingerprint
+
+        self.hits += 1
+
+        return json.loads(row[4]), fingerprint
+
+    def set(self, namespace, entries, touched=()):
+        """
+        Stores the dependencies of each (path, fingerprint, dependencies) entry and marks the touched
+        paths as recently used in a single transaction, evicting least recently used entries.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (namespace, str(path), fingerprint["size"], fingerprint["mtime_ns"], fingerprint["hash"], fingerprint["fingerprinted_at_ns"], json.dumps(dependencies, default=str), now)
+                        for path, fingerprint, dependencies in entries
+                    ]
+                )
+                connection.executemany(
+                    "UPDATE files SET accessed_at = ? WHERE namespace = ? AND path = ?",
+                    [(now, namespace, str(path)) for path in touched]
+                )
+                connection.execute(
+                    "DELETE FROM files WHERE rowid IN (SELECT rowid FROM files ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def stats(self):
+        """
+        Returns details about the index such as the number of files and its size on disk.
+        """
+        with self._lock:
+            entries, namespaces = self._connect().execute("SELECT COUNT(*), COUNT(DISTINCT namespace) FROM files").fetchone()
+
+        stats = {
+            "path": str(self.path),
+            "files": entries,
+            "namespaces": namespaces,
+            "max entries": self.max_entries,
+            "size": self.path.stat().st_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+        return stats
+
+    def clear(self):
+        """
+        Removes all entries from the index and returns the number removed.
+        """
+        with self._lock:
+            connection = self._connect()
+            removed = connection.execute("DELETE FROM files").rowcount
+            connection.execute("VACUUM")
+
+        return removed
+
+    def close(self):
+        """
+        Closes the underlying database connection, if it was opened.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+# Snapshot files are the magic bytes, an entry count, an index of (key hash, offset, length) sorted by
+# key hash, and then a compact JSON record for each entry.
+SNAPSHOT_EXTENSION = ".snapshot"
+SNAPSHOT_MAGIC = b"TFMESHS1"
+SNAPSHOT_HEADER = struct.Struct("<I")
+SNAPSHOT_INDEX = struct.Struct("<QQI")
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot file is not a complete tfmesh snapshot.
+    """
+
+def get_snapshot_key(target, source=None):
+    """
+    Returns the 64 bit hash that snapshot entries are indexed by.
+    """
+    digest = hashlib.blake2b(f"{target}\0{source or ''}".encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little")
+
+class VersionSnapshot:
+    """
+    A read-only snapshot of available versions keyed by target and source, loaded from a snapshot
+    file or from every .snapshot file in a folder.
+
+    Snapshot files are memory-mapped and looked up with a binary search over a sorted index of key
+    hashes, so only the entries that are used are read, however large the snapshot is.  A snapshot
+    is always offline, so versions that are not in it are never requested from their sources.
+    """
+    offline = True
+    refresh = False
+
+    def __init__(self, path):
+        path = Path(path).expanduser().absolute()
+        paths = sorted(path.glob(f"*{SNAPSHOT_EXTENSION}")) if path.is_dir() else [path]
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._files = []
+        self._maps = []
+
+        for snapshot_path in paths:
+            f = open(snapshot_path, "rb")
+            try:
+                self._maps.append(self._map(snapshot_path, f))
+            except BaseException:
+                f.close()
+                self.close()
+                raise
+            self._files.append(f)
+
+    def _map(self, snapshot_path, f):
+        """
+        Memory-maps a snapshot file after checking that its header, index and last entry are all there.
+        """
+        header_size = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size
+        size = os.fstat(f.fileno()).st_size
+
+        if size < header_size:
+            raise SnapshotError(f"{snapshot_path} is not a tfmesh snapshot file.")
+
+        snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if snapshot[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            snapshot.close()
+            raise SnapshotError(f"{snapshot_path} is not a tfmesh snapshot file.")
+
+        # entries are written in index order, so a truncated file is missing the end of the last one
+        count = SNAPSHOT_HEADER.unpack_from(snapshot, len(SNAPSHOT_MAGIC))[0]
+        index_end = header_size + count * SNAPSHOT_INDEX.size
+        complete = index_end <= size
+        if complete and count:
+            key, offset, length = SNAPSHOT_INDEX.unpack_from(snapshot, index_end - SNAPSHOT_INDEX.size)
+            complete = offset + length <= size
+        if not complete:
+            snapshot.close()
+            raise SnapshotError(f"The snapshot {snapshot_path} is incomplete.  Export it again.")
+
+        return snapshot
+
+    def _lookup(self, snapshot, target, source):
+        """
+        Returns the entry for a target and source in one snapshot file, or None.
+        """
+        key = get_snapshot_key(target, source)
+        count = SNAPSHOT_HEADER.unpack_from(snapshot, len(SNAPSHOT_MAGIC))[0]
+        index_start = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size
+
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if SNAPSHOT_INDEX.unpack_from(snapshot, index_start + middle * SNAPSHOT_INDEX.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        # hashes can collide, so every entry with the same hash is checked
+        while low < count:
+            entry_key, offset, length = SNAPSHOT_INDEX.unpack_from(snapshot, index_start + low * SNAPSHOT_INDEX.size)
+            if entry_key != key:
+                break
+            entry = json.loads(snapshot[offset:offset + length])
+            if entry[0] == target and entry[1] == (source or ""):
+                return entry
+            low += 1
+
+        return None
+
+    def get(self, target, source=None):
+        """
+        Returns the snapshot result for the target and source, or None when it is not in the snapshot.
+        """
+        for snapshot in self._maps:
+            entry = self._lookup(snapshot, target, source)
+            if entry is not None:
+                self.hits += 1
+                return {"status_code": entry[2], "reason": entry[3], "versions": entry[4]}
+
+        self.misses += 1
+
+        return None
+
+    def set(self, target, source, result):
+        """
+        Does nothing, since snapshots are read-only.
+        """
+        pass
+
+    def stats(self):
+        """
+        Returns details about the snapshot such as the number of entries and its size on disk.
+        """
+        stats = {
+            "path": str(self.path),
+            "files": len(self._maps),
+            "entries": sum(SNAPSHOT_HEADER.unpack_from(snapshot, len(SNAPSHOT_MAGIC))[0] for snapshot in self._maps),
+            "size": sum(len(snapshot) for snapshot in self._maps),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+        return stats
+
+    def close(self):
+        """
+        Unmaps and closes the snapshot files.
+        """
+        for snapshot in self._maps:
+            snapshot.close()
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
+
+def write_snapshot(path, results):
+    """
+    Writes a snapshot file from a dictionary of (target, source) to results, returning the number of entries written.
+
+    Only successful results are written.  The file is written and synced to a uniquely named
+    temporary file and then moved into place, so an existing snapshot is never left partly written
+    and concurrent exports do not collide.
+    """
+    entries = []
+    for (target, source), result in results.items():
+        if result is None or result["status_code"] != 200:
+            continue
+        entry = json.dumps([target, source or "", result["status_code"], result["reason"], result["versions"]], separators=(",", ":")).encode()
+        entries.append((get_snapshot_key(target, source), entry))
+    entries.sort(key=lambda entry: entry[0])
+
+    index = bytearray()
+    records = bytearray()
+    offset = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size + SNAPSHOT_INDEX.size * len(entries)
+    for key, entry in entries:
+        index += SNAPSHOT_INDEX.pack(key, offset + len(records), len(entry))
+        records += entry
+
+    path = Path(path).expanduser().absolute()
+    descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(len(entries)) + bytes(index) + bytes(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return len(entries)
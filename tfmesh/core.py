@@ -2,11 +2,22 @@ from pathlib import Path, PurePath
 import os
 import sys
 import base64
-import requests
+import glob
+import hashlib
 import json
 import re
 import operator
+import threading
+import functools
+import tempfile
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from tfmesh.artifact import PlanError, get_fingerprint, read_plan, write_plan
+from tfmesh.cache import write_snapshot
+from tfmesh.trace import span, traced
+from tfmesh.transport import get_transport
+from tfmesh.versions import ConstraintError, Version, VersionSet, compile_constraint, interval_contains, parse_version, version_key
+from tfmesh import hcl
 
 def colors(color="END"):
     """
@@ -42,66 +53,521 @@ def patterns(pattern):
     A standard set of regex patterns.
     """
     patterns = {
-        "TERRAFORM": r'(((^terraform)) *{[^}]*?required_version *= *\"([=!><~(.*)]* *\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*))[\s\S]*?)',
-        "PROVIDER": r'(([a-zA-Z\S]*) *= *{[^}]*?[\s]*source *= *\"(.*)\"[\s]*version *= *\"([=!><~(.*)]* *\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*))[\s\S]*?})',
-        "MODULE_REGISTRY": r'(^module *\"(.*)\" *{[^}]*?source *= *\"([=!><~(.*)]* *\S*)\"[\s]*version *= *\"(\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*))[\s\S]*?^})',
-        "MODULE_GITHUB": r'(^module *\"(.*)\" *{[^}]*?source *= *\"([=!><~(.*)]* *\S*)\?ref=([a-zA-Z]*\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*))[\s\S]*?^})',
+        "TERRAFORM": r'(((^terraform)) *{[^}]*?required_version *= *\"([=!><~(.*)]* *\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*)(?: *, *[=!><~]* *[0-9\.]+)*)[\s\S]*?)',
+        "PROVIDER": r'(([a-zA-Z\S]*) *= *{[^}]*?[\s]*source *= *\"(.*)\"[\s]*version *= *\"([=!><~(.*)]* *\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*)(?: *, *[=!><~]* *[0-9\.]+)*)[\s\S]*?})',
+        "MODULE_REGISTRY": r'(^module *\"(.*)\" *{[^}]*?source *= *\"([=!><~(.*)]* *\S*)\"[\s]*version *= *\"(\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*)(?: *, *[=!><~]* *[0-9\.]+)*)[\s\S]*?^})',
+        "MODULE_GITHUB": r'(^module *\"(.*)\" *{[^}]*?source *= *\"([=!><~(.*)]* *\S*)\?ref=([a-zA-Z]*\S*)\" *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*)(?: *, *[=!><~]* *[0-9\.]+)*)[\s\S]*?^})',
     }
 
     return patterns[pattern]
 
-def get_terraform_files(terraform_folder=None, file_pattern='*.tf'):
+def host_limits(host):
     """
-    Get a list of absolute paths to terraform files matching the given pattern.
+    A standard set of per-host concurrency limits used when resolving versions.
+    """
+    host_limits = {
+        "registry.terraform.io": 8,
+        "releases.hashicorp.com": 2,
+        "api.github.com": 4,
+        "dev.azure.com": 4,
+    }
+
+    return host_limits.get(host, 4)
+
+# Directories that never hold Terraform configuration worth updating, such as provider and module caches.
+PRUNED_FOLDERS = (".git", ".terraform", "node_modules")
+
+IGNORE_FILES = (".gitignore", ".tfmeshignore")
+
+@functools.lru_cache(maxsize=None)
+def compile_glob(pattern):
+    """
+    Compiles a glob for matching paths relative to a folder, where * and ? match within one path
+    segment and ** matches any number of segments.
+    """
+    regex = ""
+    index = 0
+    pattern = pattern[2:] if pattern.startswith("./") else pattern
+
+    while index < len(pattern):
+        if pattern.startswith("**/", index) and (index == 0 or pattern[index - 1] == "/"):
+            regex += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+        elif pattern[index] == "*":
+            regex += "[^/]*"
+            index += 1
+        elif pattern[index] == "?":
+            regex += "[^/]"
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2:]:
+            end = pattern.index("]", index + 2)
+            characters = pattern[index + 1:end]
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            regex += "[" + characters.replace("\\", "\\\\") + "]"
+            index = end + 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+
+    return re.compile(regex + r"\Z")
+
+def read_ignore_file(path):
+    """
+    Returns the (regex, negate, directory_only) rules in a .gitignore style file.
+    """
+    rules = []
+
+    try:
+        lines = open(path).read().splitlines()
+    except OSError:
+        return rules
+
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        line = line[1:] if negate else line
+        line = line[1:] if line.startswith("\\") else line
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+
+        # Patterns without a slash in the middle match at any depth, like they do in git.
+        if "/" not in line:
+            line = "**/" + line
+        rules.append((compile_glob(line.lstrip("/")), negate, directory_only))
+
+    return rules
+
+def is_ignored(relative_path, is_directory, ignore_rules):
+    """
+    Returns True when the last matching ignore rule for a path excludes it.
+    """
+    ignored = False
+
+    for base, rules in ignore_rules:
+        if base:
+            if not relative_path.startswith(base + "/"):
+                continue
+            path = relative_path[len(base) + 1:]
+        else:
+            path = relative_path
+
+        for regex, negate, directory_only in rules:
+            if (is_directory or not directory_only) and regex.match(path):
+                ignored = not negate
+
+    return ignored
+
+@traced("find files")
+def get_terraform_files(terraform_folder=None, file_pattern='*.tf', exclude=(), pruned_folders=PRUNED_FOLDERS, stats=None):
+    """
+    Get a sorted list of absolute paths to terraform files matching the given pattern or patterns.
+
+    Folders in pruned_folders and paths matched by .gitignore or .tfmeshignore files (within the
+    folder) are skipped before they are walked, as are paths matching any of the exclude patterns.
+    When a stats dictionary is given, it is updated with the number of folders walked, files
+    matched, folders pruned and entries ignored or excluded.
     """
     if terraform_folder:
         path = Path(terraform_folder).absolute()
     else:
         path = Path(os.getcwd())
 
-    file_list = [str(x) for x in path.glob(file_pattern) if x.is_file()]
+    include = [compile_glob(pattern) for pattern in ([file_pattern] if isinstance(file_pattern, str) else file_pattern)]
+    exclude = [compile_glob(pattern) for pattern in ([exclude] if isinstance(exclude, str) else exclude)]
+    patterns = [file_pattern] if isinstance(file_pattern, str) else list(file_pattern)
+    recursive = any("**" in pattern for pattern in patterns)
+    max_depth = max([pattern.strip("/").count("/") for pattern in patterns], default=0)
+    counts = {"folders": 0, "files": 0, "pruned": 0, "ignored": 0}
+
+    file_list = []
+    visited = set()
+    folders = [(str(path), "", 0, [])]
+
+    while folders:
+        folder, relative_folder, depth, ignore_rules = folders.pop()
+
+        try:
+            with os.scandir(folder) as entries:
+                entries = list(entries)
+            identity = os.stat(folder)
+        except OSError:
+            continue
+
+        # Symlinked folders are followed, but only once, so links that point back up the tree cannot loop.
+        if (identity.st_dev, identity.st_ino) in visited:
+            continue
+        visited.add((identity.st_dev, identity.st_ino))
+        counts["folders"] += 1
+
+        rules = [read_ignore_file(os.path.join(folder, name)) for name in IGNORE_FILES if any(entry.name == name for entry in entries)]
+        if any(rules):
+            ignore_rules = ignore_rules + [(relative_folder, [rule for rule_list in rules for rule in rule_list])]
+
+        for entry in entries:
+            relative_path = f"{relative_folder}/{entry.name}" if relative_folder else entry.name
+
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                continue
+
+            if is_directory:
+                # folders below the depth of every pattern are never walked, so they are not counted as pruned
+                if not recursive and depth >= max_depth:
+                    continue
+                elif entry.name in pruned_folders:
+                    counts["pruned"] += 1
+                elif is_ignored(relative_path, True, ignore_rules) or any(regex.match(relative_path) for regex in exclude):
+                    counts["ignored"] += 1
+                else:
+                    folders.append((entry.path, relative_path, depth + 1, ignore_rules))
+            elif any(regex.match(relative_path) for regex in include) and entry.is_file():
+                if is_ignored(relative_path, False, ignore_rules) or any(regex.match(relative_path) for regex in exclude):
+                    counts["ignored"] += 1
+                else:
+                    file_list.append(entry.path)
+
+    file_list.sort()
+    counts["files"] = len(file_list)
+
+    if stats is not None:
+        stats.update(counts)
     
     return file_list
 
-def get_dependency_attributes(terraform_files, patterns):
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
     """
-    Returns all attributes for a given resource.
+    Returns a compiled regex pattern, compiling each pattern only once.
     """
-    dependencies = defaultdict(dict)
+    return re.compile(pattern, re.MULTILINE)
+
+def block_kinds():
+    """
+    A standard mapping of the built-in regex patterns to the kind of block they are found in.
+    """
+    block_kinds = {
+        patterns("TERRAFORM"): "terraform",
+        patterns("PROVIDER"): "required_providers",
+        patterns("MODULE_REGISTRY"): "module",
+        patterns("MODULE_GITHUB"): "module",
+    }
+
+    return block_kinds
+
+BLOCK_HEADER = re.compile(r'^(terraform) *{|^(module) *".*" *{|(required_providers) *{', re.MULTILINE)
+BRACE = re.compile(r'[{}]')
+ENTRY_OPEN = re.compile(r'= *{')
+
+def scan_blocks(contents):
+    """
+    Finds all terraform, required_providers and module blocks in a single pass.
+
+    Returns the (start, end) span of each block by kind.  Spans are the smallest region that can
+    contain every match of the built-in pattern for that kind of block, so the patterns never need
+    to be run against the rest of the file.
+    """
+    blocks = {"terraform": [], "required_providers": [], "module": []}
+    headers = [(match.lastindex, match.start(), match.end()) for match in BLOCK_HEADER.finditer(contents)]
+
+    # blocks never run into the next top level block, which bounds the search for their end
+    limit = len(contents)
+    limits = []
+    for group, start, header_end in reversed(headers):
+        limits.append(limit)
+        if group != 3:
+            limit = start
+    limits.reverse()
+
+    for (group, start, header_end), limit in zip(headers, limits):
+        if group == 1:
+            # matches end on the line of the first closing brace at the latest
+            index = contents.find("}", header_end, limit)
+            index = contents.find("\n", index, limit) if index != -1 else -1
+            blocks["terraform"].append((start, index if index != -1 else limit))
+        elif group == 2:
+            # matches end at the first closing brace at the start of a line
+            index = contents.find("\n}", start, limit)
+            blocks["module"].append((start, index + 2 if index != -1 else limit))
+        else:
+            # matches end within the block, so find its closing brace
+            depth = 0
+            end = limit
+            for brace in BRACE.finditer(contents, header_end - 1, limit):
+                depth += 1 if brace.group() == "{" else -1
+                if depth == 0:
+                    end = brace.end()
+                    break
+            blocks["required_providers"].append((start, end))
+
+    return blocks
+
+def find_entry_matches(contents, regex, start, end):
+    """
+    Yields the matches of a provider pattern within a required_providers block, trying each entry once.
+
+    A provider match starts with the name of an entry and cannot cross a closing brace before its source,
+    so when an entry does not match, no entry opened before that closing brace or within the same name can
+    match either.  Skipping past them keeps unclosed or incomplete entries from being searched again from
+    every offset.
+    """
+    position = start
+    floor = start
+
+    while True:
+        opening = ENTRY_OPEN.search(contents, position, end)
+        if opening is None:
+            return
+        close = contents.find("}", opening.end(), end)
+        if close == -1:
+            return
+
+        # the match starts at the name before the equals sign, or at the spaces before it if there is no name
+        name_end = opening.start()
+        while name_end > floor and contents[name_end - 1] == " ":
+            name_end -= 1
+        name_start = name_end
+        while name_start > floor and not contents[name_start - 1].isspace():
+            name_start -= 1
+
+        match = regex.match(contents, name_start, end)
+        if match:
+            yield match
+            position = floor = match.end()
+        else:
+            floor = name_start
+            while floor < end and not contents[floor].isspace():
+                floor += 1
+            position = max(close, floor)
+
+def find_pattern_matches(contents, pattern, blocks):
+    """
+    Returns the groups and spans for every match of a pattern, only searching blocks that can contain a match.
+
+    Patterns that are not built-in are searched for in the whole file.
+    """
+    regex = compile_pattern(pattern)
+    kind = block_kinds().get(pattern)
+
+    if kind is None:
+        matches = list(regex.finditer(contents))
+    else:
+        matches = []
+        last_end = 0
+        for start, end in blocks[kind]:
+            if start < last_end:
+                continue
+            if kind == "required_providers":
+                found = find_entry_matches(contents, regex, start, end)
+            else:
+                found = regex.finditer(contents, start, end)
+            for match in found:
+                if match.start() >= last_end:
+                    matches.append(match)
+                    last_end = match.end()
+
+    results = []
+    for match in matches:
+        spans = {
+            "code": match.span(1),
+            "version": match.span(4),
+            "constraint": match.span(5),
+        }
+        results.append((match.groups(default=""), spans))
+
+    return results
+
+def find_dependencies(contents, patterns, parser="regex"):
+    """
+    Returns a list of (target, result, spans) tuples for the dependencies in the contents of a file.
+
+    The regex parser runs the given patterns, while the hcl parser tokenizes the file and returns
+    dependencies for the targets in patterns that it supports.  Custom patterns always use the regex parser.
+    """
+    built_in = all(pattern in block_kinds() for pattern_list in patterns.values() for pattern in pattern_list)
+
+    if parser == "hcl" and built_in:
+        return hcl.find_dependencies(contents, targets=[target for target in patterns if target in ["terraform", "providers", "modules"]])
+
+    blocks = scan_blocks(contents)
+    dependencies = []
+
+    for target, pattern_list in patterns.items():
+        for pattern in pattern_list:
+            for result, spans in find_pattern_matches(contents, pattern, blocks):
+                dependencies.append((target, result, spans))
+
+    return dependencies
+
+# Workspaces smaller than this are parsed in-process, since starting a process pool costs more than it saves.
+PARALLEL_PARSE_MIN_BYTES = 4 * 1024 * 1024
+
+def get_file_dependencies(terraform_file, patterns, parser="regex"):
+    """
+    Returns the list of dependencies found in a single Terraform file.
+    """
+    dependencies = []
+    contents = open(terraform_file).read()
+
+    for target, result, spans in find_dependencies(contents, patterns, parser):
+        if result != []:
+            dependency = {
+                "target": target,
+                "filepath": terraform_file, 
+                "filename": Path(terraform_file).name,
+                "code": result[0],
+                "name": result[1],
+                "source": result[2],
+                "version": result[3],
+                "constraint": result[4],
+                "lower_constraint_operator": result[5],
+                "lower_constraint": result[6],
+                "upper_constraint_operator": result[7],
+                "upper_constraint": result[8],
+                "spans": spans
+            }
+
+            dependencies.append(dependency)
+
+    return dependencies
 
+def get_files_dependencies(terraform_files, patterns, parser="regex"):
+    """
+    Returns the dependencies for each of a shard of Terraform files, in the order given.
+    """
+    return [get_file_dependencies(terraform_file, patterns, parser) for terraform_file in terraform_files]
+
+def get_parse_jobs(terraform_files, jobs=None):
+    """
+    Returns the number of processes to parse files with, or 1 when the workspace is too small to benefit.
+    """
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs <= 1 or len(terraform_files) < 2:
+        return 1
+
+    size = 0
     for terraform_file in terraform_files:
-        contents = open(terraform_file).read()
-
-        for target, pattern_list in patterns.items():
-            for pattern in pattern_list:
-                results = re.findall(pattern, contents, re.MULTILINE)
-                
-                for result in results:
-                    if result != []:
-                        dependency = {
-                            "target": target,
-                            "filepath": terraform_file, 
-                            "filename": Path(terraform_file).name,
-                            "code": result[0],
-                            "name": result[1],
-                            "source": result[2],
-                            "version": result[3],
-                            "constraint": result[4],
-                            "lower_constraint_operator": result[5],
-                            "lower_constraint": result[6],
-                            "upper_constraint_operator": result[7],
-                            "upper_constraint": result[8]
-                        }
-
-                        dependencies[target][result[1]] = dependency
+        size += os.path.getsize(terraform_file)
+        if size >= PARALLEL_PARSE_MIN_BYTES:
+            return min(jobs, len(terraform_files))
+
+    return 1
+
+@functools.lru_cache(maxsize=None)
+def get_parser_code_hash():
+    """
+    Returns a hash of the tfmesh parsing code, so indexed results are discarded whenever it changes.
+    """
+    digest = hashlib.sha256()
+
+    for module_file in [__file__, hcl.__file__]:
+        with open(module_file, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+def get_parse_namespace(patterns, parser="regex"):
+    """
+    Returns the parse index namespace for the tfmesh code, parser and patterns used to find dependencies.
+    """
+    key = json.dumps({"code": get_parser_code_hash(), "parser": parser, "patterns": patterns}, sort_keys=True)
+
+    return hashlib.sha256(key.encode()).hexdigest()
+
+@traced("parse files")
+def get_file_dependency_lists(terraform_files, patterns, parser="regex", jobs=1, parse_index=None):
+    """
+    Returns the list of dependencies found in each Terraform file, in the order given.
+
+    Large workspaces are split into shards and parsed across jobs processes (all cpus when jobs is
+    None).  When a parse index is given, files that have not changed since they were last indexed
+    are not parsed again.
+    """
+    terraform_files = list(terraform_files)
+    file_dependencies = [None] * len(terraform_files)
+    fingerprints = {}
+    touched = []
+    parse_index = parse_index if terraform_files else None
+
+    if parse_index:
+        namespace = get_parse_namespace(patterns, parser)
+        for index, terraform_file in enumerate(terraform_files):
+            indexed, fingerprint = parse_index.get(namespace, terraform_file)
+            if indexed is not None:
+                for dependency in indexed:
+                    dependency["filepath"] = terraform_file
+                    dependency["spans"] = {name: tuple(span) for name, span in dependency["spans"].items()}
+                file_dependencies[index] = indexed
+            if fingerprint is None:
+                touched.append(terraform_file)
+            else:
+                fingerprints[index] = fingerprint
+
+    unparsed = [index for index, dependency_list in enumerate(file_dependencies) if dependency_list is None]
+    unparsed_files = [terraform_files[index] for index in unparsed]
+    jobs = get_parse_jobs(unparsed_files, jobs)
+
+    if jobs == 1:
+        parsed = get_files_dependencies(unparsed_files, patterns, parser)
+    else:
+        # Several shards per process keep the processes busy when some files are much larger than others.
+        shard_size = -(-len(unparsed_files) // (jobs * 4))
+        shards = [unparsed_files[i:i + shard_size] for i in range(0, len(unparsed_files), shard_size)]
+        parsed = []
+
+        # imported here because it pulls in multiprocessing, which most runs never need
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for shard in executor.map(get_files_dependencies, shards, [patterns] * len(shards), [parser] * len(shards)):
+                parsed.extend(shard)
+
+    for index, dependency_list in zip(unparsed, parsed):
+        file_dependencies[index] = dependency_list
+
+    if parse_index:
+        entries = [(terraform_files[index], fingerprint, file_dependencies[index]) for index, fingerprint in fingerprints.items()]
+        parse_index.set(namespace, entries, touched)
+
+    return file_dependencies
+
+def merge_dependencies(file_dependencies):
+    """
+    Merges the dependencies of each file into dependencies by target and name, with later files taking precedence.
+    """
+    dependencies = defaultdict(dict)
+
+    for dependency_list in file_dependencies:
+        for dependency in dependency_list:
+            dependencies[dependency["target"]][dependency["name"]] = dependency
 
     return dependencies
 
-def get_dependency_attribute(terraform_files, patterns, resource_type, name, attribute, allowed, exclude_prerelease, top):
+def get_dependency_attributes(terraform_files, patterns, parser="regex", jobs=1, parse_index=None):
+    """
+    Returns all attributes for a given resource.
+
+    Results are merged in file order so they are the same however many jobs are used to parse them.
+    """
+    return merge_dependencies(get_file_dependency_lists(terraform_files, patterns, parser, jobs, parse_index))
+
+def get_dependency_attribute(terraform_files, patterns, resource_type, name, attribute, allowed, exclude_prerelease, top, cache=None, transport=None, parser="regex", jobs=1, parse_index=None, output_format="text"):
     """
     Gets an attribute for a given resource.
+
+    With an output_format of json or jsonl, the attribute or error is returned as a JSON record.
     """
-    if terraform_files == []:
+    if terraform_files == [] and output_format != "text":
+        result = format_json({"type": "error", "message": "No Terraform files found."}, output_format)
+    elif terraform_files == []:
         result = pretty_print(
             title=f"No Terraform files found.  Try:",
             options=["Changing the current working directory to a directory with Terraform (.tf) files.", "Selecting a different folder with the --terraform-folder option or TFMESH_TERRAFORM_FOLDER environment variable.", "Changing the file pattern with the --terraform-file-pattern option or TFMESH_TERRAFORM_FILE_PATTERN environment variable."]
@@ -109,38 +575,49 @@ def get_dependency_attribute(terraform_files, patterns, resource_type, name, att
     else:
         dependencies = get_dependency_attributes(
             terraform_files=terraform_files,
-            patterns=patterns
+            patterns=patterns,
+            parser=parser,
+            jobs=jobs,
+            parse_index=parse_index
         )
-        if attribute == "versions":
+        constraints, errors = compile_constraints({resource_type: {name: dependencies[resource_type][name]}})
+
+        record = {"type": "attribute", "resource_type": resource_type, "name": name, "attribute": attribute}
+
+        if attribute == "versions" and allowed and errors and output_format != "text":
+            result = format_json({"type": "error", "message": "The version constraint is not valid.", "errors": errors}, output_format)
+        elif attribute == "versions" and allowed and errors:
+            result = pretty_print(
+                title=f'{colors("FAIL")}The version constraint is not valid.{colors()}',
+                options=errors
+            )
+        elif attribute == "versions":
             request = get_available_versions(
                 target=dependencies[resource_type][name]["target"],
                 source=dependencies[resource_type][name]["source"],
-                exclude_pre_release=exclude_prerelease
-            )
-            available_versions = sort_versions(request["versions"])
-            allowed_versions = sort_versions(
-                get_allowed_versions(
-                    available_versions,
-                    dependencies[resource_type][name]["lower_constraint"],
-                    dependencies[resource_type][name]["lower_constraint_operator"],
-                    dependencies[resource_type][name]["upper_constraint"],
-                    dependencies[resource_type][name]["upper_constraint_operator"],
-                )
+                exclude_pre_release=exclude_prerelease,
+                cache=cache,
+                transport=transport
             )
-            if request["status_code"] != 200:
+            version_set = VersionSet(request["versions"])
+            if request["status_code"] != 200 and output_format != "text":
+                result = format_json({"type": "error", "message": f"The API call to return versions for {name} failed.", "status_code": request["status_code"], "reason": request["reason"]}, output_format)
+            elif output_format != "text":
+                result = format_json(dict(record, value=version_set.allowed(constraints[(resource_type, name)] if allowed else None, top=top)), output_format)
+            elif request["status_code"] != 200:
                 result = pretty_print(
                     title=f'The API call to return versions for {name} failed. {colors("FAIL")}{request["status_code"]} {request["reason"]}{colors()}.'
                 )
             elif allowed:
                 result = pretty_print(
-                    options=allowed_versions,
-                    top=top
+                    options=version_set.allowed(constraints[(resource_type, name)], top=top)
                 )
             else:
                 result = pretty_print(
-                    options=available_versions,
-                    top=top
+                    options=version_set.allowed(top=top)
                 )
+        elif output_format != "text":
+            result = format_json(dict(record, value=dependencies[resource_type][name][attribute]), output_format)
         else:
             if attribute == "code":
                 result = pretty_print(
@@ -153,7 +630,7 @@ def get_dependency_attribute(terraform_files, patterns, resource_type, name, att
 
     return result
 
-def set_dependency_attribute(terraform_files, patterns, resource_type, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, force):
+def set_dependency_attribute(terraform_files, patterns, resource_type, name, attribute, value, exclude_prerelease, what_if, ignore_constraints, force, cache=None, transport=None, parser="regex", jobs=1, parse_index=None, backup=False):
     """
     Updates an attribute for a given resource.
     """
@@ -165,35 +642,44 @@ def set_dependency_attribute(terraform_files, patterns, resource_type, name, att
     else:
         dependencies = get_dependency_attributes(
             terraform_files=terraform_files,
-            patterns=patterns
+            patterns=patterns,
+            parser=parser,
+            jobs=jobs,
+            parse_index=parse_index
         )
-        if attribute == "version":
+        # a constraint may be given as it is written in a comment, so a leading # is dropped before it is checked and written
+        if attribute == "constraint":
+            value = value.strip().lstrip("#").strip()
+        # a new constraint is checked instead of the current one
+        resource = dict(dependencies[resource_type][name], constraint=value) if attribute == "constraint" else dependencies[resource_type][name]
+        constraints, errors = compile_constraints({resource_type: {name: resource}})
+        invalid = errors and not force and (attribute == "constraint" or not ignore_constraints)
+
+        if attribute == "version" and not invalid:
             request = get_available_versions(
                 target=dependencies[resource_type][name]["target"],
                 source=dependencies[resource_type][name]["source"],
-                exclude_pre_release=exclude_prerelease
-            )
-            available_versions = sort_versions(request["versions"])
-            allowed_versions = sort_versions(
-                get_allowed_versions(
-                    available_versions,
-                    dependencies[resource_type][name]["lower_constraint"],
-                    dependencies[resource_type][name]["lower_constraint_operator"],
-                    dependencies[resource_type][name]["upper_constraint"],
-                    dependencies[resource_type][name]["upper_constraint_operator"],
-                )
+                exclude_pre_release=exclude_prerelease,
+                cache=cache,
+                transport=transport
             )
+            version_set = VersionSet(request["versions"])
             if ignore_constraints:
-                versions = available_versions
+                versions = version_set.allowed()
             else:
-                versions = allowed_versions
+                versions = version_set.allowed(constraints.get((resource_type, name)))
         else:
             versions = []
 
         current_value = dependencies[resource_type][name][attribute]
         new_value = value
 
-        if current_value == new_value:
+        if invalid:
+            result = pretty_print(
+                title=f'{colors("FAIL")}The version constraint is not valid.{colors()}',
+                options=errors
+            )
+        elif current_value == new_value:
             result = pretty_print(
                 title=f'The {attribute} is already set to "{new_value}".'
             )
@@ -206,7 +692,9 @@ def set_dependency_attribute(terraform_files, patterns, resource_type, name, att
                 filepath=dependencies[resource_type][name]["filepath"],
                 code=dependencies[resource_type][name]["code"],
                 attribute=attribute,
-                value=value
+                value=value,
+                spans=dependencies[resource_type][name]["spans"],
+                backup=backup
             )
             result = pretty_print(
                 title=f'The {attribute} was changed from "{current_value}" to "{new_value}" without validation.'
@@ -220,7 +708,9 @@ def set_dependency_attribute(terraform_files, patterns, resource_type, name, att
                 filepath=dependencies[resource_type][name]["filepath"],
                 code=dependencies[resource_type][name]["code"],
                 attribute=attribute,
-                value=value
+                value=value,
+                spans=dependencies[resource_type][name]["spans"],
+                backup=backup
             )
             result = pretty_print(
                 title=f'The {attribute} was changed from "{current_value}" to "{new_value}".'
@@ -238,11 +728,15 @@ def set_dependency_attribute(terraform_files, patterns, resource_type, name, att
         
     return result
 
-def get_resources(terraform_files, patterns):
+def get_resources(terraform_files, patterns, parser="regex", jobs=1, parse_index=None, output_format="text"):
     """
     Returns a nicely formatted string showing a list of available resources.
+
+    With an output_format of json or jsonl, a JSON record is returned for each resource instead.
     """
-    if terraform_files == []:
+    if terraform_files == [] and output_format != "text":
+        result = format_json({"type": "error", "message": "No Terraform files found."}, output_format)
+    elif terraform_files == []:
         result = pretty_print(
             title=f"No Terraform files found.  Try:",
             options=["Changing the current working directory to a directory with Terraform (.tf) files.", "Selecting a different folder with the --terraform-folder option or TFMESH_TERRAFORM_FOLDER environment variable.", "Changing the file pattern with the --terraform-file-pattern option or TFMESH_TERRAFORM_FILE_PATTERN environment variable."]
@@ -252,21 +746,75 @@ def get_resources(terraform_files, patterns):
 
         dependencies = get_dependency_attributes(
             terraform_files=terraform_files,
-            patterns=patterns
+            patterns=patterns,
+            parser=parser,
+            jobs=jobs,
+            parse_index=parse_index
         )
         for resource_type, resources in dependencies.items():
             for resource in resources:
                 resource_list.append(resource)
-        
+
+        if output_format != "text":
+            result = format_json([get_resource_record(resource_type, attributes) for resource_type, resources in dependencies.items() for attributes in resources.values()], output_format)
+        else:
+            result = pretty_print(
+                options=resource_list
+            )
+
+    return result
+
+def export_snapshot(terraform_files, patterns, output, parallelism=10, cache=None, transport=None, parser="regex", jobs=1, parse_index=None):
+    """
+    Writes the available versions of every resource to a snapshot file, so later commands can run without network access.
+    """
+    if terraform_files == []:
         result = pretty_print(
-            options=resource_list
+            title=f"No Terraform files found.  Try:",
+            options=["Changing the current working directory to a directory with Terraform (.tf) files.", "Selecting a different folder with the --terraform-folder option or TFMESH_TERRAFORM_FOLDER environment variable.", "Changing the file pattern with the --terraform-file-pattern option or TFMESH_TERRAFORM_FILE_PATTERN environment variable."]
+        )
+    else:
+        resources = get_dependency_attributes(
+            terraform_files=terraform_files,
+            patterns=patterns,
+            parser=parser,
+            jobs=jobs,
+            parse_index=parse_index
+        )
+        version_requests = resolve_available_versions(
+            resources,
+            parallelism=parallelism,
+            cache=cache,
+            transport=transport
         )
 
+        results = {}
+        failures = []
+        for (resource_type, name), request in version_requests.items():
+            attributes = resources[resource_type][name]
+            results[(attributes["target"], attributes["source"])] = request
+            if request["status_code"] != 200:
+                failures.append(f'{attributes["target"]} "{name}": {request["status_code"]} {request["reason"]}')
+
+        entries = write_snapshot(output, results)
+
+        if failures:
+            result = pretty_print(
+                title=f'Wrote {entries} version list(s) to {output}.  {colors("FAIL")}{len(failures)} resource(s) failed to return a list of available versions and were left out:{colors()}',
+                options=failures
+            )
+        else:
+            result = pretty_print(
+                title=f"Wrote {entries} version list(s) to {output}."
+            )
+
     return result
 
 def get_semantic_version(version):
     """
     Get a dictionary of the semantic version components including major, minor, patch, and pre-release.
+
+    These tuples do not order pre-releases correctly, so tfmesh compares Version values from parse_version instead.
     """
     regex_pattern = r'(\d+)\.*(\d+)*\.*(\d+)*(?:-*(?:(?:[a-zA-Z]*(\d*)))?)'
 
@@ -287,21 +835,29 @@ def get_semantic_version(version):
 
     return version
 
-def get_github_module_versions(user, repo, token=None):
+def get_github_module_versions(user, repo, token=None, transport=None):
     """
-    Get tags from GitHub repo.
+    Get tags from GitHub repo, following pagination until all tags are returned.
     """
     if token:
         headers = {'Authorization': 'token ' + token}
-        response = requests.get(f"https://api.github.com/repos/{user}/{repo}/tags", headers=headers)
     else:
-        response = requests.get(f"https://api.github.com/repos/{user}/{repo}/tags")
+        headers = {}
 
-    if response.status_code == 200:
-        tag_data = json.loads(response.text)
-        versions = [x["name"] for x in tag_data]
-    else:
-        versions = []
+    url = f"https://api.github.com/repos/{user}/{repo}/tags?per_page=100"
+    versions = []
+
+    while url:
+        response = get_transport(transport).get(url, headers=headers)
+
+        if response.status_code == 200:
+            tag_data = json.loads(response.text)
+            versions += [x["name"] for x in tag_data]
+            next_page = re.findall(r'<([^>]*)>; *rel="next"', response.headers.get("Link", ""))
+            url = next_page[0] if next_page else None
+        else:
+            versions = []
+            url = None
 
     result = {
         "status_code": response.status_code,
@@ -311,16 +867,63 @@ def get_github_module_versions(user, repo, token=None):
 
     return result
 
-def get_azure_devops_module_versions(organization, project, repo, token=None):
+def get_github_module_versions_batch(repositories, token, transport=None, batch_size=50):
+    """
+    Get tags for many GitHub repos using aliased GraphQL queries, paging each repo until all tags are returned.
+
+    Takes a list of (user, repo) tuples and returns results keyed by the same tuples.
+    """
+    headers = {'Authorization': 'bearer ' + token}
+    results = {repository: {"status_code": 200, "reason": "OK", "versions": []} for repository in repositories}
+    pending = [(repository, None) for repository in results]
+
+    while pending:
+        batch, pending = pending[:batch_size], pending[batch_size:]
+
+        variables = {}
+        fields = []
+        for index, ((user, repo), cursor) in enumerate(batch):
+            variables.update({f"owner{index}": user, f"name{index}": repo, f"cursor{index}": cursor})
+            fields.append(
+                f'r{index}: repository(owner: $owner{index}, name: $name{index}) {{ '
+                f'refs(refPrefix: "refs/tags/", first: 100, after: $cursor{index}) {{ '
+                f'nodes {{ name }} pageInfo {{ hasNextPage endCursor }} }} }}'
+            )
+        declarations = ", ".join(f"$owner{i}: String!, $name{i}: String!, $cursor{i}: String" for i in range(len(batch)))
+        query = f'query({declarations}) {{ {" ".join(fields)} }}'
+
+        response = get_transport(transport).post(
+            "https://api.github.com/graphql",
+            json.dumps({"query": query, "variables": variables}),
+            headers=headers
+        )
+        data = (json.loads(response.text).get("data") or {}) if response.status_code == 200 else {}
+
+        for index, (repository, cursor) in enumerate(batch):
+            repository_data = data.get(f"r{index}")
+            if response.status_code != 200:
+                results[repository] = {"status_code": response.status_code, "reason": response.reason, "versions": []}
+            elif repository_data is None:
+                results[repository] = {"status_code": 404, "reason": "Not Found", "versions": []}
+            else:
+                refs = repository_data["refs"]
+                results[repository]["versions"] += [node["name"] for node in refs["nodes"]]
+                if refs["pageInfo"]["hasNextPage"]:
+                    pending.append((repository, refs["pageInfo"]["endCursor"]))
+
+    return results
+
+def get_azure_devops_module_versions(organization, project, repo, token=None, transport=None):
     """
     Get tags from Azure DevOps repo.
     """
     if token:
         token = str(base64.b64encode(bytes(':'+token, 'ascii')), 'ascii')
         headers = {'Authorization': 'Basic ' + token}
-        response = requests.get(f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo}/refs?filter=tags/&api-version=6.0-preview.1", headers=headers)
     else:
-        response = requests.get(f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo}/refs?filter=tags/&api-version=6.0-preview.1")
+        headers = {}
+
+    response = get_transport(transport).get(f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo}/refs?filter=tags/&api-version=6.0-preview.1", headers=headers)
 
     if response.status_code == 200:
         tag_data = json.loads(response.text)
@@ -336,41 +939,49 @@ def get_azure_devops_module_versions(organization, project, repo, token=None):
 
     return result
 
-def get_terraform_module_versions(source):
+def get_terraform_module_versions(source, transport=None):
     """
     Gets a list of versions for a given terraform module.
     """
-    response = requests.get(f"https://registry.terraform.io/v1/modules/{source}")
-    data = json.loads(response.text)
+    response = get_transport(transport).get(f"https://registry.terraform.io/v1/modules/{source}")
+
+    if response.status_code == 200:
+        versions = json.loads(response.text)["versions"]
+    else:
+        versions = []
 
     result = {
         "status_code": response.status_code,
         "reason": response.reason,
-        "versions": data["versions"]
+        "versions": versions
     }
     
     return result
 
-def get_terraform_provider_versions(source):
+def get_terraform_provider_versions(source, transport=None):
     """
     Gets a list of versions for a given terraform provider such as aws, gcp, or azurerm.
     """
-    response = requests.get(f"https://registry.terraform.io/v1/providers/{source}")
-    data = json.loads(response.text)
+    response = get_transport(transport).get(f"https://registry.terraform.io/v1/providers/{source}")
+
+    if response.status_code == 200:
+        versions = json.loads(response.text)["versions"]
+    else:
+        versions = []
 
     result = {
         "status_code": response.status_code,
         "reason": response.reason,
-        "versions": data["versions"]
+        "versions": versions
     }
     
     return result
 
-def get_terraform_versions():
+def get_terraform_versions(transport=None):
     """
     Gets a list of terraform versions.
     """
-    response = requests.get("https://releases.hashicorp.com/terraform")
+    response = get_transport(transport).get("https://releases.hashicorp.com/terraform")
     
     pattern = r'terraform_((\d+)\.*(\d+)*\.*(\d+)*-?([\S]*))</a>'
     versions = re.findall(pattern, response.text)
@@ -410,7 +1021,7 @@ def get_azure_devops_org_project_and_repo(source):
 
     return data
 
-def get_available_versions(target, source=None, exclude_pre_release=False):
+def fetch_available_versions(target, source=None, transport=None):
     """
     Gets a list of available versions based on API calls to various endpoints.
     """
@@ -428,45 +1039,327 @@ def get_available_versions(target, source=None, exclude_pre_release=False):
     # Pull available versions
     if target == "modules" and "github" in source:
         data = get_github_user_and_repo(source)
-        available_versions = get_github_module_versions(data["user"], data["repo"], token=github_token)
+        available_versions = get_github_module_versions(data["user"], data["repo"], token=github_token, transport=transport)
     elif target == "modules" and "dev.azure" in source:
         data = get_azure_devops_org_project_and_repo(source)
-        available_versions = get_azure_devops_module_versions(data["org"], data["project"], data["repo"], token=azure_devops_token)
+        available_versions = get_azure_devops_module_versions(data["org"], data["project"], data["repo"], token=azure_devops_token, transport=transport)
     elif target == "modules":
-        available_versions = get_terraform_module_versions(source)
+        available_versions = get_terraform_module_versions(source, transport=transport)
     elif target == "providers":
-        available_versions = get_terraform_provider_versions(source)
+        available_versions = get_terraform_provider_versions(source, transport=transport)
     elif target == "terraform":
-        available_versions = get_terraform_versions()
+        available_versions = get_terraform_versions(transport=transport)
     else:
         available_versions = None
 
+    return available_versions
+
+def lookup_available_versions(target, source=None, cache=None, transport=None):
+    """
+    Gets a list of available versions from the version cache or, if not cached, from its source.
+    """
+    with span("lookup versions", "versions", target=target, source=source) as lookup_span:
+        available_versions = cache.get(target, source) if cache else None
+
+        if available_versions is None and cache and cache.offline:
+            lookup_span.set(cache="miss", status_code=503)
+            available_versions = {
+                "status_code": 503,
+                "reason": "Not available offline",
+                "versions": []
+            }
+        elif available_versions is None:
+            available_versions = fetch_available_versions(target, source, transport)
+            lookup_span.set(cache="miss" if cache else "disabled", status_code=(available_versions or {}).get("status_code"))
+            if cache:
+                cache.set(target, source, available_versions)
+        else:
+            lookup_span.set(cache="hit", status_code=available_versions["status_code"])
+
+    return available_versions
+
+def get_available_versions(target, source=None, exclude_pre_release=False, cache=None, coalescer=None, transport=None):
+    """
+    Gets a list of available versions, sharing requests for identical sources when a coalescer is provided.
+    """
+    if coalescer:
+        available_versions = coalescer.get(
+            target=target,
+            source=source,
+            lookup=lambda: lookup_available_versions(target, source, cache, transport)
+        )
+    else:
+        available_versions = lookup_available_versions(target, source, cache, transport)
+
     if exclude_pre_release:
         versions = available_versions["versions"]
-        available_versions["versions"] = [version for version in versions if len(get_semantic_version(version)) < 4]
+        available_versions["versions"] = [version for version in versions if parse_version(version) and not parse_version(version).prerelease]
 
     return available_versions
 
+def get_source_host(target, source=None):
+    """
+    Returns the host that serves available versions for a given target and source.
+    """
+    if target == "modules" and "github" in source:
+        host = "api.github.com"
+    elif target == "modules" and "dev.azure" in source:
+        host = "dev.azure.com"
+    elif target in ["modules", "providers"]:
+        host = "registry.terraform.io"
+    elif target == "terraform":
+        host = "releases.hashicorp.com"
+    else:
+        host = None
+
+    return host
+
+def get_request_key(target, source=None):
+    """
+    Returns a key that is the same for all sources that share a list of available versions.
+    """
+    host = get_source_host(target, source)
+
+    try:
+        if host == "api.github.com":
+            data = get_github_user_and_repo(source)
+            source = f'{data["user"]}/{data["repo"]}'
+        elif host == "dev.azure.com":
+            data = get_azure_devops_org_project_and_repo(source)
+            source = f'{data["org"]}/{data["project"]}/{data["repo"]}'
+    except IndexError:
+        pass
+
+    if target == "terraform":
+        source = ""
+
+    key = (target, host, (source or "").lower())
+
+    return key
+
+def get_shard(target, source, count):
+    """
+    Returns the shard, from 1 to count, that a resource belongs to.
+
+    Resources are assigned by a stable hash of the key their available versions are requested with,
+    so every resource with the same source is on the same shard and its versions are only fetched once.
+    """
+    digest = hashlib.sha256(json.dumps(get_request_key(target, source)).encode()).digest()
+
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+def filter_shard(resources, shard):
+    """
+    Returns only the resources that belong to a shard, given as an (index, count) tuple.
+    """
+    index, count = shard
+    filtered = defaultdict(dict)
+
+    for resource_type, dependencies in resources.items():
+        for name, attributes in dependencies.items():
+            if get_shard(attributes["target"], attributes["source"], count) == index:
+                filtered[resource_type][name] = attributes
+
+    return filtered
+
+class RequestCoalescer:
+    """
+    Shares a single request between identical version lookups, including lookups that are still in flight.
+
+    Requests that do go out are limited per host based on host_limits.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.saved = 0
+        self._futures = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def get(self, target, source, lookup):
+        """
+        Returns the result of lookup, calling it at most once per distinct target and source.
+        """
+        key = get_request_key(target, source)
+
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+                self.requests += 1
+                if key[1] not in self._semaphores:
+                    self._semaphores[key[1]] = threading.BoundedSemaphore(host_limits(key[1]))
+            else:
+                self.saved += 1
+
+        if owner:
+            try:
+                with self._semaphores[key[1]]:
+                    future.set_result(lookup())
+            except BaseException as e:
+                future.set_exception(e)
+
+        result = future.result()
+
+        # each caller gets its own copy so results can be filtered independently
+        return dict(result, versions=list(result["versions"]))
+
+    def has(self, target, source):
+        """
+        Returns whether a lookup of the target and source has already been made or primed.
+        """
+        with self._lock:
+            return get_request_key(target, source) in self._futures
+
+    def prime(self, target, source, result):
+        """
+        Stores a result fetched elsewhere, such as a batch request, so later lookups share it.
+        """
+        key = get_request_key(target, source)
+
+        with self._lock:
+            if key not in self._futures:
+                future = self._futures[key] = Future()
+                future.set_result(result)
+
+def prefetch_github_module_versions(resources, coalescer, cache=None, transport=None):
+    """
+    Gets tags for all GitHub modules in as few GraphQL requests as possible and primes the coalescer with them.
+
+    This requires a GitHub token, so without TFMESH_GITHUB_TOKEN the modules are requested one at a time instead.
+    """
+    github_token = os.environ.get("TFMESH_GITHUB_TOKEN", "")
+
+    if not github_token or (cache and cache.offline):
+        return 0
+
+    sources = {}
+    for resource_type, dependencies in resources.items():
+        for name, attributes in dependencies.items():
+            if get_source_host(attributes["target"], attributes["source"]) != "api.github.com":
+                continue
+            if coalescer.has(attributes["target"], attributes["source"]):
+                continue
+            # only checked here, since resolving the module gets it from the cache and counts the hit
+            if cache and cache.has(attributes["target"], attributes["source"]):
+                continue
+            try:
+                data = get_github_user_and_repo(attributes["source"])
+            except IndexError:
+                continue
+            sources.setdefault((data["user"], data["repo"]), []).append(attributes)
+
+    if not sources:
+        return 0
+
+    results = get_github_module_versions_batch(list(sources), token=github_token, transport=transport)
+
+    # failed lookups are left to the REST path so they are retried and reported individually
+    for repository, result in results.items():
+        if result["status_code"] != 200:
+            continue
+        for attributes in sources[repository]:
+            coalescer.prime(attributes["target"], attributes["source"], result)
+            if cache:
+                cache.set(attributes["target"], attributes["source"], result)
+
+    return len(results)
+
+def iter_available_versions(resources, exclude_pre_release=False, parallelism=10, cache=None, coalescer=None, transport=None, wait=None):
+    """
+    Gets available versions for all resources concurrently and yields each resource's key and result in resource order.
+
+    A result is yielded as soon as it and every result before it have resolved, so callers can render
+    while later requests are still running.  When given, wait is called before blocking on a result
+    that has not resolved yet, such as to flush output that is waiting to be written.
+    """
+    if coalescer is None:
+        coalescer = RequestCoalescer()
+
+    with span("get versions"):
+        prefetch_github_module_versions(resources, coalescer, cache=cache, transport=transport)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, parallelism))
+        futures = []
+        for resource_type, dependencies in resources.items():
+            for name, attributes in dependencies.items():
+                futures.append(((resource_type, name), executor.submit(
+                    get_available_versions,
+                    target=attributes["target"],
+                    source=attributes["source"],
+                    exclude_pre_release=exclude_pre_release,
+                    cache=cache,
+                    coalescer=coalescer,
+                    transport=transport
+                )))
+
+    try:
+        for key, future in futures:
+            if not future.done():
+                if wait:
+                    wait()
+                with span("get versions"):
+                    future.result()
+
+            yield key, future.result()
+    finally:
+        # stop requests that have not started if the caller stops early
+        for key, future in futures:
+            future.cancel()
+        executor.shutdown()
+
+def resolve_available_versions(resources, exclude_pre_release=False, parallelism=10, cache=None, coalescer=None, transport=None):
+    """
+    Gets available versions for all resources concurrently using a bounded pool of workers.
+
+    Results are keyed by resource type and name so callers can keep their own output order.
+    """
+    return dict(iter_available_versions(
+        resources,
+        exclude_pre_release=exclude_pre_release,
+        parallelism=parallelism,
+        cache=cache,
+        coalescer=coalescer,
+        transport=transport
+    ))
+
 def get_allowed_versions(available_versions, lower_constraint="", lower_constraint_operator="", upper_constraint="", upper_constraint_operator=""):
     """
     Takes a list of available versions and considers constraints to get a list of allowed versions.
     """
-    if lower_constraint and not lower_constraint_operator:
-        lower_constraint_operator = "="
+    clauses = [(lower_constraint_operator, lower_constraint)]
+    if upper_constraint and upper_constraint_operator:
+        clauses.append((upper_constraint_operator, upper_constraint))
+    constraint = compile_constraint(", ".join(f"{op}{version}" for op, version in clauses if version))
 
-    if lower_constraint and lower_constraint_operator and upper_constraint and upper_constraint_operator:
-        allowed_versions = [version for version in available_versions if compare_versions(get_semantic_version(version), lower_constraint_operator, get_semantic_version(lower_constraint)) and compare_versions(get_semantic_version(version), upper_constraint_operator, get_semantic_version(upper_constraint))]
-    elif lower_constraint and lower_constraint_operator:
-        allowed_versions = [version for version in available_versions if compare_versions(get_semantic_version(version), lower_constraint_operator, get_semantic_version(lower_constraint))]
-    else:
-        # Ensures that pre-release versions are removed if there are no constraints.
-        allowed_versions = [version for version in available_versions if get_semantic_version(version)]
+    # Ensures that strings which are not versions are removed
+    allowed_versions = [version for version in available_versions if parse_version(version) and (constraint is None or any(interval_contains(interval, parse_version(version)) for interval in constraint))]
 
     return allowed_versions
 
+@traced("compile constraints")
+def compile_constraints(resources):
+    """
+    Compiles the constraint of every resource once, before any versions are compared.
+
+    Returns the compiled constraints keyed by resource type and name, and an error for each
+    resource whose constraint is not valid so they can all be reported together.
+    """
+    constraints = {}
+    errors = []
+
+    for resource_type, dependencies in resources.items():
+        for name, attributes in dependencies.items():
+            try:
+                constraints[(resource_type, name)] = compile_constraint(attributes["constraint"])
+            except ConstraintError as e:
+                errors.append(f'{attributes["target"]} "{name}" in {attributes["filename"]}: {e}')
+
+    return constraints, errors
+
 def compare_versions(a, op, b):
     """
-    Takes two tuples and compares them based on valid operations.
+    Takes two Version values (or version tuples) and compares them based on valid operations.
     """
     ops = {
         "<": operator.lt,
@@ -479,7 +1372,9 @@ def compare_versions(a, op, b):
     }
 
     if a and b:
-        if op == "~>":
+        if op == "~>" and isinstance(b, Version):
+            result = a >= b and (b.pessimistic_bound() is None or a < b.pessimistic_bound())
+        elif op == "~>":
             version_length = b[-1]
             if version_length == 2:
                 result = ops[">="](a, b) and ops["<"](a, (b[0]+1, 0, 0))
@@ -515,8 +1410,7 @@ def sort_versions(versions, reverse=True):
     """
     Sorts lists of versions based on the semantic version.  Normal sort does not work because of versions like 1.67.0 vs. 1.9.0.
     """
-    tuple_versions = [get_semantic_version(version) for version in versions]
-    versions = [x for _, x in sorted(zip(tuple_versions, versions), reverse=reverse)]
+    versions = sorted(versions, key=lambda version: (version_key(version), version), reverse=reverse)
 
     return versions
 
@@ -550,21 +1444,32 @@ def get_latest_version(versions):
     Provides the latest version based on a list of provided versions.
     """
     if versions:
-        versions = sort_versions(versions)
-        latest_version = versions[0]
+        latest_version = max(versions, key=lambda version: (version_key(version), version))
     else:
         latest_version = None
 
     return latest_version
 
-def update_version(filepath, code, attribute, value):
+def get_span_edit(data, spans, attribute, value):
     """
-    Reads existing terraform files, updates versions, and saves back.
+    Returns the (start, end, text) edit that sets a version or constraint based on its span within a file.
+    """
+    start, end = spans[attribute]
+
+    # Handle edge case where constraint is added to resource with no current constraint
+    if attribute == "constraint" and start == end and "#" not in data[spans["version"][1]:start] and "#" not in value:
+        start = end = spans["version"][1] + 1
+        value = f' # {value}'
+
+    return start, end, value
+
+def get_code_edit(code, attribute, value):
+    """
+    Returns the code of a resource with its version or constraint set, by matching the code again.
     """
-    #TODO: Rename this function
     patterns = {
         "version": r'(=|")([=!><~]* *[a-zA-Z]?[0-9]+\.[0-9]+\.*[0-9]*(?:-[0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*)?(?:\+[0-9A-Za-z-]+)?)(")',
-        "constraint": r'(" *#+ *)([=!><~(.*)]* *[0-9\.]+ *,* *[=!><~(.*)]* *[0-9\.]+)*()',
+        "constraint": r'(" *#+ *)([=!><~(.*)]* *[0-9\.]+ *,* *[=!><~(.*)]* *[0-9\.]+(?: *, *[=!><~]* *[0-9\.]+)*)*()',
     }
 
     # Handle edge case where constraint is added to resource with no current constraint
@@ -574,19 +1479,177 @@ def update_version(filepath, code, attribute, value):
         if current_constraint == "" and "#" not in value:
             value = f' # {value}'
 
-    # Read in the file
-    with open(filepath, 'r') as f:
-        data = f.read()
-
     # Replace the target string
     new_code = re.sub(patterns[attribute], r'\1__value__\3', code)
     new_code = new_code.replace("__value__", value)
 
-    data = data.replace(code, new_code)
+    return new_code
+
+class EditError(Exception):
+    """
+    Raised when edits cannot be made to Terraform files.  When it is raised, no files have been changed.
+    """
+
+def get_file_edits(data, edits):
+    """
+    Returns the (start, end, text) splices for all edits to the contents of one file, in file order.
+
+    Each edit is a dictionary with the filepath, code, attribute, value and spans of a resource.
+    When the code is still at the same place in the file, only the span for the attribute is
+    replaced.  Otherwise the first copy of the code is matched again to find the value to replace.
+    """
+    splices = []
+
+    for edit in edits:
+        spans = edit.get("spans")
+        if spans and data[spans["code"][0]:spans["code"][1]] == edit["code"]:
+            splices.append(get_span_edit(data, spans, edit["attribute"], edit["value"]))
+        else:
+            start = data.find(edit["code"])
+            if start == -1:
+                raise EditError(f'The {edit["attribute"]} could not be set in {edit["filepath"]} because the code changed after it was read.')
+            splices.append((start, start + len(edit["code"]), get_code_edit(edit["code"], edit["attribute"], edit["value"])))
+
+    splices.sort(key=lambda splice: splice[:2])
+
+    for (start, end, text), (next_start, next_end, next_text) in zip(splices, splices[1:]):
+        if end > next_start:
+            raise EditError(f'Two edits to the same code in {edits[0]["filepath"]} overlap.')
+
+    return splices
+
+def write_temp_file(path, text, mode):
+    """
+    Writes text to a new temporary file next to path and returns its name, so it can replace path atomically.
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_file, mode)
+    except OSError:
+        os.remove(temp_file)
+        raise
+
+    return temp_file
+
+def replace_file(path, text, mode):
+    """
+    Replaces the contents of a file atomically, so it is never left partly written.
+    """
+    temp_file = write_temp_file(path, text, mode)
+
+    try:
+        os.replace(temp_file, path)
+    except OSError:
+        os.remove(temp_file)
+        raise
+
+def write_files(files, backup=False):
+    """
+    Writes the new contents of each file atomically, given a dictionary of filepath to (original, new) contents.
+
+    All files are written to temporary files next to them before any file is replaced, and files
+    that were already replaced are restored atomically if replacing another one fails.  When backup
+    is True, the original contents are kept in a .backup file next to each file, and backups written
+    before a failure are removed (or restored, if one already existed).
+    """
+    temp_files = {}
+    replaced = []
+    modes = {}
+    previous_backups = {}
+
+    try:
+        for filepath, (original, data) in files.items():
+            modes[filepath] = os.stat(filepath).st_mode & 0o7777
+            contents = [(filepath, data)]
+            if backup:
+                backup_path = f"{filepath}.backup"
+                if os.path.exists(backup_path):
+                    with open(backup_path, "r") as f:
+                        previous_backups[backup_path] = (f.read(), os.stat(backup_path).st_mode & 0o7777)
+                contents.append((backup_path, original))
+            for path, text in contents:
+                temp_files[path] = write_temp_file(path, text, modes[filepath])
+
+        # backups are moved into place first, so every replaced file has one
+        for path in sorted(temp_files, key=lambda path: not path.endswith(".backup")):
+            os.replace(temp_files[path], path)
+            del temp_files[path]
+            replaced.append(path)
+    except OSError as e:
+        for temp_file in temp_files.values():
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+
+        unrestored = []
+        for path in reversed(replaced):
+            try:
+                if path in files:
+                    replace_file(path, files[path][0], modes[path])
+                elif path in previous_backups:
+                    replace_file(path, *previous_backups[path])
+                else:
+                    os.remove(path)
+            except OSError:
+                unrestored.append(path)
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(data)
+        if unrestored:
+            raise EditError(f"The changes could not be written ({e}) and {', '.join(unrestored)} could not be restored.") from e
+
+        raise EditError(f"The changes could not be written ({e}).  No files were modified.") from e
+
+@traced("write files")
+def apply_edits(edits, backup=False, fingerprints=None):
+    """
+    Applies a list of edits, reading and writing each file once, and returns the number of files changed.
+
+    Edits are grouped by file and spliced in a single pass.  Every edit is checked before any file
+    is written, so either all files are changed or none are.  When fingerprints are given, a file
+    whose contents no longer match its fingerprint stops all of the edits.
+    """
+    grouped = defaultdict(list)
+    for edit in edits:
+        grouped[edit["filepath"]].append(edit)
+
+    files = {}
+    for filepath, file_edits in grouped.items():
+        try:
+            with open(filepath, "r") as f:
+                original = f.read()
+        except OSError as e:
+            raise EditError(f"{filepath} could not be read ({e}).  No files were modified.") from e
+
+        if fingerprints is not None and get_fingerprint(original) != fingerprints.get(filepath):
+            raise EditError(f"{filepath} has changed since the plan was saved.  Run plan again.  No files were modified.")
+
+        parts = []
+        position = 0
+        for start, end, text in get_file_edits(original, file_edits):
+            parts += [original[position:start], text]
+            position = end
+        parts.append(original[position:])
+
+        files[filepath] = (original, "".join(parts))
+
+    write_files(files, backup)
+
+    return len(files)
+
+def update_version(filepath, code, attribute, value, spans=None, backup=False):
+    """
+    Reads existing terraform files, updates versions, and saves back.
+
+    When spans are provided and the code is still at the same place in the file, only the span for
+    the attribute is replaced.  Otherwise the code is matched again to find the value to replace.
+    """
+    #TODO: Rename this function
+    apply_edits([{"filepath": filepath, "code": code, "attribute": attribute, "value": value, "spans": spans}], backup)
 
 def get_status(current_version, latest_available_version, latest_allowed_version):
     """
@@ -601,9 +1664,9 @@ def get_status(current_version, latest_available_version, latest_allowed_version
     x no suitable version
     ! bug
     """
-    current_version = get_semantic_version(current_version)
-    latest_available_version = get_semantic_version(latest_available_version)
-    latest_allowed_version = get_semantic_version(latest_allowed_version)
+    current_version = parse_version(current_version)
+    latest_available_version = parse_version(latest_available_version)
+    latest_allowed_version = parse_version(latest_allowed_version)
 
     if latest_allowed_version == None:
         status = {
@@ -680,12 +1743,8 @@ def prefix_status(status, string, color=None, no_color=False):
     """
     Makes plan and apply text output to terminal more consistent.
     """
-    index = 0
-    for char in string:
-        if re.match(r'[\S]', char):
-            break
-        else:
-            index += 1
+    # the index of the first character that is not whitespace
+    index = len(string) - len(string.lstrip())
 
     status_length = len(status) + 1
 
@@ -699,18 +1758,158 @@ def prefix_status(status, string, color=None, no_color=False):
 
     return line
 
-def run_plan_apply(terraform_files, patterns, target=[], apply=False, verbose=False, exclude_prerelease=False, ignore_constraints=False, no_color=False):
+class BufferedOutput:
+    """
+    Collects lines of output and writes them to a stream in one go rather than one write per line.
+
+    Output is written when limit characters have been collected and whenever flush is called.
+    """
+    def __init__(self, stream=None, limit=65536):
+        self.stream = stream if stream is not None else sys.stdout
+        self.limit = limit
+        self._parts = []
+        self._size = 0
+
+    def print(self, text=""):
+        """
+        Adds a line of output.
+        """
+        self._parts.append(text)
+        self._parts.append("\n")
+        self._size += len(text) + 1
+
+        if self._size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the collected output to the stream.
+        """
+        if self._parts:
+            self.stream.write("".join(self._parts))
+            self.stream.flush()
+            self._parts = []
+            self._size = 0
+
+def print_plan_header(output, no_color=False):
+    """
+    Prints the key to the symbols used in plan and apply output.
+    """
+    output.print(f'{"" if no_color else colors("OK_GREEN")}')
+    output.print("Resource actions and version statuses are indicated with the following symbols:")
+    output.print('\n')
+    output.print("Actions:")
+    output.print("+: upgraded")
+    output.print("-: downgraded")
+    output.print("~: no change")
+    output.print('\n')
+    output.print("Version status:")
+    output.print("*: latest available version")
+    output.print(".: latest allowed version based on constraints")
+    output.print("x: no suitable version")
+    output.print("!: bug")
+    output.print('\n')
+    output.print("Actions and and versions are used together separated by a forward slash (/) to indicate changes.")
+    output.print("For example, '+/*' would indicate the version will be upgraded to the latest version")
+    output.print('\n')
+    output.print("Terraform Mesh will perform the following actions:")
+    output.print(f'{"" if no_color else colors()}')
+
+def print_plan_resource(output, code, current_version, status, latest_allowed_version, apply=False, no_color=False):
+    """
+    Prints the code of a resource whose version will change, with its status on the line with the version.
+    """
+    # iterate through code
+    for line in pretty_code(code).split('\n'):
+        if current_version in line:
+            output.print(f'{prefix_status(status["symbol"], line, status["color"], no_color)}{"" if no_color else colors(status["color"])} // {status["action"]}{"d" if apply else ""} to {status["status"]} = {latest_allowed_version}{"" if no_color else colors()}')
+        else:
+            output.print(line)
+
+    output.print("\n")
+
+# The attributes of a resource written to its JSON record.  Parser details such as spans are left out
+# so the records do not change when the parser does.
+RECORD_ATTRIBUTES = ["target", "name", "source", "filepath", "version", "constraint"]
+
+def get_resource_record(resource_type, attributes):
+    """
+    Returns the record of a resource with its documented attributes, as written when output is JSON.
+    """
+    return {
+        "type": "resource",
+        "resource_type": resource_type,
+        **{name: attributes.get(name) for name in RECORD_ATTRIBUTES}
+    }
+
+def get_plan_record(resource_type, attributes, request, version_set, constraint, latest_available_version, latest_allowed_version, status, changed):
+    """
+    Returns the record of a resource that is written for it when plan or apply output is JSON.
+    """
+    return {
+        **get_resource_record(resource_type, attributes),
+        "status_code": request["status_code"],
+        "reason": request["reason"],
+        "available_versions": version_set.allowed(),
+        "allowed_versions": version_set.allowed(constraint),
+        "latest_available_version": latest_available_version,
+        "latest_allowed_version": latest_allowed_version,
+        "status": status,
+        "action": status["action"] if changed else "no change"
+    }
+
+def format_json(records, output_format="jsonl"):
+    """
+    Returns records as JSON Lines with one record per line, or as one indented JSON document.
+    """
+    if output_format == "jsonl":
+        return "\n".join(json.dumps(record) for record in (records if isinstance(records, list) else [records]))
+
+    return json.dumps(records, indent=2)
+
+def run_plan_apply(terraform_files, patterns, target=[], apply=False, verbose=False, exclude_prerelease=False, ignore_constraints=False, no_color=False, parallelism=10, cache=None, transport=None, parser="regex", jobs=1, parse_index=None, file_stats=None, backup=False, summary=None, output_format="text", out=None, resources=None, coalescer=None, workspace=None, records=None, shard=None):
     """
     Implements logic to plan and apply updates to resource versions.
+
+    When a summary dictionary is given, it is filled with the number of resources to upgrade, downgrade
+    and leave unchanged, the number that failed and the number of files searched.  When out is given,
+    the plan is saved to it so apply_plan can make the same changes later.
+
+    With an output_format of jsonl, a record is written for every resource as soon as it resolves and
+    a summary record follows them.  With json, the same records are written as one JSON list at the end,
+    or added to records when a list is given.
+
+    Resources that were already parsed, a coalescer shared with other runs and the name of the
+    workspace are given when planning many workspaces at once.  The workspace is shown in place of
+    the symbol key and added to every record.  When a shard is given as (index, count), only the
+    resources that belong to it are planned.
     """
+    output = BufferedOutput()
+    write_json = records is None
+    records = [] if records is None else records
+
+    def write_record(record):
+        if workspace is not None:
+            record = dict(record, workspace=workspace)
+        if output_format == "jsonl":
+            output.print(json.dumps(record))
+        else:
+            records.append(record)
+
+    def write_records():
+        if output_format == "json" and write_json:
+            output.print(format_json(records, output_format))
+
     # get resource attributes
-    resources = get_dependency_attributes(terraform_files, patterns)
+    if resources is None:
+        resources = get_dependency_attributes(terraform_files, patterns, parser, jobs, parse_index)
 
     # limit resources to targets if there are targets
     if target:
         tmp_resources = defaultdict(dict)
         for resource in target:
-            print(f'resource: {resource}')
+            if output_format == "text":
+                output.print(f'resource: {resource}')
             resource_type = resource[0]
             resource_name = resource[1]
 
@@ -719,26 +1918,26 @@ def run_plan_apply(terraform_files, patterns, target=[], apply=False, verbose=Fa
     else:
         pass
 
+    # limit resources to a shard so the work can be split between machines
+    if shard:
+        resources = filter_shard(resources, shard)
+
+    # check every constraint before any versions are requested
+    constraints, errors = compile_constraints(resources)
+    if errors and not ignore_constraints:
+        if output_format == "text":
+            output.print(f'{"" if no_color else colors("FAIL")}{pretty_print(title=f"{len(errors)} resource(s) have a version constraint that is not valid:", options=errors)}{"" if no_color else colors()}')
+        else:
+            write_record({"type": "error", "message": f"{len(errors)} resource(s) have a version constraint that is not valid.", "errors": errors})
+            write_records()
+        output.flush()
+        return None
+
     # print the header text
-    print(f'{"" if no_color else colors("OK_GREEN")}')
-    print("Resource actions and version statuses are indicated with the following symbols:")
-    print('\n')
-    print("Actions:")
-    print("+: upgraded")
-    print("-: downgraded")
-    print("~: no change")
-    print('\n')
-    print("Version status:")
-    print("*: latest available version")
-    print(".: latest allowed version based on constraints")
-    print("x: no suitable version")
-    print("!: bug")
-    print('\n')
-    print("Actions and and versions are used together separated by a forward slash (/) to indicate changes.")
-    print("For example, '+/*' would indicate the version will be upgraded to the latest version")
-    print('\n')
-    print("Terraform Mesh will perform the following actions:")
-    print(f'{"" if no_color else colors()}')
+    if output_format == "text" and workspace is not None:
+        output.print(f'{"" if no_color else colors("OK_GREEN")}Workspace: {workspace}{"" if no_color else colors()}\n')
+    elif output_format == "text":
+        print_plan_header(output, no_color)
 
     # create map for tracking changes
     plan = {
@@ -748,99 +1947,447 @@ def run_plan_apply(terraform_files, patterns, target=[], apply=False, verbose=Fa
     }
 
     failures = 0
-
-    # iterate through resources to get available and allowed versions
-    for resource_type, resources in resources.items():
-        for resource, attributes in resources.items():
-            request = get_available_versions(
-                target=attributes["target"],
-                source=attributes["source"],
-                exclude_pre_release=exclude_prerelease
-            )
-            available_versions = request["versions"]
-            allowed_versions = get_allowed_versions(
-                available_versions,
-                attributes["lower_constraint"],
-                attributes["lower_constraint_operator"],
-                attributes["upper_constraint"],
-                attributes["upper_constraint_operator"],
-            )
-
-            # get the latest versions
+    unchanged = 0
+    edits = []
+    resolved = []
+
+    # get available versions for every resource and render each one as soon as it and the ones before it resolve
+    shared = coalescer is not None
+    if not shared:
+        coalescer = RequestCoalescer()
+    version_requests = iter_available_versions(
+        resources,
+        exclude_pre_release=exclude_prerelease,
+        parallelism=parallelism,
+        cache=cache,
+        coalescer=coalescer,
+        transport=transport,
+        wait=output.flush
+    )
+
+    for (resource_type, resource), request in version_requests:
+        attributes = resources[resource_type][resource]
+
+        # get the latest versions
+        with span("filter versions"):
+            version_set = VersionSet(request["versions"])
             current_version = attributes["version"]
-            latest_available_version = get_latest_version(available_versions)
+            latest_available_version = version_set.latest()
             if ignore_constraints:
                 latest_allowed_version = latest_available_version
             else:
-                latest_allowed_version = get_latest_version(allowed_versions)
+                latest_allowed_version = version_set.latest_matching(constraints[(resource_type, resource)])
 
+        with span("render"):
             # get the status
             status = get_status(current_version, latest_available_version, latest_allowed_version)
+            changed = compare_versions(parse_version(current_version), "!=", parse_version(latest_allowed_version))
 
-            code = pretty_code(attributes["code"])
+            if changed:
+                plan[status["action"]] += 1
 
-            # split code on newlines so it can be output line by line
-            code = code.split('\n')
+                if apply or out:
+                    edits.append({
+                        "filepath": attributes["filepath"],
+                        "code": attributes["code"],
+                        "attribute": "version",
+                        "value": latest_allowed_version,
+                        "spans": attributes["spans"]
+                    })
+            elif request["status_code"] != 200:
+                failures += 1
+            else:
+                unchanged += 1
+
+            if out:
+                resolved.append({
+                    "resource_type": resource_type,
+                    "target": attributes["target"],
+                    "name": attributes["name"],
+                    "source": attributes["source"],
+                    "filepath": attributes["filepath"],
+                    "code": attributes["code"],
+                    "version": current_version,
+                    "constraint": attributes["constraint"],
+                    "status_code": request["status_code"],
+                    "latest_available_version": latest_available_version,
+                    "latest_allowed_version": latest_allowed_version,
+                    "status": status,
+                    "action": status["action"] if changed else "no change"
+                })
+
+            if output_format != "text":
+                write_record(get_plan_record(
+                    resource_type,
+                    attributes,
+                    request,
+                    version_set,
+                    None if ignore_constraints else constraints[(resource_type, resource)],
+                    latest_available_version,
+                    latest_allowed_version,
+                    status,
+                    changed
+                ))
+                continue
 
             # do some stuff is the current version is not the same as the allowed version
-            if compare_versions(get_semantic_version(current_version), "!=", get_semantic_version(latest_allowed_version)):
-                plan[status["action"]] += 1
-
-                # iterate through code
-                for line in code:
-                    if current_version in line:
-                        print(f'{prefix_status(status["symbol"], line, status["color"], no_color)}{"" if no_color else colors(status["color"])} // {status["action"]}{"d" if apply else ""} to {status["status"]} = {latest_allowed_version}{"" if no_color else colors()}')
-                    else:
-                        print(line)
-
-                print("\n")
-                # print("...")
-                # print("\n")
-
-                if apply:
-                    update_version(
-                        filepath=attributes["filepath"],
-                        code=attributes["code"],
-                        attribute="version",
-                        value=latest_allowed_version
-                    )
+            if changed:
+                print_plan_resource(output, attributes["code"], current_version, status, latest_allowed_version, apply, no_color)
+            elif verbose:
+                plan["no change"] += 1
+                if request["status_code"] != 200:
+                    output.print(f'{colors("FAIL")}~/x {colors()}The API call to return versions for {attributes["target"]} "{attributes["name"]}" failed.{colors("FAIL")} // {request["status_code"]} {request["reason"]}.{colors()}\n\n')
                 else:
-                    pass
+                    # split code on newlines so it can be output line by line
+                    code = pretty_code(attributes["code"]).split('\n')
+
+                    # iterate through code
+                    for line in code:
+                        if current_version in line:
+                            output.print(f'{prefix_status(status["symbol"], line, status["color"])}{"" if no_color else colors(status["color"])} // {status["action"]} - {status["status"]}{"" if no_color else colors()}')
+                        else:
+                            output.print(line)
+
+                    output.print("\n")
+
+    counts = {
+        "upgrade": plan["upgrade"],
+        "downgrade": plan["downgrade"],
+        "no change": unchanged,
+        "failure": failures,
+        "files": len(terraform_files)
+    }
+
+    if summary is not None:
+        summary.update(counts)
+
+    # save the plan so it can be applied without getting versions again
+    if out:
+        try:
+            write_plan(out, edits, resolved, counts)
+        except OSError as e:
+            if output_format == "text":
+                output.print(f'{"" if no_color else colors("FAIL")}The plan could not be saved to {out} ({e}).{"" if no_color else colors()}')
             else:
-                if request["status_code"] != 200:
-                    failures += 1
-                if verbose:
-                    plan["no change"] += 1
-                    if request["status_code"] != 200:
-                        print(f'{colors("FAIL")}~/x {colors()}The API call to return versions for {attributes["target"]} "{attributes["name"]}" failed.{colors("FAIL")} // {request["status_code"]} {request["reason"]}.{colors()}\n\n')
-                    else:
-                        # iterate through code
-                        for line in code:
-                            if current_version in line:
-                                print(f'{prefix_status(status["symbol"], line, status["color"])}{"" if no_color else colors(status["color"])} // {status["action"]} - {status["status"]}{"" if no_color else colors()}')
-                            else:
-                                print(line)
-
-                        print("\n")
+                write_record({"type": "error", "message": f"The plan could not be saved to {out} ({e})."})
+                write_records()
+            output.flush()
+            return None
+
+    # write every change at once so a failure part way through leaves no files half updated
+    if apply and edits:
+        try:
+            apply_edits(edits, backup=backup)
+        except EditError as e:
+            if output_format == "text":
+                output.print(f'{"" if no_color else colors("FAIL")}Apply failed!  {e}{"" if no_color else colors()}')
+            else:
+                write_record({"type": "error", "message": f"Apply failed!  {e}"})
+                write_records()
+            output.flush()
+            return None
+
+    if output_format != "text":
+        write_record({
+            "type": "summary",
+            "apply": apply,
+            "upgrade": plan["upgrade"],
+            "downgrade": plan["downgrade"],
+            "no change": unchanged,
+            "failure": failures,
+            "files": len(terraform_files),
+            "requests_saved": 0 if shared else coalescer.saved,
+            **({"plan_file": out} if out else {}),
+            **({"shard": f"{shard[0]}/{shard[1]}"} if shard else {})
+        })
+        write_records()
+        output.flush()
+        return None
 
     if apply:
-        print(f'{"" if no_color else colors("OK_GREEN")}Apply complete!  Resources: {plan["upgrade"]} upgraded, {plan["downgrade"]} downgraded{"" if no_color else colors()}')
+        output.print(f'{"" if no_color else colors("OK_GREEN")}Apply complete!  Resources: {plan["upgrade"]} upgraded, {plan["downgrade"]} downgraded{"" if no_color else colors()}')
     elif plan["no change"] > 0:
-        print(f'{"" if no_color else colors("OK_GREEN")}Plan: {plan["upgrade"]} to upgrade (+), {plan["downgrade"]} to downgrade (-), {plan["no change"]} not to change (~){"" if no_color else colors()}')
+        output.print(f'{"" if no_color else colors("OK_GREEN")}Plan: {plan["upgrade"]} to upgrade (+), {plan["downgrade"]} to downgrade (-), {plan["no change"]} not to change (~){"" if no_color else colors()}')
     elif plan["upgrade"] > 0 or plan["downgrade"] > 0:
-        print(f'{"" if no_color else colors("OK_GREEN")}Plan: {plan["upgrade"]} to upgrade, {plan["downgrade"]} to downgrade{"" if no_color else colors()}')
+        output.print(f'{"" if no_color else colors("OK_GREEN")}Plan: {plan["upgrade"]} to upgrade, {plan["downgrade"]} to downgrade{"" if no_color else colors()}')
     else:
-        print(f'{"" if no_color else colors("OK_GREEN")}No changes.  Dependency versions are up-to-date.{"" if no_color else colors()}')
+        output.print(f'{"" if no_color else colors("OK_GREEN")}No changes.  Dependency versions are up-to-date.{"" if no_color else colors()}')
+
+    if coalescer.saved > 0 and not shared:
+        output.print(f'{coalescer.saved} request(s) saved by sharing or batching lookups of identical sources.')
+
+    if shard:
+        output.print(f'Planned shard {shard[0]} of {shard[1]}.  Run "tfmesh report merge" on the --output json or jsonl results of every shard to combine them.')
+
+    if out:
+        output.print(f'Saved the plan to {out}.  Run "tfmesh apply {out}" to make these changes without getting versions again.')
+
+    if verbose and file_stats:
+        output.print(f'Searched {file_stats["folders"]} folder(s) and found {file_stats["files"]} Terraform file(s).  {file_stats["pruned"]} folder(s) were pruned and {file_stats["ignored"]} path(s) were ignored or excluded.')
 
     if failures >= 1:
-        print(f'\n{"" if no_color else colors("FAIL")}Warning: {failures} resource(s) failed to return a list of available versions.{"" if no_color else colors()}')
+        output.print(f'\n{"" if no_color else colors("FAIL")}Warning: {failures} resource(s) failed to return a list of available versions.{"" if no_color else colors()}')
         if apply:
-            print(f'{"" if no_color else colors("FAIL")}These resources were not modified during apply.{"" if no_color else colors()}')
+            output.print(f'{"" if no_color else colors("FAIL")}These resources were not modified during apply.{"" if no_color else colors()}')
         if not verbose:
-            print(f'{"" if no_color else colors("FAIL")}For more details, run the command again with the "--verbose" flag.{"" if no_color else colors()}')
+            output.print(f'{"" if no_color else colors("FAIL")}For more details, run the command again with the "--verbose" flag.{"" if no_color else colors()}')
+
+    output.flush()
 
     return None
 
+def apply_plan(path, backup=False, no_color=False, summary=None, output_format="text"):
+    """
+    Applies a plan saved by run_plan_apply without finding, parsing or getting versions again.
+
+    Nothing is changed if any file the plan edits has changed since the plan was saved.  When a
+    summary dictionary is given, it is filled with the counts the plan was saved with.
+    """
+    output = BufferedOutput()
+
+    try:
+        plan = read_plan(path)
+    except PlanError as e:
+        if output_format == "text":
+            output.print(f'{"" if no_color else colors("FAIL")}Apply failed!  {e}{"" if no_color else colors()}')
+        else:
+            output.print(format_json([{"type": "error", "message": f"Apply failed!  {e}"}], output_format))
+        output.flush()
+        return None
+
+    # the code of each resource is only saved for the text output
+    records = [{"type": "resource", **{name: value for name, value in resource.items() if name != "code"}} for resource in plan["resources"]]
+
+    if summary is not None:
+        summary.update(plan["summary"])
+
+    if output_format == "text":
+        print_plan_header(output, no_color)
+        for resource in plan["resources"]:
+            if resource["action"] != "no change":
+                print_plan_resource(output, resource["code"], resource["version"], resource["status"], resource["latest_allowed_version"], True, no_color)
+    elif output_format == "jsonl":
+        for record in records:
+            output.print(json.dumps(record))
+        records = []
+
+    # write every change at once so a failure part way through leaves no files half updated
+    try:
+        if plan["edits"]:
+            apply_edits(plan["edits"], backup=backup, fingerprints=plan["files"])
+    except EditError as e:
+        if output_format == "text":
+            output.print(f'{"" if no_color else colors("FAIL")}Apply failed!  {e}{"" if no_color else colors()}')
+        else:
+            output.print(format_json(records + [{"type": "error", "message": f"Apply failed!  {e}"}], output_format))
+        output.flush()
+        return None
+
+    if output_format == "text":
+        output.print(f'{"" if no_color else colors("OK_GREEN")}Apply complete!  Resources: {plan["summary"]["upgrade"]} upgraded, {plan["summary"]["downgrade"]} downgraded{"" if no_color else colors()}')
+        if plan["summary"]["failure"] >= 1:
+            output.print(f'\n{"" if no_color else colors("FAIL")}Warning: {plan["summary"]["failure"]} resource(s) failed to return a list of available versions when the plan was saved.{"" if no_color else colors()}')
+            output.print(f'{"" if no_color else colors("FAIL")}These resources were not modified during apply.{"" if no_color else colors()}')
+    else:
+        output.print(format_json(records + [{"type": "summary", "apply": True, **plan["summary"], "requests_saved": 0, "plan_file": path}], output_format))
+
+    output.flush()
+
+    return None
+
+def get_workspaces(patterns=(), manifest=None, root=None, pruned_folders=PRUNED_FOLDERS):
+    """
+    Returns the sorted absolute paths of the folders matching glob patterns, and the patterns that matched no folder.
+
+    Patterns are relative to root (defaults to the current directory).  A manifest file lists one
+    folder or pattern per line relative to the manifest, ignoring blank lines and lines starting with #.
+    Folders within pruned_folders are left out.
+    """
+    root = Path(root).absolute() if root else Path(os.getcwd())
+    entries = [(root, pattern) for pattern in patterns]
+
+    if manifest:
+        manifest = Path(manifest).absolute()
+        for line in manifest.read_text().splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                entries.append((manifest.parent, line))
+
+    workspaces = set()
+    unmatched = []
+    for folder, pattern in entries:
+        matches = [
+            os.path.abspath(match)
+            for match in glob.glob(os.path.join(folder, pattern), recursive=True)
+            if os.path.isdir(match) and not any(part in pruned_folders for part in Path(os.path.relpath(match, folder)).parts)
+        ]
+        if not matches:
+            unmatched.append(pattern)
+        workspaces.update(matches)
+
+    return sorted(workspaces), unmatched
+
+def run_workspaces_plan(workspaces, patterns, file_pattern='*.tf', exclude=(), pruned_folders=PRUNED_FOLDERS, root=None, verbose=False, exclude_prerelease=False, ignore_constraints=False, no_color=False, parallelism=10, cache=None, transport=None, parser="regex", jobs=1, parse_index=None, summary=None, output_format="text", shard=None):
+    """
+    Plans updates to resource versions for many workspaces (root module folders) at once.
+
+    Files are found for each workspace, and every file is parsed once even when workspaces share
+    it.  Available versions for the union of all their resources are then requested once, in
+    parallel, before each workspace is planned in turn.  A plan is shown for each workspace and
+    the totals for all of them follow.  A summary dictionary, when given, is filled with the totals.
+    When a shard is given as (index, count), only the resources of each workspace that belong to it
+    are planned.
+    """
+    output = BufferedOutput()
+    root = Path(root).absolute() if root else Path(os.getcwd())
+    records = [] if output_format == "json" else None
+    totals = {"upgrade": 0, "downgrade": 0, "no change": 0, "failure": 0, "files": 0}
+    failed = []
+
+    # find the files of every workspace
+    workspace_files = {}
+    for workspace in workspaces:
+        workspace_files[workspace] = get_terraform_files(
+            terraform_folder=workspace,
+            file_pattern=file_pattern,
+            exclude=exclude,
+            pruned_folders=pruned_folders
+        )
+
+    # parse each file once, including files linked into several workspaces
+    real_paths = {terraform_file: os.path.realpath(terraform_file) for terraform_files in workspace_files.values() for terraform_file in terraform_files}
+    unique_files = sorted(set(real_paths.values()))
+    parsed = dict(zip(unique_files, get_file_dependency_lists(unique_files, patterns, parser, jobs, parse_index)))
+
+    workspace_resources = {}
+    union = defaultdict(dict)
+    for workspace, terraform_files in workspace_files.items():
+        workspace_resources[workspace] = merge_dependencies(
+            [dict(dependency, filepath=terraform_file, filename=Path(terraform_file).name) for dependency in parsed[real_paths[terraform_file]]]
+            for terraform_file in terraform_files
+        )
+        if shard:
+            workspace_resources[workspace] = filter_shard(workspace_resources[workspace], shard)
+        for resource_type, dependencies in workspace_resources[workspace].items():
+            for attributes in dependencies.values():
+                union[resource_type][attributes["source"]] = attributes
+
+    # request the versions of every distinct source once, so each workspace shares the results
+    coalescer = RequestCoalescer()
+    resolve_available_versions(
+        union,
+        exclude_pre_release=exclude_prerelease,
+        parallelism=parallelism,
+        cache=cache,
+        coalescer=coalescer,
+        transport=transport
+    )
+
+    # every workspace's lookups are served from the results above, so only the lookups made while
+    # resolving them and the sources that more than one workspace shares were saved
+    workspace_sources = sum(len({(resource_type, attributes["source"]) for resource_type, dependencies in resources.items() for attributes in dependencies.values()}) for resources in workspace_resources.values())
+    requests_saved = coalescer.saved + workspace_sources - sum(len(sources) for sources in union.values())
+
+    if output_format == "text":
+        print_plan_header(output, no_color)
+    output.flush()
+
+    for workspace in workspaces:
+        workspace_summary = {}
+        run_plan_apply(
+            terraform_files=workspace_files[workspace],
+            patterns=patterns,
+            verbose=verbose,
+            exclude_prerelease=exclude_prerelease,
+            ignore_constraints=ignore_constraints,
+            no_color=no_color,
+            parallelism=parallelism,
+            cache=cache,
+            transport=transport,
+            summary=workspace_summary,
+            output_format=output_format,
+            resources=workspace_resources[workspace],
+            coalescer=coalescer,
+            workspace=os.path.relpath(workspace, root),
+            records=records
+        )
+        if not workspace_summary:
+            failed.append(workspace)
+        for name in totals:
+            totals[name] += workspace_summary.get(name, 0)
+        if output_format == "text":
+            output.print("")
+
+    if summary is not None:
+        summary.update(totals)
+
+    if output_format != "text":
+        record = {"type": "summary", "apply": False, "workspaces": len(workspaces), "workspaces_failed": len(failed), **totals, "requests_saved": requests_saved, **({"shard": f"{shard[0]}/{shard[1]}"} if shard else {})}
+        if output_format == "jsonl":
+            output.print(json.dumps(record))
+        else:
+            output.print(format_json(records + [record], output_format))
+        output.flush()
+        return None
+
+    output.print(f'{"" if no_color else colors("OK_GREEN")}All {len(workspaces)} workspace(s): {totals["upgrade"]} to upgrade, {totals["downgrade"]} to downgrade, {totals["no change"]} not to change and {totals["failure"]} failed in {totals["files"]} file(s).{"" if no_color else colors()}')
+    output.print(f'{coalescer.requests} request(s) made for the versions of every workspace and {requests_saved} saved by sharing or batching lookups of identical sources.')
+    if shard:
+        output.print(f'Planned shard {shard[0]} of {shard[1]}.  Run "tfmesh report merge" on the --output json or jsonl results of every shard to combine them.')
+    if failed:
+        output.print(f'{"" if no_color else colors("FAIL")}Warning: {len(failed)} workspace(s) could not be planned: {", ".join(os.path.relpath(workspace, root) for workspace in failed)}.{"" if no_color else colors()}')
+    output.flush()
+
+    return None
+
+def read_records(path):
+    """
+    Reads the records written to a file by --output json or jsonl.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+
+    try:
+        records = json.loads(text)
+    except ValueError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    return records if isinstance(records, list) else [records]
+
+def merge_plan_records(records):
+    """
+    Combines the records of plans run as shards into the resources and totals of a single plan.
+
+    Totals are counted from the resource records the way run_plan_apply counts them, and a resource
+    found in more than one set of results is only counted once.  Returns the resources, the totals
+    and the shards (as INDEX/COUNT) that are missing from the results.
+    """
+    resources = {}
+    shards = set()
+    files = 0
+
+    for record in records:
+        if record.get("type") == "resource":
+            key = (record.get("workspace"), record["resource_type"], record["name"], record["filepath"])
+            resources[key] = record
+        elif record.get("type") == "summary" and "workspace" not in record:
+            files = max(files, record.get("files", 0))
+            if "shard" in record:
+                shards.add(tuple(int(part) for part in record["shard"].split("/")))
+
+    totals = {"upgrade": 0, "downgrade": 0, "no change": 0, "failure": 0, "files": files}
+    for record in resources.values():
+        if record["action"] != "no change":
+            totals[record["action"]] += 1
+        elif record["status_code"] != 200:
+            totals["failure"] += 1
+        else:
+            totals["no change"] += 1
+
+    missing = [f"{index}/{count}" for count in sorted({count for index, count in shards}) for index in range(1, count + 1) if (index, count) not in shards]
+
+    return list(resources.values()), totals, missing
+
 def pretty_code(code, spaces=4, indent_symbols = ("{", "[", "("), outdent_symbols = ("}", "]", ")")):
     """
     Return nicely formated nested code.
@@ -873,11 +2420,11 @@ def pretty_code(code, spaces=4, indent_symbols = ("{", "[", "("), outdent_symbol
         else:
             current_indent = indent
 
-        # use regex to create the newly formatted line
-        pattern = r'^ +(.*)'
-        line_of_code = re.sub(pattern, fr'{" "*current_indent}\1', line)
+        # re-indent lines that start with spaces
+        if line.startswith(" "):
+            line = " "*current_indent + line.lstrip(" ")
 
-        new_code.append(line_of_code)
+        new_code.append(line)
 
     return "\n".join(new_code)
 
@@ -0,0 +1,308 @@
+import re
+from collections import namedtuple
+
+Token = namedtuple("Token", ["kind", "start", "end"])
+Block = namedtuple("Block", ["type", "labels", "start", "end", "attributes", "blocks"])
+Attribute = namedtuple("Attribute", ["name", "start", "end", "value"])
+Value = namedtuple("Value", ["kind", "start", "end", "entries"])
+
+TOKEN = re.compile(r'''
+    (?P<newline>\n)
+    |(?P<space>[ \t\r]+)
+    |(?P<comment>(?:\#|//)[^\n]*|/\*[\s\S]*?(?:\*/|\Z))
+    |(?P<heredoc><<-?[ \t]*(?P<marker>[A-Za-z_][A-Za-z0-9_-]*)[ \t]*(?=\n))
+    |(?P<string>")
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_-]*)
+    |(?P<open>[{\[(])
+    |(?P<close>[}\])])
+    |(?P<equals>=(?![=>]))
+    |(?P<comma>,)
+    |(?P<other>[^\s"{}\[\]()=,\#/A-Za-z_]+|.)
+''', re.VERBOSE)
+
+STRING_PART = re.compile(r'[^"\\$%\n]+|\\.|\$\$\{|%%\{|[$%]\{|[$%]|"|\n')
+
+# This is the same constraint comment syntax that the regex patterns accept after a version string.
+CONSTRAINT = re.compile(r' *#? *(([=!><~(.*)]*) *([0-9\.]*) *,* *([=!><~(.*)]*) *([0-9\.]*)(?: *, *[=!><~]* *[0-9\.]+)*)')
+
+def _heredoc_end(contents, match):
+    """
+    Returns the offset just after the closing marker of the heredoc that starts at match.
+    """
+    marker = re.compile(r'^[ \t]*' + re.escape(match.group("marker")) + r'[ \t]*$', re.MULTILINE)
+    closing = marker.search(contents, match.end() + 1)
+
+    return closing.end() if closing else len(contents)
+
+def _string_end(contents, position):
+    """
+    Returns the offset just after the string literal that starts at position, skipping escapes and templates.
+
+    Strings nested inside template interpolations are tracked on a stack, where None stands for a string and
+    a number for the brace depth of a template, so deeply nested templates cannot exhaust the recursion limit.
+    """
+    stack = [None]
+    index = position + 1
+
+    while index < len(contents):
+        if stack[-1] is None:
+            part = STRING_PART.match(contents, index)
+            text = part.group()
+            if text == '"' or text == "\n":
+                index = part.end() if text == '"' else index
+                stack.pop()
+                if not stack:
+                    return index
+            elif text in ("${", "%{"):
+                stack.append(1)
+                index = part.end()
+            else:
+                index = part.end()
+        else:
+            match = TOKEN.match(contents, index)
+            kind = match.lastgroup
+            index = _heredoc_end(contents, match) if kind == "heredoc" else match.end()
+            if kind == "string":
+                stack.append(None)
+            elif kind == "open" and match.group() == "{":
+                stack[-1] += 1
+            elif kind == "close" and match.group() == "}":
+                stack[-1] -= 1
+                if stack[-1] == 0:
+                    stack.pop()
+
+    return len(contents)
+
+def tokenize(contents, position=0):
+    """
+    Yields tokens from HCL source one at a time, treating strings, heredocs and comments as single tokens.
+
+    Each token has a kind and the start and end offsets of its text within contents.
+    """
+    while position < len(contents):
+        match = TOKEN.match(contents, position)
+        kind = match.lastgroup
+        end = match.end()
+
+        if kind == "string":
+            end = _string_end(contents, position)
+        elif kind == "heredoc":
+            end = _heredoc_end(contents, match)
+
+        if kind != "space":
+            yield Token(kind, position, end)
+
+        position = end
+
+class _Parser:
+    """
+    Builds blocks, attributes and object values from a stream of tokens.
+    """
+    def __init__(self, contents):
+        self.contents = contents
+        self.tokens = tokenize(contents)
+        self.lookahead = None
+
+    def peek(self):
+        if self.lookahead is None:
+            self.lookahead = next(self.tokens, Token("eof", len(self.contents), len(self.contents)))
+        return self.lookahead
+
+    def next(self):
+        token = self.peek()
+        self.lookahead = None
+        return token
+
+    def text(self, token):
+        return self.contents[token.start:token.end]
+
+    def skip_comments(self):
+        while self.peek().kind == "comment":
+            self.next()
+
+    def body(self):
+        """
+        Parses attributes and blocks until the end of the file.
+
+        Nested blocks and object values are kept on an explicit stack instead of being parsed recursively, so
+        deeply nested or unclosed braces cannot exhaust the recursion limit.  Each entry holds the attributes
+        and blocks parsed so far and the owner they are added to when the closing brace (or the end of the file)
+        is reached.
+        """
+        stack = [({}, [], None)]
+
+        while True:
+            token = self.next()
+            attributes, blocks, owner = stack[-1]
+
+            if token.kind in ("newline", "comment", "comma"):
+                continue
+            elif token.kind == "eof" or (owner and token.kind == "close"):
+                if owner is None:
+                    return attributes, blocks
+                stack.pop()
+                if owner[0] == "block":
+                    kind, parent, name, labels, start = owner
+                    parent.append(Block(name, labels, start, token.end, attributes, blocks))
+                else:
+                    kind, parent, name, start, value_start = owner
+                    parent[name] = Attribute(name, start, token.end, Value("object", value_start, token.end, attributes))
+                continue
+            elif token.kind not in ("ident", "string"):
+                self.rest_of_line()
+                continue
+
+            self.skip_comments()
+            if self.peek().kind == "equals" or self.text(self.peek()) == ":":
+                self.next()
+                name = self.text(token).strip('"')
+                self.skip_comments()
+                first = self.peek()
+                if first.kind == "open" and self.text(first) == "{":
+                    self.next()
+                    stack.append(({}, [], ("object", attributes, name, token.start, first.start)))
+                else:
+                    value = self.expression()
+                    attributes[name] = Attribute(name, token.start, value.end, value)
+                continue
+
+            labels = []
+            while self.peek().kind in ("ident", "string"):
+                label = self.next()
+                labels.append((self.text(label).strip('"'), label.start + 1, label.end - 1))
+                self.skip_comments()
+
+            if self.peek().kind == "open" and self.text(self.peek()) == "{":
+                self.next()
+                stack.append(({}, [], ("block", blocks, self.text(token), labels, token.start)))
+            else:
+                self.rest_of_line()
+
+    def expression(self):
+        """
+        Parses a value other than an object up to the end of its line, recognising strings.
+        """
+        first = self.peek()
+
+        depth = 0
+        end = first.start
+        count = 0
+        while True:
+            token = self.peek()
+            if token.kind == "eof":
+                break
+            if depth == 0 and (token.kind in ("newline", "comma", "comment") or token.kind == "close"):
+                break
+            self.next()
+            count += 1
+            end = token.end
+            if token.kind == "open":
+                depth += 1
+            elif token.kind == "close":
+                depth -= 1
+
+        kind = "string" if count == 1 and first.kind == "string" else "expression"
+
+        return Value(kind, first.start, end, None)
+
+    def rest_of_line(self):
+        """
+        Skips tokens up to the end of the line, keeping track of nested brackets.
+        """
+        depth = 0
+        while True:
+            token = self.peek()
+            if token.kind == "eof" or (depth == 0 and token.kind == "newline"):
+                return
+            if depth == 0 and token.kind == "close":
+                return
+            self.next()
+            if token.kind == "open":
+                depth += 1
+            elif token.kind == "close":
+                depth -= 1
+
+def parse(contents):
+    """
+    Parses HCL source and returns its top level attributes and blocks.
+    """
+    return _Parser(contents).body()
+
+def _string_value(contents, attributes, name):
+    """
+    Returns the content and content offsets of a string attribute, or None if it is not a string.
+    """
+    attribute = attributes.get(name)
+
+    if attribute is None or attribute.value.kind != "string":
+        return None
+
+    start, end = attribute.value.start + 1, attribute.value.end - 1
+
+    return contents[start:end], start, end
+
+def _dependency(contents, code_start, code_end, name, source, version, version_start, version_end):
+    """
+    Builds the dependency groups and spans for a version string followed by an optional constraint comment.
+
+    When code_end is None, the code ends with the constraint comment.
+    """
+    constraint = CONSTRAINT.match(contents, version_end + 1)
+    code_end = constraint.end() if code_end is None else code_end
+
+    result = (contents[code_start:code_end], name, source, version) + constraint.groups()
+    spans = {
+        "code": (code_start, code_end),
+        "version": (version_start, version_end),
+        "constraint": constraint.span(1),
+    }
+
+    return result, spans
+
+def find_dependencies(contents, targets=("terraform", "providers", "modules")):
+    """
+    Returns the versioned terraform, provider and module dependencies in HCL source.
+
+    Each dependency is a (target, result, spans) tuple where result holds the same groups as the regex
+    patterns and spans holds the offsets of the code, version and constraint within contents.
+    """
+    attributes, blocks = parse(contents)
+    dependencies = {target: [] for target in targets}
+
+    for block in blocks:
+        if block.type == "terraform":
+            version = _string_value(contents, block.attributes, "required_version")
+            if version and "terraform" in dependencies:
+                dependencies["terraform"].append(
+                    _dependency(contents, block.start, None, "terraform", "terraform", *version)
+                )
+
+            for required_providers in block.blocks:
+                if required_providers.type != "required_providers" or "providers" not in dependencies:
+                    continue
+                for name, attribute in required_providers.attributes.items():
+                    if attribute.value.kind != "object":
+                        continue
+                    source = _string_value(contents, attribute.value.entries, "source")
+                    version = _string_value(contents, attribute.value.entries, "version")
+                    if source and version:
+                        dependencies["providers"].append(
+                            _dependency(contents, attribute.start, attribute.end, name, source[0], *version)
+                        )
+
+        elif block.type == "module" and block.labels and "modules" in dependencies:
+            name = block.labels[0][0]
+            source = _string_value(contents, block.attributes, "source")
+            version = _string_value(contents, block.attributes, "version")
+
+            if source and "?ref=" in source[0]:
+                index = source[0].index("?ref=")
+                dependencies["modules"].append(
+                    _dependency(contents, block.start, block.end, name, source[0][:index], source[0][index + 5:], source[1] + index + 5, source[2])
+                )
+            elif source and version:
+                dependencies["modules"].append(
+                    _dependency(contents, block.start, block.end, name, source[0], *version)
+                )
+
+    return [(target, result, spans) for target in targets for result, spans in dependencies[target]]
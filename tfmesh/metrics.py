@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+
+# Upper bounds in seconds of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ACTIONS = ("upgrade", "downgrade", "no change", "failure")
+
+def get_metrics(tracer, summary, workspace=""):
+    """
+    Returns the metrics for one plan or apply from its summary and the spans its tracer collected.
+    """
+    requests = {}
+    hits = 0
+    misses = 0
+
+    for event in tracer.events:
+        if event["cat"] == "http":
+            seconds = event["dur"] / 1000000
+            host = requests.setdefault(event["args"].get("host") or "", {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+            host["count"] += 1
+            host["sum"] += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    host["buckets"][index] += 1
+        elif event["cat"] == "versions" and event["args"].get("cache") == "hit":
+            hits += 1
+        elif event["cat"] == "versions" and event["args"].get("cache") == "miss":
+            misses += 1
+
+    timings = tracer.timings()
+
+    return {
+        "workspace": workspace,
+        "resources": {action: summary.get(action, 0) for action in ACTIONS},
+        "requests": requests,
+        "cache": {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0
+        },
+        "files_scanned": summary.get("files", 0),
+        "parse_seconds": timings.get("parse files", [0, 0.0])[1],
+        "duration_seconds": timings.get("total", [0, 0.0])[1]
+    }
+
+def _labels(**labels):
+    """
+    Returns labels in the OpenMetrics format with their values escaped.
+    """
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for name, value in labels.items()}
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+def format_openmetrics(metrics):
+    """
+    Returns metrics in the OpenMetrics text format, which the node exporter textfile collector can read.
+    """
+    workspace = metrics["workspace"]
+    lines = [
+        "# TYPE tfmesh_resources gauge",
+        "# HELP tfmesh_resources Resources by the action planned for their version.",
+    ]
+    for action, count in metrics["resources"].items():
+        lines.append(f'tfmesh_resources{_labels(workspace=workspace, action=action)} {count}')
+
+    lines += [
+        "# TYPE tfmesh_http_requests counter",
+        "# HELP tfmesh_http_requests Requests made for available versions.",
+    ]
+    for host, request in sorted(metrics["requests"].items()):
+        lines.append(f'tfmesh_http_requests_total{_labels(workspace=workspace, host=host)} {request["count"]}')
+
+    lines += [
+        "# TYPE tfmesh_http_request_duration_seconds histogram",
+        "# HELP tfmesh_http_request_duration_seconds Time taken by requests made for available versions.",
+    ]
+    for host, request in sorted(metrics["requests"].items()):
+        for bound, count in zip(LATENCY_BUCKETS, request["buckets"]):
+            lines.append(f'tfmesh_http_request_duration_seconds_bucket{_labels(workspace=workspace, host=host, le=repr(float(bound)))} {count}')
+        lines.append(f'tfmesh_http_request_duration_seconds_bucket{_labels(workspace=workspace, host=host, le="+Inf")} {request["count"]}')
+        lines.append(f'tfmesh_http_request_duration_seconds_count{_labels(workspace=workspace, host=host)} {request["count"]}')
+        lines.append(f'tfmesh_http_request_duration_seconds_sum{_labels(workspace=workspace, host=host)} {request["sum"]}')
+
+    lines += [
+        "# TYPE tfmesh_cache_lookups counter",
+        "# HELP tfmesh_cache_lookups Version lookups by whether the version cache had them.",
+        f'tfmesh_cache_lookups_total{_labels(workspace=workspace, result="hit")} {metrics["cache"]["hits"]}',
+        f'tfmesh_cache_lookups_total{_labels(workspace=workspace, result="miss")} {metrics["cache"]["misses"]}',
+        "# TYPE tfmesh_cache_hit_ratio gauge",
+        "# HELP tfmesh_cache_hit_ratio Share of version lookups the version cache had.",
+        f'tfmesh_cache_hit_ratio{_labels(workspace=workspace)} {metrics["cache"]["hit_ratio"]}',
+        "# TYPE tfmesh_files_scanned gauge",
+        "# HELP tfmesh_files_scanned Terraform files searched for versioned resources.",
+        f'tfmesh_files_scanned{_labels(workspace=workspace)} {metrics["files_scanned"]}',
+        "# TYPE tfmesh_parse_seconds gauge",
+        "# HELP tfmesh_parse_seconds Time taken to parse Terraform files.",
+        f'tfmesh_parse_seconds{_labels(workspace=workspace)} {metrics["parse_seconds"]}',
+        "# TYPE tfmesh_duration_seconds gauge",
+        "# HELP tfmesh_duration_seconds Time taken by the whole command.",
+        f'tfmesh_duration_seconds{_labels(workspace=workspace)} {metrics["duration_seconds"]}',
+        "# EOF",
+    ]
+
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path, metrics, metrics_format="openmetrics"):
+    """
+    Writes metrics to a file as OpenMetrics text or JSON.
+
+    The file is replaced atomically so a collector never reads a partly written file.
+    """
+    if metrics_format == "json":
+        text = json.dumps(metrics, indent=2) + "\n"
+    else:
+        text = format_openmetrics(metrics)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w") as f:
+            f.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,201 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Paths served by the fake registry, which are the real request paths prefixed with the real host.
+ROUTES = [
+    ("providers", re.compile(r'/registry\.terraform\.io/v1/providers/([^/]+/[^/]+)')),
+    ("modules", re.compile(r'/registry\.terraform\.io/v1/modules/([^/]+/[^/]+/[^/]+)')),
+    ("terraform", re.compile(r'/releases\.hashicorp\.com/terraform/?')),
+    ("github", re.compile(r'/api\.github\.com/repos/([^/]+/[^/]+)/tags')),
+    ("graphql", re.compile(r'/api\.github\.com/graphql')),
+    ("azure_devops", re.compile(r'/dev\.azure\.com/([^/]+/[^/]+)/_apis/git/repositories/([^/]+)/refs')),
+]
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Answers requests for the fake registry that owns the server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.registry.handle(self, "GET")
+
+    def do_POST(self):
+        self.server.registry.handle(self, "POST")
+
+    def log_message(self, *args):
+        pass
+
+class FakeRegistry:
+    """
+    A local HTTP server that stands in for the Terraform Registry, the Terraform releases listing,
+    GitHub (tags and GraphQL) and Azure DevOps, so plan and apply can run without the internet.
+
+    Every source has tag_count versions, generated from the source so they are the same in every
+    run.  Each request waits latency seconds (plus up to jitter seconds), and fails with a 500 at
+    error_rate.  Requests are counted by host in requests.
+    """
+    def __init__(self, latency=0, jitter=0, error_rate=0, tag_count=50, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tag_count = tag_count
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The base url of the server, which request urls are rewritten to by RedirectTransport.
+        """
+        host, port = self._server.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def versions(self, source):
+        """
+        Returns the versions for a source, oldest first, with a pre-release before every tenth release.
+        """
+        generator = random.Random(zlib.crc32(source.encode()))
+        versions = []
+        major, minor, patch = generator.randint(0, 3), 0, 0
+
+        while len(versions) < self.tag_count:
+            if len(versions) % 10 == 9:
+                versions.append(f"{major}.{minor + 1}.0-beta{generator.randint(1, 3)}")
+            else:
+                versions.append(f"{major}.{minor}.{patch}")
+            step = generator.random()
+            if step < 0.05:
+                major, minor, patch = major + 1, 0, 0
+            elif step < 0.3:
+                minor, patch = minor + 1, 0
+            else:
+                patch += 1
+
+        return versions[:self.tag_count]
+
+    def handle(self, request, method):
+        """
+        Routes a request to the matching endpoint and writes the response.
+        """
+        url = urlsplit(request.path)
+        host = url.path.strip("/").split("/")[0]
+
+        with self._lock:
+            self.requests[host] += 1
+            failed = self._random.random() < self.error_rate
+            delay = self.latency + self._random.random() * self.jitter
+
+        time.sleep(delay)
+
+        body = request.rfile.read(int(request.headers.get("Content-Length") or 0)) if method == "POST" else b""
+        route, match = next(((name, regex.fullmatch(url.path)) for name, regex in ROUTES if regex.fullmatch(url.path)), (None, None))
+
+        if failed:
+            self._respond(request, 500, "Internal Server Error")
+        elif route is None or (route == "graphql") != (method == "POST"):
+            self._respond(request, 404, "Not Found")
+        elif route in ["providers", "modules"]:
+            self._respond(request, 200, json.dumps({"versions": self.versions(match.group(1))}))
+        elif route == "terraform":
+            links = "".join(f'<a href="/terraform/{version}/">terraform_{version}</a>\n' for version in reversed(self.versions("terraform")))
+            self._respond(request, 200, f"<html><body><ul>\n{links}</ul></body></html>", "text/html")
+        elif route == "github":
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            per_page = int(parse_qs(url.query).get("per_page", ["30"])[0])
+            tags = list(reversed(self.versions(match.group(1))))
+            headers = {}
+            if page * per_page < len(tags):
+                headers["Link"] = f'<https://api.github.com/repos/{match.group(1)}/tags?per_page={per_page}&page={page + 1}>; rel="next"'
+            self._respond(request, 200, json.dumps([{"name": f"v{tag}"} for tag in tags[(page - 1) * per_page:page * per_page]]), headers=headers)
+        elif route == "graphql":
+            self._respond(request, 200, json.dumps({"data": self._graphql(json.loads(body)["variables"])}))
+        else:
+            tags = self.versions(f"{match.group(1)}/{match.group(2)}")
+            self._respond(request, 200, json.dumps({"value": [{"name": f"refs/tags/v{tag}"} for tag in tags]}))
+
+    def _graphql(self, variables):
+        """
+        Answers an aliased query for the tags of many repositories, 100 tags per page.
+        """
+        data = {}
+
+        for index in range(len(variables) // 3):
+            tags = list(reversed(self.versions(f'{variables[f"owner{index}"]}/{variables[f"name{index}"]}')))
+            start = int(variables[f"cursor{index}"] or 0)
+            data[f"r{index}"] = {
+                "refs": {
+                    "nodes": [{"name": f"v{tag}"} for tag in tags[start:start + 100]],
+                    "pageInfo": {"hasNextPage": start + 100 < len(tags), "endCursor": str(start + 100)},
+                }
+            }
+
+        return data
+
+    def _respond(self, request, status_code, text, content_type="application/json", headers=None):
+        """
+        Writes a response with the given status code and body.
+        """
+        body = text.encode()
+        request.send_response(status_code)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+class RedirectTransport:
+    """
+    Wraps a transport so every request goes to a fake registry, keeping the real host as the first part of the path.
+    """
+    def __init__(self, url, transport):
+        self.url = url.rstrip("/")
+        self.transport = transport
+
+    def _redirect(self, url):
+        return re.sub(r'^https?://', f"{self.url}/", url)
+
+    def get(self, url, headers=None):
+        return self.transport.get(self._redirect(url), headers=headers)
+
+    def post(self, url, body, headers=None):
+        return self.transport.post(self._redirect(url), body, headers=headers)
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,212 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Arguments that spans take from the span they are opened within, so an http request is tagged with the source it was made for.
+INHERITED_ARGS = ("target", "source")
+
+class Span:
+    """
+    A timed section of work that is recorded by its tracer when it ends.
+    """
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        """
+        Adds arguments to the span, such as the status code of a request once it is known.
+        """
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        for parent in reversed(stack):
+            for name in INHERITED_ARGS:
+                if name in parent.args and name not in self.args:
+                    self.args[name] = parent.args[name]
+        stack.append(self)
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter()
+        self.tracer._stack().pop()
+        self.tracer._record(self, end)
+
+        return False
+
+class _NullSpan:
+    """
+    The span returned while tracing is disabled, which does nothing.
+    """
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Tracer:
+    """
+    Collects spans from every thread and reports them as a timings table or a Chrome trace.
+
+    Spans with the phase category are the steps of a command (finding files, parsing, fetching
+    versions and so on) and are summed by name for the timings table.  Every span is written to
+    the trace, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        return stack
+
+    def _record(self, span, end):
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": round((span.start - self.origin) * 1000000, 3),
+            "dur": round((end - span.start) * 1000000, 3),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": span.args
+        }
+
+        with self._lock:
+            self.events.append(event)
+
+    def span(self, name, category="phase", **args):
+        """
+        Returns a span to time a with block.
+        """
+        return Span(self, name, category, args)
+
+    def timings(self):
+        """
+        Returns the number of calls and total seconds of each phase, in the order the phases first started.
+        """
+        timings = defaultdict(lambda: [0, 0.0])
+
+        for event in sorted(self.events, key=lambda event: event["ts"]):
+            if event["cat"] == "phase":
+                timings[event["name"]][0] += 1
+                timings[event["name"]][1] += event["dur"] / 1000000
+
+        return dict(timings)
+
+    def requests(self):
+        """
+        Returns the number of http requests, total seconds and bytes received for each host.
+        """
+        requests = defaultdict(lambda: [0, 0.0, 0])
+
+        for event in self.events:
+            if event["cat"] == "http":
+                request = requests[event["args"].get("host")]
+                request[0] += 1
+                request[1] += event["dur"] / 1000000
+                request[2] += event["args"].get("bytes", 0)
+
+        return dict(requests)
+
+    def write(self, path):
+        """
+        Writes every span to a file in the Chrome trace event format.
+        """
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+_tracer = None
+
+def span(name, category="phase", **args):
+    """
+    Returns a span from the active tracer, or a span that does nothing when tracing is disabled.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+
+    return _tracer.span(name, category, **args)
+
+def traced(name, category="phase"):
+    """
+    Decorates a function so each call is a span while tracing is enabled.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return f(*args, **kwargs)
+
+            with _tracer.span(name, category):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def get_tracer():
+    """
+    Returns the active tracer, or None when tracing is disabled.
+    """
+    return _tracer
+
+@contextmanager
+def tracing(tracer):
+    """
+    Makes a tracer the active tracer for the duration of a with block.
+    """
+    global _tracer
+
+    previous, _tracer = _tracer, tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+
+def format_timings(tracer):
+    """
+    Returns a table of the time spent in each phase and the http requests made to each host.
+    """
+    timings = tracer.timings()
+    requests = tracer.requests()
+    total = timings.get("total", [1, 0.0])[1] or 1
+    width = max([len(name) for name in list(timings) + [host or "" for host in requests]] + [5])
+
+    lines = [f'{"phase":<{width}}  {"calls":>6}  {"time":>11}  {"share":>6}']
+    for name, (calls, seconds) in timings.items():
+        lines.append(f'{name:<{width}}  {calls:>6}  {seconds * 1000:>8.1f} ms  {seconds / total:>6.1%}')
+
+    if requests:
+        lines.append("")
+        lines.append(f'{"host":<{width}}  {"calls":>6}  {"time":>11}  {"bytes":>10}')
+        for host, (calls, seconds, size) in sorted(requests.items(), key=lambda request: str(request[0])):
+            lines.append(f'{host or "":<{width}}  {calls:>6}  {seconds * 1000:>8.1f} ms  {size:>10}')
+
+    return "\n".join(lines)
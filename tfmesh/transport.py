@@ -0,0 +1,122 @@
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+from tfmesh.trace import span
+
+Response = namedtuple("Response", ["status_code", "reason", "text", "headers"])
+
+class Transport:
+    """
+    A shared HTTP transport with pooled keep-alive connections, timeouts and conditional requests.
+
+    When a validator store is provided, responses with an ETag or Last-Modified header are kept
+    and later requests for the same url are revalidated so unchanged responses come back as 304s.
+
+    requests is only imported when the first request is sent, so commands that never use the
+    network do not pay for importing it.
+    """
+    def __init__(self, connect_timeout=5, read_timeout=30, pool_size=10, validators=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.validators = validators
+        self.pool_size = pool_size
+        self._session = None
+        self._errors = ()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        The pooled requests session, created when it is first used.
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    session.headers["Accept-Encoding"] = "gzip, deflate"
+
+                    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+
+                    self._errors = requests.exceptions.RequestException
+                    self._session = session
+
+        return self._session
+
+    def get(self, url, headers=None):
+        """
+        Sends a GET request and returns a Response, revalidating a stored response when possible.
+        """
+        headers = dict(headers or {})
+        stored = self.validators.get_response(url) if self.validators else None
+
+        if stored:
+            if stored["etag"]:
+                headers["If-None-Match"] = stored["etag"]
+            if stored["last_modified"]:
+                headers["If-Modified-Since"] = stored["last_modified"]
+
+        with span("GET", "http", host=urlsplit(url).hostname, url=url) as request_span:
+            session = self.session
+            try:
+                response = session.get(url, headers=headers, timeout=self.timeout)
+            except self._errors as e:
+                request_span.set(status_code=599, bytes=0, cache="miss")
+                return Response(599, f"Network error ({type(e).__name__})", "", {})
+
+            request_span.set(status_code=response.status_code, bytes=len(response.content), cache="hit" if response.status_code == 304 and stored else "miss")
+
+        if response.status_code == 304 and stored:
+            return Response(200, "OK (not modified)", stored["body"], dict(stored["headers"], **response.headers))
+
+        if response.status_code == 200 and self.validators:
+            etag = response.headers.get("ETag", "")
+            last_modified = response.headers.get("Last-Modified", "")
+            if etag or last_modified:
+                self.validators.set_response(url, etag, last_modified, response.text, dict(response.headers))
+
+        return Response(response.status_code, response.reason, response.text, dict(response.headers))
+
+    def post(self, url, body, headers=None):
+        """
+        Sends a POST request with the given body and returns a Response.
+        """
+        with span("POST", "http", host=urlsplit(url).hostname, url=url) as request_span:
+            session = self.session
+            try:
+                response = session.post(url, data=body, headers=headers, timeout=self.timeout)
+            except self._errors as e:
+                request_span.set(status_code=599, bytes=0, cache="miss")
+                return Response(599, f"Network error ({type(e).__name__})", "", {})
+
+            request_span.set(status_code=response.status_code, bytes=len(response.content), cache="miss")
+
+        return Response(response.status_code, response.reason, response.text, dict(response.headers))
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self._session is not None:
+            self._session.close()
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+def get_transport(transport=None):
+    """
+    Returns the given transport or a lazily created transport shared by the whole process.
+    """
+    global _default_transport
+
+    if transport:
+        return transport
+
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+
+    return _default_transport
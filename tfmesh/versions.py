@@ -0,0 +1,306 @@
+import re
+import bisect
+import functools
+from collections import namedtuple
+
+VERSION = re.compile(r'(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-?([0-9A-Za-z][0-9A-Za-z.-]*))?(?:\+[0-9A-Za-z.-]*)?')
+PRERELEASE_PART = re.compile(r'\d+|[^\d.]+')
+
+# Releases rank above all of their pre-releases, whose parts are (0, number) or (1, text).
+RELEASE = ((2,),)
+
+def _prerelease_key(prerelease):
+    """
+    Returns a sort key for a pre-release where numeric parts compare as numbers and rank below text parts.
+    """
+    if not prerelease:
+        return RELEASE
+
+    return tuple((0, int(part)) if part.isdigit() else (1, part) for part in PRERELEASE_PART.findall(prerelease))
+
+class Version:
+    """
+    An immutable semantic version that compares by a key computed once when it is created.
+
+    The release is packed into a single integer so most comparisons are one integer comparison.
+    Pre-releases rank below their release (1.3.0-alpha20220622 < 1.3.0) and build metadata is
+    ignored.  length is the number of release components given (1.1 has two), which the
+    pessimistic constraint operator uses.
+    """
+    __slots__ = ("string", "major", "minor", "patch", "prerelease", "length", "key")
+
+    def __init__(self, major, minor=0, patch=0, prerelease="", length=3, string=None):
+        object.__setattr__(self, "major", major)
+        object.__setattr__(self, "minor", minor)
+        object.__setattr__(self, "patch", patch)
+        object.__setattr__(self, "prerelease", prerelease)
+        object.__setattr__(self, "length", length)
+        object.__setattr__(self, "string", string or f"{major}.{minor}.{patch}{'-' + prerelease if prerelease else ''}")
+        object.__setattr__(self, "key", (major << 128 | minor << 64 | patch, _prerelease_key(prerelease)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return (type(self), (self.major, self.minor, self.patch, self.prerelease, self.length, self.string))
+
+    def __repr__(self):
+        return f"Version({self.string!r})"
+
+    def __str__(self):
+        return self.string
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == other.key if isinstance(other, Version) else NotImplemented
+
+    def __ne__(self, other):
+        return self.key != other.key if isinstance(other, Version) else NotImplemented
+
+    def __lt__(self, other):
+        return self.key < other.key if isinstance(other, Version) else NotImplemented
+
+    def __le__(self, other):
+        return self.key <= other.key if isinstance(other, Version) else NotImplemented
+
+    def __gt__(self, other):
+        return self.key > other.key if isinstance(other, Version) else NotImplemented
+
+    def __ge__(self, other):
+        return self.key >= other.key if isinstance(other, Version) else NotImplemented
+
+    def pessimistic_bound(self):
+        """
+        Returns the version that ~> this version allows up to but not including (2.0.0 for 1.1 and 1.2.0 for 1.1.0).
+
+        ~> with only a major version allows any later version, so there is no bound and None is returned.
+        """
+        if self.length == 1:
+            bound = None
+        elif self.length == 2:
+            bound = Version(self.major + 1, 0, 0)
+        else:
+            bound = Version(self.major, self.minor + 1, 0)
+
+        return bound
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    """
+    Returns the Version found in a string such as v1.2.3 or 1.3.0-alpha20220622, or None when there is none.
+
+    Results are cached, so each distinct string is only parsed once and always returns the same Version.
+    """
+    match = VERSION.search(version or "")
+
+    if match is None:
+        return None
+
+    major, minor, patch, prerelease = match.groups()
+    length = 3 if patch is not None else 2 if minor is not None else 1
+
+    return Version(int(major), int(minor or 0), int(patch or 0), prerelease or "", length, version)
+
+# Strings that are not versions sort below every version.
+UNPARSED_KEY = (-1, ())
+
+def version_key(version):
+    """
+    Returns the sort key for a version string.
+    """
+    parsed = parse_version(version)
+
+    return parsed.key if parsed else UNPARSED_KEY
+
+# A range of versions, where a lower or upper bound of None is unbounded.
+Interval = namedtuple("Interval", ["lower", "lower_inclusive", "upper", "upper_inclusive"])
+
+ANY = Interval(None, False, None, False)
+
+def clause_intervals(operator, version):
+    """
+    Returns the intervals allowed by a single constraint clause such as >= 1.0.0 or ~> 1.1.
+    """
+    if operator in ("", "="):
+        intervals = [Interval(version, True, version, True)]
+    elif operator == "!=":
+        intervals = [Interval(None, False, version, False), Interval(version, False, None, False)]
+    elif operator == "<":
+        intervals = [Interval(None, False, version, False)]
+    elif operator == "<=":
+        intervals = [Interval(None, False, version, True)]
+    elif operator == ">":
+        intervals = [Interval(version, False, None, False)]
+    elif operator == ">=":
+        intervals = [Interval(version, True, None, False)]
+    elif operator == "~>":
+        intervals = [Interval(version, True, version.pessimistic_bound(), False)]
+    else:
+        raise ValueError(f'"{operator}" is not a valid version constraint operator.')
+
+    return intervals
+
+def intersect_intervals(a, b):
+    """
+    Returns the sorted intervals that are in both of two sorted lists of intervals.
+    """
+    intervals = []
+
+    for x in a:
+        for y in b:
+            if x.lower is None or (y.lower is not None and (y.lower, not y.lower_inclusive) > (x.lower, not x.lower_inclusive)):
+                lower, lower_inclusive = y.lower, y.lower_inclusive
+            else:
+                lower, lower_inclusive = x.lower, x.lower_inclusive
+            if x.upper is None or (y.upper is not None and (y.upper, y.upper_inclusive) < (x.upper, x.upper_inclusive)):
+                upper, upper_inclusive = y.upper, y.upper_inclusive
+            else:
+                upper, upper_inclusive = x.upper, x.upper_inclusive
+
+            if lower is not None and upper is not None and (lower > upper or (lower == upper and not (lower_inclusive and upper_inclusive))):
+                continue
+            intervals.append(Interval(lower, lower_inclusive, upper, upper_inclusive))
+
+    intervals.sort(key=lambda interval: UNPARSED_KEY if interval.lower is None else interval.lower.key)
+
+    return intervals
+
+def interval_contains(interval, version):
+    """
+    Returns True when a Version is within an interval.
+    """
+    if interval.lower is not None and (version < interval.lower or (version == interval.lower and not interval.lower_inclusive)):
+        return False
+    if interval.upper is not None and (version > interval.upper or (version == interval.upper and not interval.upper_inclusive)):
+        return False
+
+    return True
+
+class ConstraintError(ValueError):
+    """
+    Raised when a version constraint cannot be compiled.
+    """
+
+OPERATORS = ("=", "!=", ">", ">=", "<", "<=", "~>")
+
+CLAUSE = re.compile(r' *([=!><~]*) *v?(\d+(?:\.\d+){0,2}(?:-[0-9A-Za-z.-]+)?(?:\+[0-9A-Za-z.-]+)?) *')
+
+@functools.lru_cache(maxsize=None)
+def compile_constraint(constraint):
+    """
+    Compiles a constraint string such as ">=3.0.0, <4.0.0, !=3.5.0" or "~>1.1" into a sorted tuple of intervals.
+
+    Clauses are separated by commas and all of them must be met, so != clauses leave holes in the
+    intervals.  An empty constraint returns None, which allows every version.  Results are cached by
+    string and a ConstraintError is raised when a clause or operator is not valid.
+    """
+    if not constraint or not constraint.strip():
+        return None
+
+    intervals = [ANY]
+
+    for clause in constraint.split(","):
+        match = CLAUSE.fullmatch(clause)
+        if match is None:
+            raise ConstraintError(f'"{constraint}" is not a valid version constraint.  "{clause.strip()}" must be an operator followed by a version with up to three parts (e.g. >=1.0.0).')
+
+        operator, version = match.groups()
+        if operator and operator not in OPERATORS:
+            raise ConstraintError(f'"{constraint}" is not a valid version constraint.  "{operator}" must be one of {", ".join(OPERATORS)}.')
+
+        intervals = intersect_intervals(intervals, clause_intervals(operator, parse_version(version)))
+
+    return tuple(intervals)
+
+class VersionSet:
+    """
+    A list of available versions, sorted once so it can be searched by bisection.
+
+    Constraints are given as sorted intervals, such as those from compile_constraint, and None
+    allows every version.  Finding the latest version within a constraint takes O(log n) per
+    interval, and listing allowed versions takes O(log n) plus the number returned.  Strings that
+    are not versions are left out.
+    """
+    def __init__(self, versions):
+        entries = sorted((parsed.key, version, parsed) for version, parsed in ((version, parse_version(version)) for version in versions) if parsed)
+
+        self._versions = [version for key, version, parsed in entries]
+        self._keys = [key for key, version, parsed in entries]
+        self._releases = [version for key, version, parsed in entries if not parsed.prerelease]
+        self._release_keys = [key for key, version, parsed in entries if not parsed.prerelease]
+        self._strings = frozenset(self._versions)
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __iter__(self):
+        return reversed(self._versions)
+
+    def __contains__(self, version):
+        return version in self._strings
+
+    def _ranges(self, constraint, exclude_prerelease):
+        """
+        Returns the versions and the (start, end) slice of them within each interval of a constraint, lowest first.
+        """
+        versions, keys = (self._releases, self._release_keys) if exclude_prerelease else (self._versions, self._keys)
+        ranges = []
+
+        for interval in (constraint if constraint is not None else [ANY]):
+            if interval.lower is None:
+                start = 0
+            elif interval.lower_inclusive:
+                start = bisect.bisect_left(keys, interval.lower.key)
+            else:
+                start = bisect.bisect_right(keys, interval.lower.key)
+
+            if interval.upper is None:
+                end = len(keys)
+            elif interval.upper_inclusive:
+                end = bisect.bisect_right(keys, interval.upper.key)
+            else:
+                end = bisect.bisect_left(keys, interval.upper.key)
+
+            if start < end:
+                ranges.append((start, end))
+
+        return versions, ranges
+
+    def latest(self, exclude_prerelease=False):
+        """
+        Returns the latest version, or None when there are none.
+        """
+        return self.latest_matching(None, exclude_prerelease)
+
+    def latest_matching(self, constraint, exclude_prerelease=False):
+        """
+        Returns the latest version allowed by a constraint, or None when no version is allowed.
+        """
+        versions, ranges = self._ranges(constraint, exclude_prerelease)
+
+        return versions[max(end for start, end in ranges) - 1] if ranges else None
+
+    def allowed(self, constraint=None, top=None, exclude_prerelease=False):
+        """
+        Returns the versions allowed by a constraint, latest first, limited to the top n when top is given.
+
+        As with the list slicing this replaces, a top of 0 returns every version and a negative top
+        leaves out that many of the oldest.
+        """
+        versions, ranges = self._ranges(constraint, exclude_prerelease)
+        limit = top if top and top > 0 else None
+        allowed = []
+
+        for start, end in sorted(ranges, reverse=True):
+            if limit is not None:
+                start = max(start, end - (limit - len(allowed)))
+            allowed += reversed(versions[start:end])
+            if limit is not None and len(allowed) >= limit:
+                break
+
+        return allowed[:top] if top and top < 0 else allowed